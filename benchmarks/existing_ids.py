@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""Compare ways of finding which IDs of an incoming page are already stored.
+
+* ``set``        — get_activity_ids() once, then set membership per page
+                   (what sync.py did before filter_new_ids)
+* ``in``         — filter_new_ids(): ``WHERE id IN (...)`` per page
+* ``temp-table`` — insert the page into a temp table and anti-join
+
+Each database is filled with N activities; every strategy then checks a
+number of 200-ID pages, half stored and half new. Startup time (the set
+load) is reported separately from the per-page cost.
+"""
+import os
+import random
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+
+import click
+
+from strava.db import filter_new_ids, get_activity_ids, init_db
+
+PAGE_SIZE = 200
+
+
+def _fill(db_path: str, rows: int) -> None:
+    init_db(db_path)
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.executemany(
+            "INSERT INTO activities (id, name, start_date) VALUES (?, ?, ?)",
+            ((i * 2, f"Activity {i}", "2024-01-01T00:00:00Z") for i in range(rows)),
+        )
+    conn.close()
+
+
+def _pages(rows: int, count: int, rng: random.Random) -> list[list[int]]:
+    # Even IDs are stored, odd ones are not.
+    return [
+        [rng.randrange(rows) * 2 + (i % 2) for i in range(PAGE_SIZE)] for _ in range(count)
+    ]
+
+
+def _temp_table_filter(conn: sqlite3.Connection, ids: list[int]) -> list[int]:
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS page_ids (id INTEGER PRIMARY KEY)")
+    conn.execute("DELETE FROM page_ids")
+    conn.executemany("INSERT OR IGNORE INTO page_ids (id) VALUES (?)", ((i,) for i in ids))
+    new = {
+        row[0]
+        for row in conn.execute(
+            "SELECT p.id FROM page_ids p WHERE NOT EXISTS (SELECT 1 FROM activities a WHERE a.id = p.id)"
+        )
+    }
+    return [i for i in ids if i in new]
+
+
+def _measure(fn) -> tuple[float, int]:
+    """Return (seconds, peak traced bytes); timed separately since tracing slows the run."""
+    started = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+@click.command()
+@click.option("--sizes", default="10000,100000,1000000", show_default=True, help="Comma-separated row counts")
+@click.option("--pages", default=50, show_default=True, help="Pages checked per strategy")
+def main(sizes: str, pages: int) -> None:
+    """Benchmark existence checks for incoming activity pages."""
+    rng = random.Random(0)
+    click.echo(f"{'rows':>9} {'strategy':<11} {'startup ms':>10} {'per page ms':>11} {'peak MiB':>9}")
+    for rows in (int(s) for s in sizes.split(",")):
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, "bench.db")
+            _fill(db_path, rows)
+            page_list = _pages(rows, pages, rng)
+            conn = sqlite3.connect(db_path)
+
+            state: dict = {}
+            startup, peak = _measure(lambda: state.update(ids=get_activity_ids(conn)))
+            per_page, _ = _measure(
+                lambda: [[i for i in page if i not in state["ids"]] for page in page_list]
+            )
+            results = {"set": (startup, per_page / pages, peak)}
+            del state["ids"]
+
+            per_page, peak = _measure(lambda: [filter_new_ids(conn, page) for page in page_list])
+            results["in"] = (0.0, per_page / pages, peak)
+
+            per_page, peak = _measure(lambda: [_temp_table_filter(conn, page) for page in page_list])
+            results["temp-table"] = (0.0, per_page / pages, peak)
+            conn.close()
+
+            for name, (startup, page_cost, peak) in results.items():
+                click.echo(
+                    f"{rows:>9} {name:<11} {startup * 1000:>10.1f} {page_cost * 1000:>11.3f} "
+                    f"{peak / 2**20:>9.1f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
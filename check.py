@@ -3,12 +3,19 @@ import os
 
 import click
 
-from strava.client import refresh_access_token
+from strava.client import get_activities
+from strava.db import init_db
+from strava.tokens import TokenManager
 
 
 @click.command()
-def main() -> None:
-    """Check that all required Strava environment variables are set and the API is reachable."""
+@click.option("--db", default="strava.db", show_default=True, help="Path to SQLite database")
+def main(db: str) -> None:
+    """Check that all required Strava environment variables are set and the API is reachable.
+
+    The access token comes from the token store shared with sync.py and the
+    webhook server, so the check refreshes it only when it is about to expire.
+    """
     failures = 0
 
     def check(label: str, ok: bool, message: str = "") -> bool:
@@ -32,11 +39,16 @@ def main() -> None:
     ok_refresh_token = check("STRAVA_REFRESH_TOKEN is set", bool(refresh_token))
 
     if ok_client_id and ok_client_secret and ok_access_token and ok_refresh_token:
+        init_db(db)
+        tokens = TokenManager(db, client_id, client_secret)
+        tokens.seed(access_token, refresh_token)
         try:
-            refresh_access_token(client_id, client_secret, refresh_token)
+            tokens.call(lambda token: get_activities(token, per_page=1))
             check("Strava API is reachable", True)
         except Exception as e:
             check("Strava API is reachable", False, str(e))
+        finally:
+            tokens.close()
 
     if failures == 0:
         click.echo("All checks passed.")
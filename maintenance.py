@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+import os
+
+import click
+
+from strava.athletes import list_athletes, register_athlete
+from strava.compression import FORMATS, RawCodec, decode_raw, set_write_codec, train_dictionary
+from strava.db import connect, init_db, rebuild_aggregates, recompress_activities
+
+_DICT_SAMPLE_SIZE = 500
+
+
+def _raw_json_bytes(conn) -> int:
+    return conn.execute(
+        "SELECT COALESCE(SUM(length(CAST(raw_json AS BLOB))), 0) FROM activities"
+    ).fetchone()[0]
+
+
+@click.group()
+def cli() -> None:
+    """Maintenance commands for the activities database."""
+
+
+@cli.command()
+@click.option("--db", default="strava.db", show_default=True, help="Path to SQLite database")
+@click.option(
+    "--format",
+    "format_",
+    type=click.Choice(FORMATS),
+    default="zlib",
+    show_default=True,
+    help="Target raw_json encoding (zstd requires the zstandard package)",
+)
+@click.option(
+    "--dictionary/--no-dictionary",
+    default=True,
+    show_default=True,
+    help="Train a shared compression dictionary from stored activities",
+)
+@click.option("--batch-size", default=500, show_default=True, help="Rows rewritten per transaction")
+@click.option("--vacuum", is_flag=True, help="VACUUM afterwards so the file actually shrinks")
+def compress(db: str, format_: str, dictionary: bool, batch_size: int, vacuum: bool) -> None:
+    """Switch raw_json to FORMAT and re-encode all stored activities in batches.
+
+    New writes from sync.py and the webhook server use the new format as soon
+    as this command starts; existing rows are converted batch by batch and
+    the command can be interrupted and re-run at any time. ``--format json``
+    decompresses everything again.
+    """
+    init_db(db)
+    conn = connect(db)
+    codec = RawCodec(format_)
+    if format_ != "json" and dictionary:
+        rows = conn.execute(
+            "SELECT raw_json, raw_format FROM activities WHERE raw_json IS NOT NULL "
+            "ORDER BY id DESC LIMIT ?",
+            (_DICT_SAMPLE_SIZE,),
+        ).fetchall()
+        samples = [decode_raw(conn, raw, raw_format).encode() for raw, raw_format in rows]
+        try:
+            codec = RawCodec(format_, train_dictionary(format_, samples))
+            click.echo(f"Slovník {codec.dict_id} natrénován z {len(samples)} aktivit.")
+        except Exception as e:  # e.g. too few samples for the zstd trainer
+            click.echo(f"Slovník se nepodařilo natrénovat ({e}), komprimuji bez něj.")
+
+    before = _raw_json_bytes(conn)
+    set_write_codec(conn, codec)
+    rewritten = recompress_activities(
+        conn,
+        codec,
+        batch_size=batch_size,
+        progress=lambda n: click.echo(f"\rPřekódováno {n} aktivit...", nl=False),
+    )
+    if rewritten:
+        click.echo()
+    after = _raw_json_bytes(conn)
+    ratio = before / after if after else 1.0
+    click.echo(
+        f"Hotovo: {rewritten} aktivit překódováno, raw_json {before / 2**20:.1f} MiB → "
+        f"{after / 2**20:.1f} MiB ({ratio:.1f}×)."
+    )
+    if vacuum:
+        click.echo("Spouštím VACUUM...")
+        conn.execute("VACUUM")
+    conn.close()
+
+
+@cli.command("rebuild-aggregates")
+@click.option("--db", default="strava.db", show_default=True, help="Path to SQLite database")
+def rebuild_aggregates_command(db: str) -> None:
+    """Recompute the agg_weekly and agg_monthly rollups from all activities.
+
+    Triggers keep the rollups current on every write; this repairs them if
+    they ever drift, e.g. after manual edits with recursive triggers off.
+    """
+    init_db(db)
+    conn = connect(db)
+    rebuild_aggregates(conn)
+    weeks = conn.execute("SELECT COUNT(*) FROM agg_weekly").fetchone()[0]
+    months = conn.execute("SELECT COUNT(*) FROM agg_monthly").fetchone()[0]
+    click.echo(f"Hotovo: {weeks} týdenních a {months} měsíčních souhrnů.")
+    conn.close()
+
+
+@cli.command("add-athlete")
+@click.option("--db", default="strava.db", show_default=True, help="Path to SQLite database")
+@click.option("--athlete-id", type=int, required=True, help="Strava athlete ID")
+@click.option("--access-token", required=True, help="The athlete's current access token")
+@click.option("--refresh-token", required=True, help="The athlete's current refresh token")
+@click.option("--name", default=None, help="Display name")
+def add_athlete(db: str, athlete_id: int, access_token: str, refresh_token: str, name: str | None) -> None:
+    """Register an athlete for ``sync.py --all-athletes``.
+
+    Application credentials come from STRAVA_CLIENT_ID and STRAVA_CLIENT_SECRET.
+    """
+    init_db(db)
+    register_athlete(
+        db,
+        os.environ["STRAVA_CLIENT_ID"],
+        os.environ["STRAVA_CLIENT_SECRET"],
+        athlete_id,
+        access_token,
+        refresh_token,
+        name=name,
+    )
+    conn = connect(db)
+    click.echo(f"Sportovec {athlete_id} zaregistrován ({len(list_athletes(conn))} aktivních).")
+    conn.close()
+
+
+if __name__ == "__main__":
+    cli()
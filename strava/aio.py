@@ -0,0 +1,224 @@
+import asyncio
+from collections.abc import AsyncIterator, Iterable
+
+import aiohttp
+
+from strava.client import STRAVA_API, _auth_headers
+from strava.ratelimit import RateLimiter
+from strava.retry import RetryCounters, RetryPolicy, parse_retry_after
+from strava.tokens import TokenManager
+
+DEFAULT_CONCURRENCY = 16
+DEFAULT_TIMEOUT = 30.0
+
+
+class AsyncStravaClient:
+    """asyncio counterpart of :class:`strava.client.StravaClient` built on aiohttp.
+
+    A semaphore bounds the number of requests in flight, so hundreds of detail
+    fetches can be scheduled at once without opening hundreds of sockets. An
+    optional RateLimiter is consulted before every call exactly like in the
+    blocking client; its SQLite work runs in a thread so the event loop never
+    blocks on it. Transient failures are retried with the same RetryPolicy.
+
+    Use as an async context manager::
+
+        async with AsyncStravaClient(concurrency=20) as client:
+            async for activity in client.iter_activity_details(token, ids):
+                ...
+    """
+
+    def __init__(
+        self,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        timeout: float = DEFAULT_TIMEOUT,
+        rate_limiter: RateLimiter | None = None,
+        base_url: str = STRAVA_API,
+        retry_policy: RetryPolicy | None = None,
+    ) -> None:
+        """Configure the client; the HTTP session is opened on ``__aenter__``.
+
+        Args:
+            concurrency: Maximum number of requests in flight at once.
+            timeout: Total timeout per request in seconds.
+            rate_limiter: Optional scheduler that paces calls within Strava's budgets.
+            base_url: API root, overridable for tests against a local server.
+            retry_policy: Retry behaviour for transient failures; defaults to RetryPolicy().
+        """
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter
+        self.base_url = base_url.rstrip("/")
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.retry_counters = RetryCounters()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._session: aiohttp.ClientSession | None = None
+
+    async def __aenter__(self) -> "AsyncStravaClient":
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.concurrency),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        """Close the underlying aiohttp session."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _acquire(self) -> None:
+        limiter = self.rate_limiter
+        while limiter is not None:
+            delay = await asyncio.to_thread(limiter.reserve_token)
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+    def retry_metrics(self) -> dict[str, dict[str, int]]:
+        """Return per-endpoint retry counters, e.g. ``{"activity": {"retries": 2, "gave_up": 0}}``."""
+        return self.retry_counters.snapshot()
+
+    async def _get(
+        self, path: str, endpoint: str, access_token: str, params: dict | None = None
+    ):
+        """GET ``base_url + path`` within the concurrency and rate budgets and decode the JSON body.
+
+        Connection errors, timeouts and retryable statuses are retried per the
+        RetryPolicy; *endpoint* labels the call in the retry counters.
+        """
+        if self._session is None:
+            raise RuntimeError("AsyncStravaClient must be used as an async context manager")
+        policy = self.retry_policy
+        limiter = self.rate_limiter
+        async with self._semaphore:
+            attempt = 0
+            while True:
+                attempt += 1
+                await self._acquire()
+                try:
+                    async with self._session.get(
+                        f"{self.base_url}{path}",
+                        headers=_auth_headers(access_token),
+                        params=params,
+                    ) as resp:
+                        if limiter is not None:
+                            await asyncio.to_thread(limiter.update, resp.headers)
+                        if resp.status in policy.retry_statuses and attempt >= policy.max_attempts:
+                            self.retry_counters.record_give_up(endpoint)
+                        if resp.status not in policy.retry_statuses or attempt >= policy.max_attempts:
+                            resp.raise_for_status()
+                            return await resp.json()
+                        status, headers = resp.status, resp.headers
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                    if attempt >= policy.max_attempts:
+                        self.retry_counters.record_give_up(endpoint)
+                        raise
+                    self.retry_counters.record_retry(endpoint)
+                    await asyncio.sleep(policy.delay(attempt - 1))
+                    continue
+
+                self.retry_counters.record_retry(endpoint)
+                retry_after = parse_retry_after(headers.get("Retry-After"))
+                if status == 429 and limiter is not None:
+                    # The limiter's next reservation already waits for the window reset.
+                    await asyncio.to_thread(limiter.exhaust, headers)
+                    delay = retry_after or 0.0
+                else:
+                    delay = policy.delay(attempt - 1, retry_after)
+                await asyncio.sleep(delay)
+
+    async def get_activities(
+        self,
+        access_token: str,
+        page: int = 1,
+        per_page: int = 200,
+        after: int | None = None,
+        before: int | None = None,
+    ) -> list[dict]:
+        """Fetch a paginated list of the authenticated athlete's activities.
+
+        Args:
+            access_token: Valid Strava OAuth access token.
+            page: Page number to fetch (1-based).
+            per_page: Number of activities per page (max 200).
+            after: Optional Unix timestamp; only activities after this time are returned.
+            before: Optional Unix timestamp; only activities before this time are returned.
+
+        Returns:
+            List of activity dicts as returned by the Strava API.
+        """
+        params: dict[str, int] = {"page": page, "per_page": per_page}
+        if after is not None:
+            params["after"] = after
+        if before is not None:
+            params["before"] = before
+        return await self._get("/athlete/activities", "activities", access_token, params)
+
+    async def get_activity(self, access_token: str, activity_id: int) -> dict:
+        """Fetch a single activity by ID from the Strava API.
+
+        Args:
+            access_token: Valid Strava OAuth access token.
+            activity_id: Numeric Strava activity ID.
+
+        Returns:
+            Activity detail dict as returned by the Strava API.
+        """
+        return await self._get(f"/activities/{activity_id}", "activity", access_token)
+
+    async def iter_activity_details(
+        self,
+        access_token: str | TokenManager,
+        activity_ids: Iterable[int],
+        missing: list[int] | None = None,
+    ) -> AsyncIterator[dict]:
+        """Fetch many activity details concurrently, yielding each one as soon as it arrives.
+
+        Results come back in completion order, not request order, so the caller
+        can persist them while the remaining fetches are still in flight. An
+        activity answered with 404 (deleted or made private since it was
+        listed) is skipped without disturbing the other fetches.
+
+        Args:
+            access_token: Valid Strava OAuth access token, or a TokenManager;
+                with a manager each request takes the current token when it
+                starts and retries once on 401, so a long run survives the
+                token expiring half-way.
+            activity_ids: IDs of the activities to fetch.
+            missing: If given, the IDs answered with 404 are appended to it.
+
+        Yields:
+            Activity detail dicts.
+        """
+        if isinstance(access_token, TokenManager):
+            tokens = access_token
+
+            def get(activity_id: int):
+                return tokens.call_async(lambda token: self.get_activity(token, activity_id))
+        else:
+            def get(activity_id: int):
+                return self.get_activity(access_token, activity_id)
+
+        async def fetch(activity_id: int) -> dict | None:
+            try:
+                return await get(activity_id)
+            except aiohttp.ClientResponseError as e:
+                if e.status != 404:
+                    raise
+                if missing is not None:
+                    missing.append(activity_id)
+                return None
+
+        tasks = [asyncio.ensure_future(fetch(activity_id)) for activity_id in activity_ids]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                activity = await next_done
+                if activity is not None:
+                    yield activity
+        finally:
+            for task in tasks:
+                task.cancel()
@@ -0,0 +1,312 @@
+import json
+import logging
+import sqlite3
+from collections.abc import Iterable
+
+try:
+    import numpy
+except ImportError:  # optional: pip install .[analytics]
+    numpy = None
+
+from strava.db import get_streams
+
+logger = logging.getLogger(__name__)
+
+# Fastest time over these distances (metres), stored as effort_<name> in seconds.
+BEST_EFFORT_DISTANCES = {"1k": 1000.0, "5k": 5000.0, "10k": 10000.0}
+# Highest average power over these durations (seconds), stored as power_<n>s in watts.
+POWER_CURVE_DURATIONS = (1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+# Lower bounds (bpm) of heart rate zones 1-5, stored as hr_zone_<n> in seconds.
+DEFAULT_HR_ZONES = (0, 115, 135, 155, 175)
+# A recording gap longer than this (seconds) is a pause, not time spent at the last value.
+MAX_SAMPLE_GAP = 10
+
+_LOWER_IS_BETTER = "effort_"
+_HIGHER_IS_BETTER = "power_"
+
+
+def _require_numpy() -> None:
+    if numpy is None:
+        raise RuntimeError("analytics require the numpy package: pip install .[analytics]")
+
+
+def best_efforts(time, distance, distances: dict[str, float] = BEST_EFFORT_DISTANCES) -> dict:
+    """Return the fastest time needed to cover each of *distances*.
+
+    For every sample a binary search over the cumulative distance stream
+    finds the first sample at least the target distance further on; the
+    shortest of those time differences is the best effort.
+
+    Args:
+        time: Seconds since start, one value per sample.
+        distance: Cumulative distance in metres, one value per sample.
+        distances: ``{name: metres}`` to compute.
+
+    Returns:
+        ``{"effort_<name>": seconds}``; None where the activity is too short.
+    """
+    _require_numpy()
+    t = numpy.asarray(time, dtype=float)
+    d = numpy.asarray(distance, dtype=float)
+    efforts = {}
+    for name, target in distances.items():
+        end = numpy.searchsorted(d, d + target)
+        valid = end < len(d)
+        efforts[f"effort_{name}"] = (
+            float((t[end[valid]] - t[valid]).min()) if valid.any() else None
+        )
+    return efforts
+
+
+def power_curve(time, watts, durations: Iterable[int] = POWER_CURVE_DURATIONS) -> dict:
+    """Return the mean-max power curve: the best average power held for each duration.
+
+    The power stream is resampled to one value per second (each sample held
+    until the next, pauses longer than :data:`MAX_SAMPLE_GAP` count as 0 W),
+    then every window average comes from differences of one cumulative sum.
+
+    Args:
+        time: Seconds since start, one value per sample.
+        watts: Power in watts, one value per sample.
+        durations: Window lengths in seconds.
+
+    Returns:
+        ``{"power_<n>s": watts}``; None for durations longer than the activity.
+    """
+    _require_numpy()
+    t = numpy.asarray(time, dtype=numpy.int64)
+    w = numpy.asarray(watts, dtype=float)
+    seconds = numpy.arange(t[0], t[-1] + 1)
+    sample = numpy.searchsorted(t, seconds, side="right") - 1
+    per_second = w[sample]
+    per_second[seconds - t[sample] > MAX_SAMPLE_GAP] = 0.0
+    total = numpy.concatenate(([0.0], numpy.cumsum(per_second)))
+    curve = {}
+    for duration in durations:
+        if duration > len(per_second):
+            curve[f"power_{duration}s"] = None
+            continue
+        curve[f"power_{duration}s"] = float((total[duration:] - total[:-duration]).max() / duration)
+    return curve
+
+
+def hr_zone_times(time, heartrate, zones: tuple[float, ...] = DEFAULT_HR_ZONES) -> dict:
+    """Return the time spent in each heart rate zone.
+
+    Each sample's interval to the next sample is attributed to the zone of
+    its heart rate. Samples without a reading (0) and pauses longer than
+    :data:`MAX_SAMPLE_GAP` are not counted.
+
+    Args:
+        time: Seconds since start, one value per sample.
+        heartrate: Heart rate in bpm, one value per sample.
+        zones: Ascending lower bounds of the zones in bpm.
+
+    Returns:
+        ``{"hr_zone_<n>": seconds}`` for zones numbered from 1.
+    """
+    _require_numpy()
+    t = numpy.asarray(time, dtype=float)
+    hr = numpy.asarray(heartrate, dtype=float)[:-1]
+    dt = numpy.diff(t)
+    counted = (hr > 0) & (dt <= MAX_SAMPLE_GAP)
+    zone = numpy.searchsorted(zones, hr[counted], side="right") - 1
+    seconds = numpy.bincount(numpy.maximum(zone, 0), weights=dt[counted], minlength=len(zones))
+    return {f"hr_zone_{n + 1}": float(seconds[n]) for n in range(len(zones))}
+
+
+def compute_metrics(streams: dict, zones: tuple[float, ...] = DEFAULT_HR_ZONES) -> dict:
+    """Compute every derived metric the available *streams* allow.
+
+    Args:
+        streams: NumPy streams from ``get_streams(..., as_numpy=True)``.
+        zones: Heart rate zone lower bounds for :func:`hr_zone_times`.
+
+    Returns:
+        Flat ``{metric: value}`` dict; empty without a time stream.
+    """
+    time = streams.get("time")
+    if time is None or len(time) < 2:
+        return {}
+    metrics: dict = {}
+    if "distance" in streams:
+        metrics.update(best_efforts(time, streams["distance"]))
+    if "watts" in streams:
+        metrics.update(power_curve(time, streams["watts"]))
+    if "heartrate" in streams:
+        metrics.update(hr_zone_times(time, streams["heartrate"], zones))
+    return metrics
+
+
+def _is_better(metric: str, value: float, current: float) -> bool:
+    if metric.startswith(_LOWER_IS_BETTER):
+        return value < current
+    return value > current
+
+
+def _rebuild_best(conn: sqlite3.Connection, athlete_id: int, metric: str) -> None:
+    """Recompute one all-time best from the cached metrics of all the athlete's activities."""
+    order = "ASC" if metric.startswith(_LOWER_IS_BETTER) else "DESC"
+    row = conn.execute(
+        f"""
+        SELECT activity_id, json_extract(metrics, '$.{metric}') AS value FROM derived_metrics
+        WHERE athlete_id = ? AND value IS NOT NULL
+        ORDER BY value {order} LIMIT 1
+        """,
+        (athlete_id,),
+    ).fetchone()
+    if row is None:
+        conn.execute(
+            "DELETE FROM athlete_bests WHERE athlete_id = ? AND metric = ?", (athlete_id, metric)
+        )
+        return
+    _set_best(conn, athlete_id, metric, row[1], row[0])
+
+
+def _set_best(
+    conn: sqlite3.Connection, athlete_id: int, metric: str, value: float, activity_id: int
+) -> None:
+    conn.execute(
+        """
+        INSERT INTO athlete_bests (athlete_id, metric, value, activity_id)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(athlete_id, metric) DO UPDATE SET
+            value = excluded.value, activity_id = excluded.activity_id
+        """,
+        (athlete_id, metric, value, activity_id),
+    )
+
+
+def _update_bests(conn: sqlite3.Connection, athlete_id: int, activity_id: int, metrics: dict) -> None:
+    """Fold one activity's new metrics into the athlete's all-time bests."""
+    current = {
+        metric: (value, holder)
+        for metric, value, holder in conn.execute(
+            "SELECT metric, value, activity_id FROM athlete_bests WHERE athlete_id = ?",
+            (athlete_id,),
+        )
+    }
+    tracked = {
+        metric
+        for metric in set(metrics) | set(current)
+        if metric.startswith((_LOWER_IS_BETTER, _HIGHER_IS_BETTER))
+    }
+    for metric in tracked:
+        value = metrics.get(metric)
+        best = current.get(metric)
+        if value is not None and (best is None or _is_better(metric, value, best[0])):
+            _set_best(conn, athlete_id, metric, value, activity_id)
+        elif best is not None and best[1] == activity_id and value != best[0]:
+            # The record holder got worse (e.g. an edit trimmed it): look again.
+            _rebuild_best(conn, athlete_id, metric)
+
+
+def rebuild_athlete_bests(conn: sqlite3.Connection, athlete_id: int) -> None:
+    """Recompute all of an athlete's bests from ``derived_metrics``. Does not commit."""
+    metrics = {
+        row[0]
+        for row in conn.execute(
+            """
+            SELECT DISTINCT key FROM derived_metrics, json_each(metrics)
+            WHERE athlete_id = ?
+            UNION SELECT metric FROM athlete_bests WHERE athlete_id = ?
+            """,
+            (athlete_id, athlete_id),
+        )
+    }
+    for metric in metrics:
+        if metric.startswith((_LOWER_IS_BETTER, _HIGHER_IS_BETTER)):
+            _rebuild_best(conn, athlete_id, metric)
+
+
+def forget_bests(conn: sqlite3.Connection, activity_ids: Iterable[int]) -> None:
+    """Re-derive the bests held by deleted activities from the remaining ones. Does not commit.
+
+    Call after :func:`strava.db.delete_activities` removed their cached metrics.
+    """
+    ids = list(activity_ids)
+    if not ids:
+        return
+    held = conn.execute(
+        f"SELECT athlete_id, metric FROM athlete_bests WHERE activity_id IN ({','.join('?' * len(ids))})",
+        ids,
+    ).fetchall()
+    for athlete_id, metric in held:
+        _rebuild_best(conn, athlete_id, metric)
+
+
+def refresh_derived_metrics(
+    conn: sqlite3.Connection,
+    activity_ids: Iterable[int] | None = None,
+    zones: tuple[float, ...] = DEFAULT_HR_ZONES,
+) -> int:
+    """Compute metrics for activities whose cached ones are missing or stale, and update bests.
+
+    Results are cached in ``derived_metrics`` with the activity's
+    ``content_hash``; an activity is only recomputed when it was edited
+    (different hash) or its streams were replaced (``upsert_streams`` drops
+    the cached row). Activities without streams are skipped. Each activity is
+    committed in its own transaction. Does nothing when numpy is missing.
+
+    Args:
+        conn: Open SQLite connection to the activities database.
+        activity_ids: Only consider these activities; None for all.
+        zones: Heart rate zone lower bounds.
+
+    Returns:
+        Number of activities computed.
+    """
+    if numpy is None:
+        logger.debug("numpy not installed, skipping derived metrics")
+        return 0
+    sql = """
+        SELECT a.id, a.content_hash, a.owner_id FROM activities a
+        LEFT JOIN derived_metrics m ON m.activity_id = a.id
+        WHERE (m.activity_id IS NULL OR m.content_hash IS NOT a.content_hash)
+          AND EXISTS (SELECT 1 FROM streams s WHERE s.activity_id = a.id)
+    """
+    params: list = []
+    if activity_ids is not None:
+        params = list(activity_ids)
+        if not params:
+            return 0
+        sql += f" AND a.id IN ({','.join('?' * len(params))})"
+    computed = 0
+    for activity_id, content_hash, owner_id in conn.execute(sql, params).fetchall():
+        athlete_id = owner_id or 0
+        metrics = compute_metrics(get_streams(conn, activity_id, as_numpy=True), zones)
+        with conn:
+            conn.execute(
+                """
+                INSERT INTO derived_metrics (activity_id, athlete_id, content_hash, metrics, computed_at)
+                VALUES (?, ?, ?, ?, datetime('now'))
+                ON CONFLICT(activity_id) DO UPDATE SET
+                    athlete_id = excluded.athlete_id,
+                    content_hash = excluded.content_hash,
+                    metrics = excluded.metrics,
+                    computed_at = excluded.computed_at
+                """,
+                (activity_id, athlete_id, content_hash, json.dumps(metrics)),
+            )
+            _update_bests(conn, athlete_id, activity_id, metrics)
+        computed += 1
+    return computed
+
+
+def get_derived_metrics(conn: sqlite3.Connection, activity_id: int) -> dict | None:
+    """Return the cached metrics of one activity, or None if not computed."""
+    row = conn.execute(
+        "SELECT metrics FROM derived_metrics WHERE activity_id = ?", (activity_id,)
+    ).fetchone()
+    return None if row is None else json.loads(row[0])
+
+
+def get_athlete_bests(conn: sqlite3.Connection, athlete_id: int) -> dict[str, dict]:
+    """Return an athlete's all-time bests as ``{metric: {"value": ..., "activity_id": ...}}``."""
+    return {
+        metric: {"value": value, "activity_id": activity_id}
+        for metric, value, activity_id in conn.execute(
+            "SELECT metric, value, activity_id FROM athlete_bests WHERE athlete_id = ? ORDER BY metric",
+            (athlete_id,),
+        )
+    }
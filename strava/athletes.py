@@ -0,0 +1,255 @@
+import logging
+import sqlite3
+import threading
+from collections import deque
+from collections.abc import Callable
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from strava.client import get_activities
+from strava.db import connect, filter_new_ids, upsert_activities
+from strava.tokens import TokenManager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 4
+DEFAULT_OVERLAP_DAYS = 7
+PER_PAGE = 200
+
+
+def athlete_account(athlete_id: int) -> str:
+    """Return the ``oauth_tokens`` account key holding *athlete_id*'s tokens."""
+    return f"athlete:{athlete_id}"
+
+
+def register_athlete(
+    db_path: str,
+    client_id: str,
+    client_secret: str,
+    athlete_id: int,
+    access_token: str,
+    refresh_token: str,
+    name: str | None = None,
+) -> None:
+    """Add an athlete to the ``athletes`` table (or re-activate one) and store their tokens.
+
+    Tokens go through :meth:`TokenManager.seed`, so re-registering with the
+    same refresh token keeps the rotated tokens already stored.
+
+    Args:
+        db_path: Path to the activities database.
+        client_id: Strava application client ID.
+        client_secret: Strava application client secret.
+        athlete_id: Strava athlete ID.
+        access_token: The athlete's current access token.
+        refresh_token: The athlete's current refresh token.
+        name: Optional display name.
+    """
+    account = athlete_account(athlete_id)
+    tokens = TokenManager(db_path, client_id, client_secret, account=account)
+    try:
+        tokens.seed(access_token, refresh_token)
+    finally:
+        tokens.close()
+    conn = connect(db_path)
+    with conn:
+        conn.execute(
+            """
+            INSERT INTO athletes (athlete_id, name, account, active) VALUES (?, ?, ?, 1)
+            ON CONFLICT(athlete_id) DO UPDATE SET
+                name = COALESCE(excluded.name, athletes.name), active = 1
+            """,
+            (athlete_id, name, account),
+        )
+    conn.close()
+
+
+def list_athletes(conn: sqlite3.Connection, active_only: bool = True) -> list[dict]:
+    """Return registered athletes with their sync state, ordered by athlete ID."""
+    columns = (
+        "athlete_id",
+        "name",
+        "account",
+        "active",
+        "high_water_mark",
+        "last_sync_at",
+        "last_status",
+        "last_error",
+    )
+    sql = f"SELECT {', '.join(columns)} FROM athletes"
+    if active_only:
+        sql += " WHERE active = 1"
+    return [dict(zip(columns, row)) for row in conn.execute(sql + " ORDER BY athlete_id")]
+
+
+def _record_sync(
+    conn: sqlite3.Connection,
+    athlete_id: int,
+    status: str,
+    error: str | None = None,
+    newest_start_date: str | None = None,
+) -> None:
+    """Store the outcome of one athlete's sync; the high-water mark only moves forward."""
+    with conn:
+        conn.execute(
+            """
+            UPDATE athletes SET
+                last_sync_at = datetime('now'),
+                last_status = ?,
+                last_error = ?,
+                high_water_mark = CASE
+                    WHEN ? IS NOT NULL AND (high_water_mark IS NULL OR ? > high_water_mark)
+                    THEN ? ELSE high_water_mark END
+            WHERE athlete_id = ?
+            """,
+            (status, error, newest_start_date, newest_start_date, newest_start_date, athlete_id),
+        )
+
+
+@dataclass
+class AthleteSyncResult:
+    """Outcome of one athlete's part of :func:`sync_all_athletes`."""
+
+    athlete_id: int
+    saved: int = 0
+    skipped: int = 0
+    pages: int = 0
+    newest_start_date: str | None = None
+    error: str | None = None
+
+
+@dataclass
+class _AthleteJob:
+    tokens: TokenManager
+    after_ts: int | None
+    result: AthleteSyncResult
+    page: int = 1
+
+
+def _after_ts(high_water_mark: str | None, overlap_days: int, full: bool) -> int | None:
+    if full or high_water_mark is None:
+        return None
+    mark = datetime.fromisoformat(high_water_mark.replace("Z", "+00:00"))
+    return int((mark - timedelta(days=overlap_days)).timestamp())
+
+
+def sync_all_athletes(
+    db_path: str,
+    client_id: str,
+    client_secret: str,
+    workers: int = DEFAULT_WORKERS,
+    overlap_days: int = DEFAULT_OVERLAP_DAYS,
+    full: bool = False,
+    progress: Callable[[AthleteSyncResult, int], None] | None = None,
+) -> list[AthleteSyncResult]:
+    """Sync every active athlete's activities on a pool of *workers* threads.
+
+    Scheduling is round-robin by page: a worker takes the athlete at the head
+    of a shared queue, fetches and stores one page of their activities and,
+    if more pages follow, puts the athlete back at the tail. Every athlete
+    with pending pages therefore gets the next free slot in turn, so one
+    athlete's years-long backlog only takes its fair share of the pool and
+    of the rate budget while the others' few new activities land promptly.
+    Each athlete has at most one page in flight, which keeps their pages in
+    order.
+
+    All requests go through the shared client, so they draw from one
+    app-level budget when its RateLimiter is attached. Tokens are per
+    athlete (``oauth_tokens`` account ``athlete:<id>``). Each athlete's sync
+    starts from their own high-water mark minus *overlap_days* (or from the
+    beginning with *full*) and the mark moves forward only when that
+    athlete's sync completes. A failing athlete is recorded and skipped; the
+    others continue.
+
+    Args:
+        db_path: Path to the activities database.
+        client_id: Strava application client ID.
+        client_secret: Strava application client secret.
+        workers: Number of worker threads.
+        overlap_days: How far before the high-water mark an incremental sync starts.
+        full: Ignore the high-water marks and page through the whole history.
+        progress: Called from the worker thread with the athlete's result
+            and the number of activities just saved, after every page.
+
+    Returns:
+        One result per athlete, in athlete ID order.
+    """
+    conn = connect(db_path)
+    athletes = list_athletes(conn)
+    conn.close()
+
+    queue: deque[_AthleteJob] = deque()
+    for athlete in athletes:
+        tokens = TokenManager(db_path, client_id, client_secret, account=athlete["account"])
+        queue.append(
+            _AthleteJob(
+                tokens=tokens,
+                after_ts=_after_ts(athlete["high_water_mark"], overlap_days, full),
+                result=AthleteSyncResult(athlete["athlete_id"]),
+            )
+        )
+    jobs = list(queue)
+    lock = threading.Lock()
+
+    def run_worker() -> None:
+        conn = connect(db_path)
+        try:
+            while True:
+                with lock:
+                    if not queue:
+                        return
+                    job = queue.popleft()
+                if _sync_page(conn, job, progress):
+                    with lock:
+                        queue.append(job)
+        finally:
+            conn.close()
+
+    threads = [
+        threading.Thread(target=run_worker, name=f"athlete-sync-{i}", daemon=True)
+        for i in range(max(1, min(workers, len(jobs))))
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for job in jobs:
+        job.tokens.close()
+    return [job.result for job in jobs]
+
+
+def _sync_page(
+    conn: sqlite3.Connection,
+    job: _AthleteJob,
+    progress: Callable[[AthleteSyncResult, int], None] | None,
+) -> bool:
+    """Fetch and store one page for *job*; return True if the athlete has more pages."""
+    result = job.result
+    try:
+        activities = job.tokens.call(
+            lambda token: get_activities(token, page=job.page, per_page=PER_PAGE, after=job.after_ts)
+        )
+        unseen = list({a["id"]: a for a in activities}.values())
+        new_ids = set(filter_new_ids(conn, [a["id"] for a in unseen]))
+        new_activities = [a for a in unseen if a["id"] in new_ids]
+        saved = upsert_activities(conn, new_activities, batch_size=max(len(new_activities), 1)).written
+    except Exception as e:
+        logger.exception("sync of athlete %s failed on page %d", result.athlete_id, job.page)
+        result.error = str(e)
+        _record_sync(conn, result.athlete_id, "failed", error=result.error)
+        return False
+
+    result.pages += 1
+    result.saved += saved
+    result.skipped += len(unseen) - len(new_activities)
+    if activities:
+        newest = max(a["start_date"] for a in activities)
+        if result.newest_start_date is None or newest > result.newest_start_date:
+            result.newest_start_date = newest
+    if progress is not None:
+        progress(result, saved)
+    if len(activities) == PER_PAGE:
+        job.page += 1
+        return True
+    _record_sync(conn, result.athlete_id, "completed", newest_start_date=result.newest_start_date)
+    return False
@@ -1,9 +1,26 @@
+import threading
+import time
+from collections.abc import Iterable
+from typing import TYPE_CHECKING, TypedDict
+
 import requests
-from typing import TypedDict
+from requests.adapters import HTTPAdapter
+
+from strava.retry import RetryCounters, RetryPolicy, parse_retry_after
+from strava.streams import STREAM_TYPES
+
+if TYPE_CHECKING:
+    from strava.ratelimit import RateLimiter
 
 STRAVA_API = "https://www.strava.com/api/v3"
 TOKEN_URL = "https://www.strava.com/oauth/token"
 
+DEFAULT_POOL_SIZE = 10
+DEFAULT_TIMEOUT = (5.0, 30.0)  # (connect, read) seconds
+
+# Transport failures that may succeed when the request is simply sent again.
+RETRYABLE_EXCEPTIONS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
 
 class TokenResponse(TypedDict):
     """Response payload returned by the Strava OAuth token endpoint."""
@@ -20,74 +37,289 @@ def _auth_headers(access_token: str) -> dict[str, str]:
     return {"Authorization": f"Bearer {access_token}"}
 
 
+class StravaClient:
+    """Strava API client backed by a pooled, keep-alive ``requests.Session``.
+
+    One instance is meant to be shared by the whole process so that repeated
+    calls reuse open TCP/TLS connections to www.strava.com instead of paying a
+    new handshake per request. The session's connection pool is thread-safe.
+
+    When a RateLimiter is attached, every API call first takes a token from it
+    and feeds the ``X-RateLimit-*`` response headers back, and a 429 response
+    makes the call wait for the budget window to reset and try again.
+
+    Connection errors, timeouts and retryable statuses (429, 5xx) are retried
+    according to a RetryPolicy. Only idempotent GETs and the token refresh are
+    retried; per-endpoint counts are available from :meth:`retry_metrics`.
+    """
+
+    def __init__(
+        self,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        timeout: float | tuple[float, float] = DEFAULT_TIMEOUT,
+        keep_alive: bool = True,
+        rate_limiter: "RateLimiter | None" = None,
+        retry_policy: RetryPolicy | None = None,
+    ) -> None:
+        """Create the client and its underlying session.
+
+        Args:
+            pool_size: Maximum number of pooled connections kept open per host.
+            timeout: Request timeout in seconds, either a single value or a
+                ``(connect, read)`` tuple.
+            keep_alive: When False, every request asks the server to close the
+                connection (useful behind proxies that mishandle idle sockets).
+            rate_limiter: Optional scheduler that paces calls within Strava's budgets.
+            retry_policy: Retry behaviour for transient failures; defaults to RetryPolicy().
+        """
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.retry_counters = RetryCounters()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        if not keep_alive:
+            self.session.headers["Connection"] = "close"
+
+    def close(self) -> None:
+        """Close all pooled connections."""
+        self.session.close()
+
+    def __enter__(self) -> "StravaClient":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def retry_metrics(self) -> dict[str, dict[str, int]]:
+        """Return per-endpoint retry counters, e.g. ``{"activity": {"retries": 2, "gave_up": 0}}``."""
+        return self.retry_counters.snapshot()
+
+    def _send(
+        self,
+        method: str,
+        url: str,
+        endpoint: str,
+        counted: bool = True,
+        retry: bool | None = None,
+        **kwargs,
+    ) -> requests.Response:
+        """Send a request through the pooled session, retrying transient failures.
+
+        Args:
+            method: Session method name, ``"get"`` or ``"post"``.
+            url: Absolute request URL.
+            endpoint: Short endpoint label used for the retry counters.
+            counted: Whether the call draws from the API rate-limit budget.
+            retry: Whether failures may be retried; defaults to True for GET only,
+                since other methods are not idempotent in general.
+            **kwargs: Passed through to the session method.
+
+        Raises:
+            requests.HTTPError: For a non-retryable status or once retries are exhausted.
+            requests.RequestException: For a transport error once retries are exhausted.
+        """
+        send = getattr(self.session, method)
+        limiter = self.rate_limiter if counted else None
+        policy = self.retry_policy
+        max_attempts = policy.max_attempts if (method == "get" if retry is None else retry) else 1
+        attempt = 0
+        while True:
+            attempt += 1
+            if limiter is not None:
+                limiter.acquire()
+            try:
+                resp = send(url, timeout=self.timeout, **kwargs)
+            except RETRYABLE_EXCEPTIONS:
+                if attempt >= max_attempts:
+                    self.retry_counters.record_give_up(endpoint)
+                    raise
+                self.retry_counters.record_retry(endpoint)
+                time.sleep(policy.delay(attempt - 1))
+                continue
+
+            if limiter is not None:
+                limiter.update(resp.headers)
+            if resp.status_code not in policy.retry_statuses:
+                break
+            if attempt >= max_attempts:
+                self.retry_counters.record_give_up(endpoint)
+                break
+            self.retry_counters.record_retry(endpoint)
+            retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+            if resp.status_code == 429 and limiter is not None:
+                # The limiter's next acquire() already waits for the window reset.
+                limiter.exhaust(resp.headers)
+                delay = retry_after or 0.0
+            else:
+                delay = policy.delay(attempt - 1, retry_after)
+            time.sleep(delay)
+        resp.raise_for_status()
+        return resp
+
+    def get_activities(
+        self,
+        access_token: str,
+        page: int = 1,
+        per_page: int = 200,
+        after: int | None = None,
+        before: int | None = None,
+    ) -> list[dict]:
+        """Fetch a paginated list of the authenticated athlete's activities.
+
+        Args:
+            access_token: Valid Strava OAuth access token.
+            page: Page number to fetch (1-based).
+            per_page: Number of activities per page (max 200).
+            after: Optional Unix timestamp; only activities after this time are returned.
+            before: Optional Unix timestamp; only activities before this time are returned.
+
+        Returns:
+            List of activity dicts as returned by the Strava API.
+        """
+        params: dict[str, int] = {"page": page, "per_page": per_page}
+        if after is not None:
+            params["after"] = after
+        if before is not None:
+            params["before"] = before
+        resp = self._send(
+            "get",
+            f"{STRAVA_API}/athlete/activities",
+            "activities",
+            headers=_auth_headers(access_token),
+            params=params,
+        )
+        return resp.json()
+
+    def get_activity(self, access_token: str, activity_id: int) -> dict:
+        """Fetch a single activity by ID from the Strava API.
+
+        Args:
+            access_token: Valid Strava OAuth access token.
+            activity_id: Numeric Strava activity ID.
+
+        Returns:
+            Activity detail dict as returned by the Strava API.
+        """
+        resp = self._send(
+            "get",
+            f"{STRAVA_API}/activities/{activity_id}",
+            "activity",
+            headers=_auth_headers(access_token),
+        )
+        return resp.json()
+
+    def get_activity_streams(
+        self,
+        access_token: str,
+        activity_id: int,
+        keys: Iterable[str] = STREAM_TYPES,
+    ) -> dict[str, dict]:
+        """Fetch the recorded sample streams of one activity.
+
+        Args:
+            access_token: Valid Strava OAuth access token.
+            activity_id: Numeric Strava activity ID.
+            keys: Stream types to request, e.g. ``("time", "heartrate")``.
+
+        Returns:
+            Dict keyed by stream type; each value holds the samples under ``"data"``.
+            Channels the activity did not record are missing.
+        """
+        resp = self._send(
+            "get",
+            f"{STRAVA_API}/activities/{activity_id}/streams",
+            "streams",
+            headers=_auth_headers(access_token),
+            params={"keys": ",".join(keys), "key_by_type": "true"},
+        )
+        return resp.json()
+
+    def refresh_access_token(
+        self, client_id: str, client_secret: str, refresh_token: str
+    ) -> TokenResponse:
+        """Exchange a refresh token for a new access token via the Strava OAuth endpoint.
+
+        Args:
+            client_id: Strava application client ID.
+            client_secret: Strava application client secret.
+            refresh_token: Current refresh token to exchange.
+
+        Returns:
+            TokenResponse dict containing the new access_token, refresh_token and expiry info.
+        """
+        resp = self._send(
+            "post",
+            TOKEN_URL,
+            "token",
+            counted=False,
+            # Refreshing with the same refresh token is safe to repeat.
+            retry=True,
+            data={
+                "client_id": client_id,
+                "client_secret": client_secret,
+                "refresh_token": refresh_token,
+                "grant_type": "refresh_token",
+            },
+        )
+        return resp.json()
+
+
+_client: StravaClient | None = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> StravaClient:
+    """Return the process-wide shared client, creating it with defaults on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = StravaClient()
+        return _client
+
+
+def set_client(client: StravaClient) -> None:
+    """Install *client* as the process-wide shared client.
+
+    Entry points call this once at startup to configure pool size and timeouts;
+    the module-level helpers below then route through it.
+    """
+    global _client
+    with _client_lock:
+        if _client is not None and _client is not client:
+            _client.close()
+        _client = client
+
+
 def get_activities(
     access_token: str,
     page: int = 1,
     per_page: int = 200,
     after: int | None = None,
+    before: int | None = None,
 ) -> list[dict]:
-    """Fetch a paginated list of the authenticated athlete's activities.
-
-    Args:
-        access_token: Valid Strava OAuth access token.
-        page: Page number to fetch (1-based).
-        per_page: Number of activities per page (max 200).
-        after: Optional Unix timestamp; only activities after this time are returned.
-
-    Returns:
-        List of activity dicts as returned by the Strava API.
-    """
-    params: dict[str, int] = {"page": page, "per_page": per_page}
-    if after is not None:
-        params["after"] = after
-    resp = requests.get(
-        f"{STRAVA_API}/athlete/activities",
-        headers=_auth_headers(access_token),
-        params=params,
+    """Fetch a page of activities using the shared client. See StravaClient.get_activities."""
+    return get_client().get_activities(
+        access_token, page=page, per_page=per_page, after=after, before=before
     )
-    resp.raise_for_status()
-    return resp.json()
 
 
 def get_activity(access_token: str, activity_id: int) -> dict:
-    """Fetch a single activity by ID from the Strava API.
+    """Fetch a single activity using the shared client. See StravaClient.get_activity."""
+    return get_client().get_activity(access_token, activity_id)
 
-    Args:
-        access_token: Valid Strava OAuth access token.
-        activity_id: Numeric Strava activity ID.
 
-    Returns:
-        Activity detail dict as returned by the Strava API.
-    """
-    resp = requests.get(
-        f"{STRAVA_API}/activities/{activity_id}",
-        headers=_auth_headers(access_token),
-    )
-    resp.raise_for_status()
-    return resp.json()
+def get_activity_streams(
+    access_token: str, activity_id: int, keys: Iterable[str] = STREAM_TYPES
+) -> dict[str, dict]:
+    """Fetch activity streams using the shared client. See StravaClient.get_activity_streams."""
+    return get_client().get_activity_streams(access_token, activity_id, keys)
 
 
 def refresh_access_token(
     client_id: str, client_secret: str, refresh_token: str
 ) -> TokenResponse:
-    """Exchange a refresh token for a new access token via the Strava OAuth endpoint.
-
-    Args:
-        client_id: Strava application client ID.
-        client_secret: Strava application client secret.
-        refresh_token: Current refresh token to exchange.
-
-    Returns:
-        TokenResponse dict containing the new access_token, refresh_token and expiry info.
-    """
-    resp = requests.post(
-        TOKEN_URL,
-        data={
-            "client_id": client_id,
-            "client_secret": client_secret,
-            "refresh_token": refresh_token,
-            "grant_type": "refresh_token",
-        },
-    )
-    resp.raise_for_status()
-    return resp.json()
+    """Refresh the access token using the shared client. See StravaClient.refresh_access_token."""
+    return get_client().refresh_access_token(client_id, client_secret, refresh_token)
@@ -0,0 +1,178 @@
+import hashlib
+import sqlite3
+import zlib
+from dataclasses import dataclass
+
+try:
+    import zstandard
+except ImportError:  # optional: pip install .[zstd]
+    zstandard = None
+
+RAW_FORMAT_KEY = "raw_format"  # sync_state key holding the codec marker for new writes
+FORMATS = ("json", "zlib", "zstd")
+ZLIB_LEVEL = 9
+ZSTD_LEVEL = 10
+ZLIB_DICT_SIZE = 32 * 1024  # zlib only looks back 32 KiB, a larger preset dictionary is ignored
+ZSTD_DICT_SIZE = 112 * 1024
+
+_dictionaries: dict[str, bytes] = {}  # dict_id -> data; ids are content hashes, so safe to share
+
+
+@dataclass(frozen=True)
+class RawCodec:
+    """How ``raw_json`` is encoded: plain JSON text, or zlib/zstd bytes with an optional dictionary.
+
+    The codec is identified by its :attr:`marker`, stored per row in
+    ``activities.raw_format``: ``json``, ``zlib``, ``zstd``, or
+    ``<format>:<dict_id>`` when a trained dictionary from
+    ``compression_dicts`` is used.
+    """
+
+    format: str = "json"
+    dictionary: bytes | None = None
+
+    @property
+    def dict_id(self) -> str | None:
+        """Content hash identifying the dictionary, or None."""
+        if self.dictionary is None:
+            return None
+        return hashlib.blake2b(self.dictionary, digest_size=8).hexdigest()
+
+    @property
+    def marker(self) -> str:
+        """Value stored in ``raw_format`` for rows written with this codec."""
+        return self.format if self.dictionary is None else f"{self.format}:{self.dict_id}"
+
+    def encode(self, text: str) -> str | bytes:
+        """Encode a JSON document for the ``raw_json`` column."""
+        if self.format == "json":
+            return text
+        data = text.encode()
+        if self.format == "zlib":
+            if self.dictionary is None:
+                return zlib.compress(data, ZLIB_LEVEL)
+            compressor = zlib.compressobj(ZLIB_LEVEL, zdict=self.dictionary)
+            return compressor.compress(data) + compressor.flush()
+        return _zstd_compressor(self.dictionary).compress(data)
+
+    def decode(self, value: str | bytes) -> str:
+        """Decode a ``raw_json`` value written with this codec back to JSON text."""
+        if self.format == "json":
+            return value
+        if self.format == "zlib":
+            if self.dictionary is None:
+                return zlib.decompress(value).decode()
+            decompressor = zlib.decompressobj(zdict=self.dictionary)
+            return (decompressor.decompress(value) + decompressor.flush()).decode()
+        return _zstd_decompressor(self.dictionary).decompress(value).decode()
+
+
+JSON_CODEC = RawCodec()
+
+
+def _require_zstd() -> None:
+    if zstandard is None:
+        raise RuntimeError("zstd compression requires the zstandard package: pip install .[zstd]")
+
+
+def _zstd_compressor(dictionary: bytes | None):
+    _require_zstd()
+    dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary is not None else None
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=dict_data)
+
+
+def _zstd_decompressor(dictionary: bytes | None):
+    _require_zstd()
+    dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary is not None else None
+    return zstandard.ZstdDecompressor(dict_data=dict_data)
+
+
+def train_dictionary(format: str, samples: list[bytes]) -> bytes:
+    """Build a compression dictionary from sample ``raw_json`` payloads.
+
+    zstd trains a real dictionary with ``zstandard.train_dictionary``. zlib has
+    no trainer; its preset dictionary is simply recent sample data, which
+    already holds the keys and value fragments every activity repeats, placed
+    so the most common content sits at the end where matches are cheapest.
+
+    Args:
+        format: ``"zlib"`` or ``"zstd"``.
+        samples: Uncompressed JSON payloads, ideally a few hundred.
+
+    Returns:
+        Dictionary bytes for :class:`RawCodec`.
+    """
+    if format == "zstd":
+        _require_zstd()
+        return zstandard.train_dictionary(ZSTD_DICT_SIZE, samples).as_bytes()
+    if format != "zlib":
+        raise ValueError(f"format {format!r} does not use a dictionary")
+    return b"".join(samples)[-ZLIB_DICT_SIZE:]
+
+
+def store_dictionary(conn: sqlite3.Connection, codec: RawCodec) -> None:
+    """Persist *codec*'s dictionary in ``compression_dicts`` so every reader can decode its rows."""
+    if codec.dictionary is None:
+        return
+    conn.execute(
+        """
+        INSERT OR IGNORE INTO compression_dicts (dict_id, format, data, created_at)
+        VALUES (?, ?, ?, datetime('now'))
+        """,
+        (codec.dict_id, codec.format, codec.dictionary),
+    )
+    _dictionaries[codec.dict_id] = codec.dictionary
+
+
+def codec_for_marker(conn: sqlite3.Connection, marker: str | None) -> RawCodec:
+    """Return the codec that wrote rows marked *marker*, loading its dictionary if needed.
+
+    Raises:
+        ValueError: If the format is unknown or the dictionary is missing.
+    """
+    if marker is None or marker == "json":
+        return JSON_CODEC
+    format, _, dict_id = marker.partition(":")
+    if format not in FORMATS:
+        raise ValueError(f"unknown raw_json format: {marker!r}")
+    if not dict_id:
+        return RawCodec(format)
+    dictionary = _dictionaries.get(dict_id)
+    if dictionary is None:
+        row = conn.execute(
+            "SELECT data FROM compression_dicts WHERE dict_id = ?", (dict_id,)
+        ).fetchone()
+        if row is None:
+            raise ValueError(f"compression dictionary {dict_id} not found")
+        dictionary = _dictionaries[dict_id] = bytes(row[0])
+    return RawCodec(format, dictionary)
+
+
+def decode_raw(conn: sqlite3.Connection, value: str | bytes | None, marker: str | None) -> str | None:
+    """Return the JSON text of a stored ``raw_json`` value, whatever its encoding."""
+    if value is None:
+        return None
+    return codec_for_marker(conn, marker).decode(value)
+
+
+def get_write_codec(conn: sqlite3.Connection) -> RawCodec:
+    """Return the codec new activity rows are written with (plain JSON unless configured)."""
+    row = conn.execute("SELECT value FROM sync_state WHERE key = ?", (RAW_FORMAT_KEY,)).fetchone()
+    return codec_for_marker(conn, None if row is None else row[0])
+
+
+def set_write_codec(conn: sqlite3.Connection, codec: RawCodec) -> None:
+    """Make *codec* the encoding for new activity rows and commit.
+
+    The setting lives in the database, so the sync and the webhook server
+    write the same format.
+    """
+    with conn:
+        store_dictionary(conn, codec)
+        conn.execute(
+            """
+            INSERT INTO sync_state (key, value, updated_at) VALUES (?, ?, datetime('now'))
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+            """,
+            (RAW_FORMAT_KEY, codec.marker),
+        )
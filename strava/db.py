@@ -1,5 +1,14 @@
+import hashlib
 import sqlite3
 import json
+import threading
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from itertools import islice
+
+from strava.compression import JSON_CODEC, RawCodec, decode_raw, get_write_codec
+from strava.streams import PackedStream, decode_stream, decode_stream_numpy, encode_stream
 
 
 CREATE_TABLE_SQL = """
@@ -20,42 +29,817 @@ CREATE TABLE IF NOT EXISTS activities (
 );
 """
 
+ACTIVITY_INDEXES_SQL = """
+CREATE INDEX IF NOT EXISTS idx_activities_start_date
+    ON activities (start_date);
+CREATE INDEX IF NOT EXISTS idx_activities_sport_type_start_date
+    ON activities (sport_type, start_date);
+"""
+
+RATE_LIMIT_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS rate_limit_state (
+    id           INTEGER PRIMARY KEY CHECK (id = 1),
+    short_limit  INTEGER NOT NULL DEFAULT 200,
+    short_usage  INTEGER NOT NULL DEFAULT 0,
+    short_window INTEGER NOT NULL DEFAULT 0,
+    long_limit   INTEGER NOT NULL DEFAULT 2000,
+    long_usage   INTEGER NOT NULL DEFAULT 0,
+    long_window  INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+SYNC_STATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS sync_state (
+    key        TEXT PRIMARY KEY,
+    value      TEXT,
+    updated_at TEXT DEFAULT (datetime('now'))
+);
+"""
+
+HIGH_WATER_MARK_KEY = "high_water_mark"
+
+SYNC_RUNS_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS sync_runs (
+    run_id            TEXT PRIMARY KEY,
+    params            TEXT,
+    status            TEXT NOT NULL DEFAULT 'running',  -- running, failed, completed
+    newest_start_date TEXT,
+    error             TEXT,
+    started_at        TEXT DEFAULT (datetime('now')),
+    updated_at        TEXT DEFAULT (datetime('now'))
+);
+"""
+
+SYNC_WINDOWS_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS sync_windows (
+    run_id       TEXT NOT NULL,
+    window_index INTEGER NOT NULL,
+    after_ts     INTEGER,
+    before_ts    INTEGER,
+    last_page    INTEGER NOT NULL DEFAULT 0,
+    done         INTEGER NOT NULL DEFAULT 0,
+    updated_at   TEXT DEFAULT (datetime('now')),
+    PRIMARY KEY (run_id, window_index)
+);
+"""
+
+
+WEBHOOK_QUEUE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS webhook_queue (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    payload      TEXT NOT NULL,
+    coalesce_key TEXT,                             -- e.g. activity:123; NULL if never merged
+    status       TEXT NOT NULL DEFAULT 'pending',  -- pending or dead
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL,                    -- Unix time the event may next be claimed
+    last_error   TEXT,
+    created_at   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_webhook_queue_available
+    ON webhook_queue (status, available_at);
+CREATE INDEX IF NOT EXISTS idx_webhook_queue_coalesce
+    ON webhook_queue (coalesce_key) WHERE attempts = 0;
+"""
+
+
+WEBHOOK_DELIVERIES_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS webhook_deliveries (
+    subscription_id INTEGER NOT NULL,
+    object_id       INTEGER NOT NULL,
+    aspect_type     TEXT NOT NULL,
+    event_time      INTEGER NOT NULL,
+    received_at     REAL NOT NULL,  -- Unix time of the first delivery; used for pruning
+    PRIMARY KEY (subscription_id, object_id, aspect_type, event_time)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_webhook_deliveries_received
+    ON webhook_deliveries (received_at);
+"""
+
+
+COMPRESSION_DICTS_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS compression_dicts (
+    dict_id    TEXT PRIMARY KEY,  -- content hash, referenced from activities.raw_format
+    format     TEXT NOT NULL,
+    data       BLOB NOT NULL,
+    created_at TEXT
+)
+"""
+
+
+OAUTH_TOKENS_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS oauth_tokens (
+    account            TEXT PRIMARY KEY,
+    access_token       TEXT NOT NULL,
+    refresh_token      TEXT NOT NULL,   -- rotated by Strava on every refresh
+    expires_at         INTEGER NOT NULL,
+    seed_refresh_token TEXT,            -- refresh token the row was seeded from (env)
+    updated_at         TEXT
+)
+"""
+
+
+DEFAULT_BUSY_TIMEOUT = 5.0  # seconds a writer waits for the lock before failing
+DEFAULT_MMAP_SIZE = 256 * 1024 * 1024
+DEFAULT_CACHED_STATEMENTS = 256
+DEFAULT_POOL_SIZE = 8
+
+
+def connect(
+    db_path: str,
+    busy_timeout: float = DEFAULT_BUSY_TIMEOUT,
+    mmap_size: int = DEFAULT_MMAP_SIZE,
+    cached_statements: int = DEFAULT_CACHED_STATEMENTS,
+) -> sqlite3.Connection:
+    """Open a tuned connection to the activities database.
+
+    The connection waits up to *busy_timeout* seconds for a competing writer
+    instead of failing with "database is locked", reads through a memory map
+    of up to *mmap_size* bytes and keeps up to *cached_statements* prepared
+    statements, so the handful of queries this package repeats are compiled
+    once per connection. Recursive triggers are enabled so that ``INSERT OR
+    REPLACE`` on ``activities`` keeps the aggregate tables correct. Rows are
+    returned as sqlite3.Row. The connection may
+    be handed between threads but must only be used by one at a time.
+
+    Args:
+        db_path: Filesystem path to the SQLite database file.
+        busy_timeout: Seconds to wait for a database lock.
+        mmap_size: Bytes of the database file to memory-map; 0 disables mmap.
+        cached_statements: Size of the prepared statement cache.
+
+    Returns:
+        Open SQLite connection.
+    """
+    conn = sqlite3.connect(
+        db_path,
+        timeout=busy_timeout,
+        cached_statements=cached_statements,
+        check_same_thread=False,
+    )
+    conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA mmap_size={int(mmap_size)}")
+    # Lets INSERT OR REPLACE fire the delete triggers that keep agg_* in step.
+    conn.execute("PRAGMA recursive_triggers = ON")
+    return conn
+
+
+class ConnectionPool:
+    """Reusable SQLite connections shared by short-lived request threads.
+
+    The webhook server handles every request on a new thread, so a
+    thread-local connection would be opened and thrown away per request.
+    Instead, connections opened with :func:`connect` are checked out for the
+    duration of a ``with pool.connection()`` block and returned afterwards;
+    up to *size* idle connections are kept open. Together with the WAL
+    journal set up by :func:`init_db`, readers no longer block the writer
+    and vice versa.
+
+    Usage::
+
+        pool = ConnectionPool("strava.db")
+        with pool.connection() as conn:
+            conn.execute(...)
+    """
+
+    def __init__(self, db_path: str, size: int = DEFAULT_POOL_SIZE, **connect_kwargs) -> None:
+        """Configure the pool; connections are opened lazily.
+
+        Args:
+            db_path: Filesystem path to the SQLite database file.
+            size: Maximum number of idle connections kept open.
+            **connect_kwargs: Passed to :func:`connect`.
+        """
+        self.db_path = db_path
+        self.size = size
+        self._connect_kwargs = connect_kwargs
+        self._idle: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Check out a connection for the duration of the ``with`` block.
+
+        A transaction left open by the block is rolled back before the
+        connection goes back to the pool.
+        """
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = connect(self.db_path, **self._connect_kwargs)
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            with self._lock:
+                if len(self._idle) < self.size:
+                    self._idle.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+
+    def close(self) -> None:
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+# Fields of raw_json copied into their own columns on every write, so queries
+# on them can use an index. {column: (type, JSON path)}. A new entry also
+# needs a migration that adds and backfills its column.
+EXTRACTED_COLUMNS = {
+    "average_heartrate": ("REAL", "$.average_heartrate"),
+    "average_watts": ("REAL", "$.average_watts"),
+    "kudos_count": ("INTEGER", "$.kudos_count"),
+    "gear_id": ("TEXT", "$.gear_id"),
+    "summary_polyline": ("TEXT", "$.map.summary_polyline"),
+    "owner_id": ("INTEGER", "$.athlete.id"),
+}
+
+
+def _backfill_extracted_columns(conn: sqlite3.Connection, paths: dict[str, str]) -> None:
+    """Fill existing rows' columns from their raw_json, whatever its encoding.
+
+    Args:
+        conn: Open SQLite connection to the activities database.
+        paths: ``{column: JSON path}`` to fill.
+    """
+    columns = list(paths)
+    if "raw_format" not in _activity_columns(conn):
+        # Databases older than compression (raw_format comes with migration 8) hold plain JSON only.
+        conn.execute(
+            f"""
+            UPDATE activities SET
+                {", ".join(f"{c} = json_extract(raw_json, '{paths[c]}')" for c in columns)}
+            WHERE raw_json IS NOT NULL
+            """
+        )
+        return
+    # Plain JSON rows are filled in SQL; compressed ones have to be decoded here.
+    conn.execute(
+        f"""
+        UPDATE activities SET
+            {", ".join(f"{c} = json_extract(raw_json, '{paths[c]}')" for c in columns)}
+        WHERE raw_json IS NOT NULL AND (raw_format IS NULL OR raw_format = 'json')
+        """
+    )
+    rows = conn.execute(
+        """
+        SELECT id, raw_json, raw_format FROM activities
+        WHERE raw_json IS NOT NULL AND raw_format IS NOT NULL AND raw_format != 'json'
+        """
+    )
+    updates = []
+    for activity_id, raw, raw_format in rows:
+        activity = json.loads(decode_raw(conn, raw, raw_format))
+        updates.append([_extract(activity, paths[c]) for c in columns] + [activity_id])
+    conn.executemany(
+        f"UPDATE activities SET {', '.join(f'{c} = ?' for c in columns)} WHERE id = ?", updates
+    )
+
+
+def _activity_columns(conn: sqlite3.Connection) -> set[str]:
+    return {row[1] for row in conn.execute("PRAGMA table_info(activities)")}
+
+
+# The columns as migration 1 shipped them. EXTRACTED_COLUMNS keeps growing;
+# each later column gets its own migration.
+_MIGRATION_1_COLUMNS = {
+    "average_heartrate": ("REAL", "$.average_heartrate"),
+    "average_watts": ("REAL", "$.average_watts"),
+    "kudos_count": ("INTEGER", "$.kudos_count"),
+    "gear_id": ("TEXT", "$.gear_id"),
+    "summary_polyline": ("TEXT", "$.map.summary_polyline"),
+}
+
+
+def _migration_extracted_columns(conn: sqlite3.Connection) -> None:
+    for column, (decl, _) in _MIGRATION_1_COLUMNS.items():
+        conn.execute(f"ALTER TABLE activities ADD COLUMN {column} {decl}")
+    _backfill_extracted_columns(conn, {c: path for c, (_, path) in _MIGRATION_1_COLUMNS.items()})
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_activities_gear_id_start_date ON activities (gear_id, start_date)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_activities_average_heartrate ON activities (average_heartrate)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_activities_average_watts ON activities (average_watts)"
+    )
+
+
+STREAMS_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS streams (
+    activity_id INTEGER NOT NULL,
+    stream_type TEXT NOT NULL,
+    typecode    TEXT NOT NULL,
+    scale       REAL NOT NULL,
+    width       INTEGER NOT NULL,
+    length      INTEGER NOT NULL,
+    data        BLOB NOT NULL,
+    PRIMARY KEY (activity_id, stream_type)
+) WITHOUT ROWID
+"""
+
+
+def _migration_streams(conn: sqlite3.Connection) -> None:
+    conn.execute(STREAMS_TABLE_SQL)
+
+
+DERIVED_METRICS_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS derived_metrics (
+    activity_id  INTEGER PRIMARY KEY,
+    athlete_id   INTEGER NOT NULL,
+    content_hash TEXT,
+    metrics      TEXT NOT NULL,
+    computed_at  TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_derived_metrics_athlete_id ON derived_metrics (athlete_id);
+CREATE TABLE IF NOT EXISTS athlete_bests (
+    athlete_id  INTEGER NOT NULL,
+    metric      TEXT NOT NULL,
+    value       REAL NOT NULL,
+    activity_id INTEGER NOT NULL,
+    PRIMARY KEY (athlete_id, metric)
+) WITHOUT ROWID;
+"""
+
+
+def _migration_derived_metrics(conn: sqlite3.Connection) -> None:
+    for statement in DERIVED_METRICS_TABLE_SQL.split(";"):
+        if statement.strip():
+            conn.execute(statement)
+
+
+# Rollup tables kept up to date by triggers on activities: {table: (period column, SQL
+# expression for the period of a row; {row} is NEW or OLD)}. Periods follow the
+# athlete's local calendar; weeks start on Monday.
+AGGREGATE_PERIODS = {
+    "agg_weekly": (
+        "week",
+        "date(COALESCE({row}.start_date_local, {row}.start_date), 'weekday 0', '-6 days')",
+    ),
+    "agg_monthly": (
+        "month",
+        "strftime('%Y-%m', COALESCE({row}.start_date_local, {row}.start_date))",
+    ),
+}
+_AGGREGATE_SPORT = "COALESCE({row}.sport_type, {row}.type, '')"
+_AGGREGATE_SUMS = {
+    "distance": "REAL",
+    "moving_time": "INTEGER",
+    "elapsed_time": "INTEGER",
+    "total_elevation_gain": "REAL",
+}
+
+
+def _aggregate_schema() -> list[str]:
+    """Return the CREATE statements for the rollup tables and their triggers."""
+    statements = []
+    for table, (period, expr) in AGGREGATE_PERIODS.items():
+        sums = "".join(f"{c} {t} NOT NULL DEFAULT 0, " for c, t in _AGGREGATE_SUMS.items())
+        statements.append(
+            f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                {period} TEXT NOT NULL, sport_type TEXT NOT NULL,
+                activity_count INTEGER NOT NULL DEFAULT 0, {sums}
+                PRIMARY KEY ({period}, sport_type)
+            ) WITHOUT ROWID
+            """
+        )
+        new_period, new_sport = expr.format(row="NEW"), _AGGREGATE_SPORT.format(row="NEW")
+        old_period, old_sport = expr.format(row="OLD"), _AGGREGATE_SPORT.format(row="OLD")
+        add = f"""
+            INSERT INTO {table} ({period}, sport_type, activity_count, {", ".join(_AGGREGATE_SUMS)})
+            SELECT {new_period}, {new_sport}, 1,
+                   {", ".join(f"COALESCE(NEW.{c}, 0)" for c in _AGGREGATE_SUMS)}
+            WHERE {new_period} IS NOT NULL
+            ON CONFLICT({period}, sport_type) DO UPDATE SET
+                activity_count = activity_count + 1,
+                {", ".join(f"{c} = {c} + excluded.{c}" for c in _AGGREGATE_SUMS)};
+        """
+        subtract = f"""
+            UPDATE {table} SET
+                activity_count = activity_count - 1,
+                {", ".join(f"{c} = {c} - COALESCE(OLD.{c}, 0)" for c in _AGGREGATE_SUMS)}
+            WHERE {period} = {old_period} AND sport_type = {old_sport};
+            DELETE FROM {table}
+            WHERE {period} = {old_period} AND sport_type = {old_sport} AND activity_count <= 0;
+        """
+        watched = ", ".join(("start_date", "start_date_local", "sport_type", "type", *_AGGREGATE_SUMS))
+        statements += [
+            f"CREATE TRIGGER IF NOT EXISTS {table}_insert AFTER INSERT ON activities BEGIN {add} END",
+            f"CREATE TRIGGER IF NOT EXISTS {table}_delete AFTER DELETE ON activities BEGIN {subtract} END",
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_update AFTER UPDATE OF {watched} ON activities
+            BEGIN {subtract} {add} END
+            """,
+        ]
+    return statements
+
+
+def rebuild_aggregates(conn: sqlite3.Connection) -> None:
+    """Recompute ``agg_weekly`` and ``agg_monthly`` from scratch in one transaction.
+
+    The triggers keep both tables exact; this is for repairing them, e.g.
+    after rows were written by a connection without recursive triggers.
+    """
+    with conn:
+        _fill_aggregates(conn)
+
+
+def _fill_aggregates(conn: sqlite3.Connection) -> None:
+    for table, (period, expr) in AGGREGATE_PERIODS.items():
+        row_period, row_sport = expr.format(row="activities"), _AGGREGATE_SPORT.format(row="activities")
+        conn.execute(f"DELETE FROM {table}")
+        conn.execute(
+            f"""
+            INSERT INTO {table} ({period}, sport_type, activity_count, {", ".join(_AGGREGATE_SUMS)})
+            SELECT {row_period}, {row_sport}, COUNT(*),
+                   {", ".join(f"COALESCE(SUM({c}), 0)" for c in _AGGREGATE_SUMS)}
+            FROM activities
+            WHERE {row_period} IS NOT NULL
+            GROUP BY 1, 2
+            """
+        )
+
+
+def _migration_aggregates(conn: sqlite3.Connection) -> None:
+    for statement in _aggregate_schema():
+        conn.execute(statement)
+    _fill_aggregates(conn)
+
+
+def _migration_owner_id(conn: sqlite3.Connection) -> None:
+    # Databases created while migration 1 still read EXTRACTED_COLUMNS got the column there.
+    if "owner_id" not in _activity_columns(conn):
+        conn.execute("ALTER TABLE activities ADD COLUMN owner_id INTEGER")
+    _backfill_extracted_columns(conn, {"owner_id": "$.athlete.id"})
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_activities_owner_id ON activities (owner_id)")
+
+
+ATHLETES_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS athletes (
+    athlete_id      INTEGER PRIMARY KEY,
+    name            TEXT,
+    account         TEXT NOT NULL UNIQUE,
+    active          INTEGER NOT NULL DEFAULT 1,
+    high_water_mark TEXT,
+    last_sync_at    TEXT,
+    last_status     TEXT,
+    last_error      TEXT,
+    created_at      TEXT DEFAULT (datetime('now'))
+)
+"""
+
+
+def _migration_athletes(conn: sqlite3.Connection) -> None:
+    conn.execute(ATHLETES_TABLE_SQL)
+
+
+def _migration_streams_checked(conn: sqlite3.Connection) -> None:
+    # Set when the streams endpoint was asked, even if it had nothing (404, empty).
+    conn.execute("ALTER TABLE activities ADD COLUMN streams_checked_at TEXT")
+    conn.execute(
+        """
+        UPDATE activities SET streams_checked_at = datetime('now')
+        WHERE EXISTS (SELECT 1 FROM streams WHERE streams.activity_id = activities.id)
+        """
+    )
+
+
+def _migration_state_columns(conn: sqlite3.Connection) -> None:
+    # Before versioned migrations existed init_db added these on every start,
+    # so any database past version 0 already has them.
+    columns = {
+        "content_hash": "TEXT",
+        "raw_format": "TEXT DEFAULT 'json'",
+        "resource_state": "INTEGER",
+    }
+    existing = _activity_columns(conn)
+    for column, decl in columns.items():
+        if column not in existing:
+            conn.execute(f"ALTER TABLE activities ADD COLUMN {column} {decl}")
+
+
+def _migration_detail_missing(conn: sqlite3.Connection) -> None:
+    # Set when the detail endpoint answered 404 for a stored summary.
+    conn.execute("ALTER TABLE activities ADD COLUMN detail_missing_at TEXT")
+
+
+# Schema changes applied in order on top of the tables init_db creates. The
+# database's PRAGMA user_version records how many have been applied, so each
+# runs exactly once per database. Append only; never reorder or edit.
+MIGRATIONS: list[Callable[[sqlite3.Connection], None]] = [
+    _migration_extracted_columns,
+    _migration_streams,
+    _migration_derived_metrics,
+    _migration_aggregates,
+    _migration_owner_id,
+    _migration_athletes,
+    _migration_streams_checked,
+    _migration_state_columns,
+    _migration_detail_missing,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """Apply the migrations this database has not seen yet.
+
+    Each migration runs in its own transaction together with the
+    ``user_version`` bump, so a failed migration leaves the database at the
+    previous version and is retried on the next start.
+
+    Args:
+        conn: Open SQLite connection to the activities database.
+
+    Returns:
+        Number of migrations applied.
+
+    Raises:
+        RuntimeError: If the database was created by a newer version of this package.
+    """
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(
+            f"database schema version {version} is newer than supported ({SCHEMA_VERSION})"
+        )
+    applied = 0
+    for number in range(version + 1, SCHEMA_VERSION + 1):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Another process may have migrated while we waited for the lock.
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= number:
+                conn.rollback()
+                continue
+            MIGRATIONS[number - 1](conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+            conn.commit()
+            applied += 1
+        except BaseException:
+            conn.rollback()
+            raise
+    return applied
+
 
 def init_db(db_path: str) -> None:
-    """Create the SQLite database file and the activities table if they don't exist.
+    """Create the SQLite database file and its tables if they don't exist, then migrate it.
+
+    Also switches the database to the WAL journal, which persists in the file:
+    readers then see the last committed state without waiting for a writer,
+    so ``sync.py`` and the webhook server can work on one database at once.
 
     Args:
         db_path: Filesystem path to the SQLite database file.
     """
     conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL")
     conn.execute(CREATE_TABLE_SQL)
+    conn.execute(RATE_LIMIT_TABLE_SQL)
+    conn.execute(SYNC_STATE_TABLE_SQL)
+    conn.execute(SYNC_RUNS_TABLE_SQL)
+    conn.execute(SYNC_WINDOWS_TABLE_SQL)
+    conn.execute(OAUTH_TOKENS_TABLE_SQL)
+    conn.execute(COMPRESSION_DICTS_TABLE_SQL)
     conn.commit()
+    conn.executescript(ACTIVITY_INDEXES_SQL)
+    conn.executescript(WEBHOOK_QUEUE_TABLE_SQL)
+    conn.executescript(WEBHOOK_DELIVERIES_TABLE_SQL)
+    migrate(conn)
     conn.close()
 
 
+_UPSERT_COLUMNS = (
+    "name",
+    "type",
+    "sport_type",
+    "distance",
+    "moving_time",
+    "elapsed_time",
+    "total_elevation_gain",
+    "start_date",
+    "start_date_local",
+    "timezone",
+    "raw_json",
+    "content_hash",
+    "raw_format",
+    "resource_state",
+    *EXTRACTED_COLUMNS,
+)
+
+# The WHERE clause turns re-saving an unchanged activity into a no-op: no row
+# is rewritten, so nothing reaches the WAL, the page cache or backups.
+# resource_state of a stored row; rows written before the column existed are always plain JSON.
+_STORED_RESOURCE_STATE = """
+COALESCE(
+    resource_state,
+    CASE WHEN raw_format IS NULL OR raw_format = 'json'
+         THEN json_extract(raw_json, '$.resource_state') END,
+    0
+)
+"""
+
+UPSERT_ACTIVITY_SQL = f"""
+INSERT INTO activities
+    (id, {", ".join(_UPSERT_COLUMNS)})
+VALUES
+    (:id, {", ".join(":" + column for column in _UPSERT_COLUMNS)})
+ON CONFLICT(id) DO UPDATE SET
+    {", ".join(f"{column} = excluded.{column}" for column in _UPSERT_COLUMNS)},
+    synced_at = datetime('now')
+WHERE activities.content_hash IS NOT excluded.content_hash
+"""
+
+DEFAULT_BATCH_SIZE = 200  # one Strava page
+_LOOKUP_CHUNK = 500  # ids per "WHERE id IN (...)" query
+
+
+@dataclass
+class UpsertStats:
+    """How many activities an upsert inserted, changed, or found unchanged."""
+
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+
+    @property
+    def written(self) -> int:
+        """Number of rows actually written."""
+        return self.inserted + self.updated
+
+    def __iadd__(self, other: "UpsertStats") -> "UpsertStats":
+        self.inserted += other.inserted
+        self.updated += other.updated
+        self.unchanged += other.unchanged
+        return self
+
+
+def activity_content_hash(activity: dict) -> str:
+    """Return a hash of the activity's canonical JSON (sorted keys, no whitespace).
+
+    Two payloads with the same content hash to the same value regardless of
+    key order, so the hash detects edits made on Strava.
+    """
+    canonical = json.dumps(activity, sort_keys=True, separators=(",", ":"))
+    return hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()
+
+
+def _extract(activity: dict, path: str):
+    """Return the value at a ``$.a.b`` JSON path in *activity*, or None if any key is missing."""
+    value = activity
+    for key in path.removeprefix("$.").split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def _extracted_values(activity: dict) -> dict:
+    return {column: _extract(activity, path) for column, (_, path) in EXTRACTED_COLUMNS.items()}
+
+
+def _activity_params(activity: dict, codec: RawCodec = JSON_CODEC) -> dict:
+    """Return the named SQL parameters for *activity*, including its encoded raw_json copy and hash."""
+    return {
+        **activity,
+        "raw_json": codec.encode(json.dumps(activity)),
+        "raw_format": codec.marker,
+        "resource_state": activity.get("resource_state"),
+        "content_hash": activity_content_hash(activity),
+        **_extracted_values(activity),
+    }
+
+
+def _stored_states(conn: sqlite3.Connection, ids: list[int]) -> dict[int, tuple[str | None, int]]:
+    """Return ``{id: (content_hash, resource_state)}`` for those of *ids* that are already stored."""
+    states: dict[int, tuple[str | None, int]] = {}
+    for start in range(0, len(ids), _LOOKUP_CHUNK):
+        chunk = ids[start:start + _LOOKUP_CHUNK]
+        cursor = conn.execute(
+            f"""
+            SELECT id, content_hash, {_STORED_RESOURCE_STATE} FROM activities
+            WHERE id IN ({','.join('?' * len(chunk))})
+            """,
+            chunk,
+        )
+        states.update((row[0], (row[1], row[2])) for row in cursor)
+    return states
+
+
+def _merge_summary(detail: dict, summary: dict) -> dict:
+    """Overlay a list-endpoint *summary* on a stored *detail* payload.
+
+    Nested objects are merged key by key and every ``resource_state`` keeps
+    the higher value, so fields only the detail endpoint returns survive and
+    an unchanged summary reproduces the stored payload (and its hash) exactly.
+    """
+    merged = dict(detail)
+    for key, value in summary.items():
+        current = merged.get(key)
+        if isinstance(value, dict) and isinstance(current, dict):
+            merged[key] = _merge_summary(current, value)
+        elif key == "resource_state" and isinstance(current, int) and isinstance(value, int):
+            merged[key] = max(current, value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def _stored_payload(conn: sqlite3.Connection, activity_id: int) -> dict:
+    raw, raw_format = conn.execute(
+        "SELECT raw_json, raw_format FROM activities WHERE id = ?", (activity_id,)
+    ).fetchone()
+    return json.loads(decode_raw(conn, raw, raw_format))
+
+
+def set_synchronous(conn: sqlite3.Connection, level: str) -> None:
+    """Set ``PRAGMA synchronous`` on *conn*.
+
+    ``NORMAL`` skips the fsync of the journal on every commit; a power loss can
+    then lose the last transactions, which a re-run of the sync recovers.
+
+    Args:
+        conn: Open SQLite connection.
+        level: One of ``OFF``, ``NORMAL``, ``FULL`` or ``EXTRA``.
+    """
+    if level.upper() not in {"OFF", "NORMAL", "FULL", "EXTRA"}:
+        raise ValueError(f"invalid synchronous level: {level!r}")
+    conn.execute(f"PRAGMA synchronous={level.upper()}")
+
+
 def upsert_activity(conn: sqlite3.Connection, activity: dict) -> None:
-    """Insert or replace an activity record in the database.
+    """Insert or update an activity record in the database.
 
-    The full activity dict is also serialised and stored in the raw_json column.
+    The full activity dict is also serialised and stored in the raw_json column,
+    compressed if a codec was configured with
+    :func:`strava.compression.set_write_codec`. If the stored row has the same
+    content hash, nothing is written. A summary never replaces a stored
+    detail payload; see :func:`upsert_activities`.
 
     Args:
         conn: Open SQLite connection to the activities database.
         activity: Activity dict containing at least the columns defined in CREATE_TABLE_SQL.
     """
-    conn.execute(
-        """
-        INSERT OR REPLACE INTO activities
-            (id, name, type, sport_type, distance, moving_time, elapsed_time,
-             total_elevation_gain, start_date, start_date_local, timezone, raw_json)
-        VALUES
-            (:id, :name, :type, :sport_type, :distance, :moving_time, :elapsed_time,
-             :total_elevation_gain, :start_date, :start_date_local, :timezone, :raw_json)
-        """,
-        {**activity, "raw_json": json.dumps(activity)},
-    )
+    upsert_activities(conn, [activity])
     conn.commit()
 
 
+def upsert_activities(
+    conn: sqlite3.Connection,
+    activities: Iterable[dict],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> UpsertStats:
+    """Insert or update many activity records, committing once per batch.
+
+    Each batch of *batch_size* rows is written with a single ``executemany``
+    inside one transaction, so a 200-activity page costs one commit instead of
+    200. Before writing, the stored content hashes of the batch are looked up;
+    activities whose hash matches are skipped entirely, so a batch with no
+    changes writes nothing. If a batch fails it is rolled back as a whole;
+    earlier batches stay committed.
+
+    A payload with a lower ``resource_state`` than the stored one (a list
+    summary arriving for an activity saved from the detail endpoint) is
+    merged into the stored payload instead of replacing it, so detail-only
+    fields are kept and the row stays out of :func:`get_summary_activity_ids`.
+
+    Args:
+        conn: Open SQLite connection to the activities database.
+        activities: Activity dicts, as accepted by upsert_activity.
+        batch_size: Maximum number of rows per transaction.
+
+    Returns:
+        UpsertStats with the inserted, updated and unchanged counts.
+    """
+    iterator = iter(activities)
+    stats = UpsertStats()
+    codec = get_write_codec(conn)
+    while batch := list(islice(iterator, batch_size)):
+        stored = _stored_states(conn, [activity["id"] for activity in batch])
+        changed = []
+        for activity in batch:
+            state = stored.get(activity["id"])
+            if state is not None and (activity.get("resource_state") or 0) < state[1]:
+                activity = _merge_summary(_stored_payload(conn, activity["id"]), activity)
+            row = _activity_params(activity, codec)
+            if state is None:
+                stats.inserted += 1
+            elif state[0] != row["content_hash"]:
+                stats.updated += 1
+            else:
+                stats.unchanged += 1
+                continue
+            changed.append(row)
+        if changed:
+            with conn:
+                conn.executemany(UPSERT_ACTIVITY_SQL, changed)
+    return stats
+
+
 def get_activity_ids(conn: sqlite3.Connection) -> set[int]:
     """Return the set of all activity IDs currently stored in the database.
 
@@ -69,6 +853,271 @@ def get_activity_ids(conn: sqlite3.Connection) -> set[int]:
     return {row[0] for row in cursor.fetchall()}
 
 
+def filter_new_ids(conn: sqlite3.Connection, ids: Iterable[int]) -> list[int]:
+    """Return those of *ids* that are not stored yet, in their original order.
+
+    Looks the IDs up by primary key in chunks of ``WHERE id IN (...)``, so the
+    cost depends on the size of one incoming page, not of the table. Prefer
+    this over :func:`get_activity_ids` when checking pages during a sync.
+
+    Args:
+        conn: Open SQLite connection to the activities database.
+        ids: Candidate activity IDs, e.g. one page from the API.
+
+    Returns:
+        IDs with no row in ``activities``.
+    """
+    ids = list(ids)
+    stored: set[int] = set()
+    for start in range(0, len(ids), _LOOKUP_CHUNK):
+        chunk = ids[start:start + _LOOKUP_CHUNK]
+        cursor = conn.execute(
+            f"SELECT id FROM activities WHERE id IN ({','.join('?' * len(chunk))})", chunk
+        )
+        stored.update(row[0] for row in cursor)
+    return [activity_id for activity_id in ids if activity_id not in stored]
+
+
+def get_summary_activity_ids(conn: sqlite3.Connection) -> list[int]:
+    """Return IDs of stored activities that only hold the summary payload.
+
+    Activities saved from the list endpoint have ``resource_state`` 2; a full
+    detail fetch returns ``resource_state`` 3. Activities marked by
+    :func:`mark_details_missing` are left out.
+
+    Args:
+        conn: Open SQLite connection to the activities database.
+
+    Returns:
+        List of integer activity IDs, newest first.
+    """
+    cursor = conn.execute(
+        f"""
+        SELECT id FROM activities
+        WHERE {_STORED_RESOURCE_STATE} < 3 AND detail_missing_at IS NULL
+        ORDER BY start_date DESC
+        """
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def mark_details_missing(conn: sqlite3.Connection, activity_ids: Iterable[int]) -> None:
+    """Record that the detail endpoint answered 404 for *activity_ids*, and commit.
+
+    The activity was deleted or made private after it was listed; marking it
+    keeps :func:`get_summary_activity_ids` from asking for it on every run.
+    The stored summary is kept.
+    """
+    with conn:
+        conn.executemany(
+            "UPDATE activities SET detail_missing_at = datetime('now') WHERE id = ?",
+            [(activity_id,) for activity_id in activity_ids],
+        )
+
+
+def get_sync_state(conn: sqlite3.Connection, key: str) -> str | None:
+    """Return the value stored under *key* in the sync_state table.
+
+    Args:
+        conn: Open SQLite connection to the activities database.
+        key: State key, e.g. HIGH_WATER_MARK_KEY.
+
+    Returns:
+        Stored string value, or None if the key has never been set.
+    """
+    row = conn.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+    return None if row is None else row[0]
+
+
+def set_sync_state(conn: sqlite3.Connection, key: str, value: str) -> None:
+    """Store *value* under *key* in the sync_state table and commit.
+
+    Args:
+        conn: Open SQLite connection to the activities database.
+        key: State key.
+        value: Value to store.
+    """
+    conn.execute(
+        """
+        INSERT INTO sync_state (key, value, updated_at) VALUES (?, ?, datetime('now'))
+        ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+        """,
+        (key, value),
+    )
+    conn.commit()
+
+
+def get_high_water_mark(conn: sqlite3.Connection) -> str | None:
+    """Return the newest ``start_date`` recorded by a successful sync, or None.
+
+    Args:
+        conn: Open SQLite connection to the activities database.
+    """
+    return get_sync_state(conn, HIGH_WATER_MARK_KEY)
+
+
+def advance_high_water_mark(conn: sqlite3.Connection, start_date: str) -> None:
+    """Move the high-water mark forward to *start_date*; an older date is ignored.
+
+    Strava ``start_date`` values are uniform ISO 8601 UTC strings, so they
+    compare correctly as text.
+
+    Args:
+        conn: Open SQLite connection to the activities database.
+        start_date: ``start_date`` of the newest activity the sync stored or saw.
+    """
+    current = get_high_water_mark(conn)
+    if current is None or start_date > current:
+        set_sync_state(conn, HIGH_WATER_MARK_KEY, start_date)
+
+
+def create_sync_run(
+    conn: sqlite3.Connection,
+    run_id: str,
+    params: dict,
+    windows: list[tuple[int | None, int | None]],
+) -> None:
+    """Start a journal entry for a sync run together with its time windows.
+
+    Args:
+        conn: Open SQLite connection to the activities database.
+        run_id: Unique identifier of the run.
+        params: JSON-serialisable parameters the run was started with.
+        windows: ``(after, before)`` Unix timestamp pairs the run pages through.
+    """
+    with conn:
+        conn.execute(
+            "INSERT INTO sync_runs (run_id, params) VALUES (?, ?)",
+            (run_id, json.dumps(params)),
+        )
+    create_sync_windows(conn, run_id, windows)
+
+
+def update_sync_run(
+    conn: sqlite3.Connection,
+    run_id: str,
+    status: str | None = None,
+    newest_start_date: str | None = None,
+    error: str | None = None,
+) -> None:
+    """Update the journal entry of a sync run; None arguments leave fields unchanged.
+
+    ``newest_start_date`` only ever moves forward.
+
+    Args:
+        conn: Open SQLite connection to the activities database.
+        run_id: Identifier of the run.
+        status: New status: ``running``, ``failed`` or ``completed``.
+        newest_start_date: Newest ``start_date`` stored by the run so far.
+        error: Error message explaining a failure.
+    """
+    with conn:
+        conn.execute(
+            """
+            UPDATE sync_runs SET
+                status = COALESCE(?, status),
+                newest_start_date = CASE
+                    WHEN newest_start_date IS NULL OR ? > newest_start_date THEN ?
+                    ELSE newest_start_date END,
+                error = COALESCE(?, error),
+                updated_at = datetime('now')
+            WHERE run_id = ?
+            """,
+            (status, newest_start_date, newest_start_date, error, run_id),
+        )
+
+
+def get_resumable_sync_run(conn: sqlite3.Connection) -> dict | None:
+    """Return the most recent sync run that did not complete, or None.
+
+    Only the latest run is considered: once a newer run has completed, an
+    older interrupted one is superseded.
+
+    Args:
+        conn: Open SQLite connection to the activities database.
+
+    Returns:
+        Dict with run_id, params (decoded), status, newest_start_date and error.
+    """
+    row = conn.execute(
+        """
+        SELECT run_id, params, status, newest_start_date, error FROM sync_runs
+        ORDER BY started_at DESC, rowid DESC LIMIT 1
+        """
+    ).fetchone()
+    if row is None or row[2] == "completed":
+        return None
+    run_id, params, status, newest_start_date, error = row
+    return {
+        "run_id": run_id,
+        "params": json.loads(params) if params else {},
+        "status": status,
+        "newest_start_date": newest_start_date,
+        "error": error,
+    }
+
+
+def create_sync_windows(
+    conn: sqlite3.Connection, run_id: str, windows: list[tuple[int | None, int | None]]
+) -> None:
+    """Register the ``(after, before)`` time windows a sync run is going to page through.
+
+    Args:
+        conn: Open SQLite connection to the activities database.
+        run_id: Identifier of the sync run.
+        windows: ``(after, before)`` Unix timestamp pairs; either bound may be None.
+    """
+    with conn:
+        conn.executemany(
+            "INSERT INTO sync_windows (run_id, window_index, after_ts, before_ts) VALUES (?, ?, ?, ?)",
+            [(run_id, i, after, before) for i, (after, before) in enumerate(windows)],
+        )
+
+
+def checkpoint_sync_window(
+    conn: sqlite3.Connection, run_id: str, window_index: int, page: int, done: bool
+) -> None:
+    """Record that *page* of a window has been stored, and whether the window is finished.
+
+    Args:
+        conn: Open SQLite connection to the activities database.
+        run_id: Identifier of the sync run.
+        window_index: Index of the window within the run.
+        page: Last page number whose activities are committed.
+        done: True once the window has no further pages.
+    """
+    with conn:
+        conn.execute(
+            """
+            UPDATE sync_windows
+            SET last_page = MAX(last_page, ?), done = ?, updated_at = datetime('now')
+            WHERE run_id = ? AND window_index = ?
+            """,
+            (page, int(done), run_id, window_index),
+        )
+
+
+def get_sync_windows(conn: sqlite3.Connection, run_id: str) -> list[dict]:
+    """Return the windows of a sync run with their checkpoints, ordered by index.
+
+    Args:
+        conn: Open SQLite connection to the activities database.
+        run_id: Identifier of the sync run.
+
+    Returns:
+        List of dicts with window_index, after_ts, before_ts, last_page and done keys.
+    """
+    cursor = conn.execute(
+        """
+        SELECT window_index, after_ts, before_ts, last_page, done FROM sync_windows
+        WHERE run_id = ? ORDER BY window_index
+        """,
+        (run_id,),
+    )
+    keys = ("window_index", "after_ts", "before_ts", "last_page", "done")
+    return [dict(zip(keys, row)) for row in cursor.fetchall()]
+
+
 def get_activity(conn: sqlite3.Connection, activity_id: int) -> dict | None:
     """Retrieve a single activity record by its ID.
 
@@ -77,11 +1126,248 @@ def get_activity(conn: sqlite3.Connection, activity_id: int) -> dict | None:
         activity_id: Numeric Strava activity ID to look up.
 
     Returns:
-        Activity record as a plain dict, or None if no matching row exists.
+        Activity record as a plain dict with ``raw_json`` decoded to JSON text
+        whatever its stored encoding, or None if no matching row exists.
     """
     conn.row_factory = sqlite3.Row
     cursor = conn.execute("SELECT * FROM activities WHERE id = ?", (activity_id,))
     row = cursor.fetchone()
     if row is None:
         return None
-    return dict(row)
+    activity = dict(row)
+    activity["raw_json"] = decode_raw(conn, activity["raw_json"], activity["raw_format"])
+    return activity
+
+
+def recompress_activities(
+    conn: sqlite3.Connection,
+    codec: RawCodec,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    progress: Callable[[int], None] | None = None,
+) -> int:
+    """Re-encode every stored raw_json not yet in *codec*'s format, one transaction per batch.
+
+    Rows are walked in id order with keyset pagination, so the webhook writer
+    only ever waits for one batch, and an interrupted run simply continues
+    with the rows still in another format when called again. Content hashes
+    do not change.
+
+    Args:
+        conn: Open SQLite connection to the activities database.
+        codec: Target encoding; its dictionary must already be stored.
+        batch_size: Rows rewritten per transaction.
+        progress: Called with the running count after each batch.
+
+    Returns:
+        Number of rows rewritten.
+    """
+    marker = codec.marker
+    rewritten = 0
+    last_id = -1
+    while True:
+        rows = conn.execute(
+            """
+            SELECT id, raw_json, raw_format FROM activities
+            WHERE id > ? AND raw_json IS NOT NULL AND raw_format IS NOT ?
+            ORDER BY id LIMIT ?
+            """,
+            (last_id, marker, batch_size),
+        ).fetchall()
+        if not rows:
+            return rewritten
+        updates = []
+        for activity_id, raw, raw_format in rows:
+            text = decode_raw(conn, raw, raw_format)
+            resource_state = json.loads(text).get("resource_state")
+            updates.append((codec.encode(text), marker, resource_state, activity_id))
+        with conn:
+            conn.executemany(
+                """
+                UPDATE activities
+                SET raw_json = ?, raw_format = ?, resource_state = ?
+                WHERE id = ?
+                """,
+                updates,
+            )
+        rewritten += len(rows)
+        last_id = rows[-1][0]
+        if progress is not None:
+            progress(rewritten)
+
+
+def upsert_streams(conn: sqlite3.Connection, activity_id: int, streams: dict) -> int:
+    """Store the streams of one activity, replacing any stored before, and commit.
+
+    Each channel is packed by :func:`strava.streams.encode_stream` into a
+    typed-array BLOB of deltas instead of a JSON list; channels this package
+    does not know are skipped. Cached derived metrics of the activity are
+    dropped so :func:`strava.analytics.refresh_derived_metrics` recomputes them.
+    The activity is marked as checked (``streams_checked_at``) even when
+    nothing is stored, so an activity without streams is not asked for again;
+    pass ``{}`` to record a 404.
+
+    Args:
+        conn: Open SQLite connection to the activities database.
+        activity_id: Numeric Strava activity ID.
+        streams: Response of ``get_activity_streams``, keyed by stream type.
+
+    Returns:
+        Number of channels stored.
+    """
+    rows = []
+    for stream_type, stream in streams.items():
+        try:
+            packed = encode_stream(stream_type, stream["data"])
+        except KeyError:
+            continue
+        rows.append(
+            (
+                activity_id,
+                stream_type,
+                packed.typecode,
+                packed.scale,
+                packed.width,
+                packed.length,
+                packed.data,
+            )
+        )
+    with conn:
+        conn.execute("DELETE FROM streams WHERE activity_id = ?", (activity_id,))
+        # Metrics computed from the old streams are stale now.
+        conn.execute("DELETE FROM derived_metrics WHERE activity_id = ?", (activity_id,))
+        conn.executemany(
+            """
+            INSERT INTO streams (activity_id, stream_type, typecode, scale, width, length, data)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            rows,
+        )
+        conn.execute(
+            "UPDATE activities SET streams_checked_at = datetime('now') WHERE id = ?",
+            (activity_id,),
+        )
+    return len(rows)
+
+
+def get_streams(
+    conn: sqlite3.Connection,
+    activity_id: int,
+    types: Iterable[str] | None = None,
+    as_numpy: bool = False,
+) -> dict:
+    """Return the stored streams of one activity.
+
+    Args:
+        conn: Open SQLite connection to the activities database.
+        activity_id: Numeric Strava activity ID.
+        types: Only these channels, e.g. ``("time", "watts")``; None for all.
+        as_numpy: Return NumPy arrays (needs numpy) instead of ``array.array``.
+
+    Returns:
+        ``{stream_type: values}``; empty if the activity has no streams.
+    """
+    sql = "SELECT stream_type, typecode, scale, width, length, data FROM streams WHERE activity_id = ?"
+    params: list = [activity_id]
+    if types is not None:
+        types = list(types)
+        sql += f" AND stream_type IN ({','.join('?' * len(types))})"
+        params.extend(types)
+    decode = decode_stream_numpy if as_numpy else decode_stream
+    return {
+        stream_type: decode(PackedStream(typecode, scale, width, length, data))
+        for stream_type, typecode, scale, width, length, data in conn.execute(sql, params)
+    }
+
+
+def get_activity_ids_without_streams(conn: sqlite3.Connection) -> list[int]:
+    """Return IDs of stored activities whose streams were never fetched, newest first.
+
+    Activities the endpoint had no streams for (manual entries) were marked
+    by :func:`upsert_streams` and are not returned again.
+    """
+    cursor = conn.execute(
+        """
+        SELECT id FROM activities
+        WHERE streams_checked_at IS NULL
+        ORDER BY start_date DESC
+        """
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+DEFAULT_PURGE_CHUNK = 500  # activities deleted per transaction by purge_athlete
+
+
+def delete_activities(conn: sqlite3.Connection, activity_ids: Iterable[int]) -> int:
+    """Delete activities together with their streams and cached metrics. Does not commit.
+
+    The aggregate triggers take the activities out of ``agg_weekly`` and
+    ``agg_monthly``. All-time bests they held are left to
+    :func:`strava.analytics.forget_bests`.
+
+    Args:
+        conn: Open SQLite connection to the activities database.
+        activity_ids: IDs to delete; unknown IDs are ignored.
+
+    Returns:
+        Number of activities deleted.
+    """
+    ids = list(activity_ids)
+    deleted = 0
+    for start in range(0, len(ids), _LOOKUP_CHUNK):
+        chunk = ids[start:start + _LOOKUP_CHUNK]
+        placeholders = ",".join("?" * len(chunk))
+        conn.execute(f"DELETE FROM streams WHERE activity_id IN ({placeholders})", chunk)
+        conn.execute(f"DELETE FROM derived_metrics WHERE activity_id IN ({placeholders})", chunk)
+        deleted += conn.execute(
+            f"DELETE FROM activities WHERE id IN ({placeholders})", chunk
+        ).rowcount
+    return deleted
+
+
+def purge_athlete(
+    conn: sqlite3.Connection,
+    athlete_id: int,
+    chunk_size: int = DEFAULT_PURGE_CHUNK,
+    progress: Callable[[int], None] | None = None,
+) -> int:
+    """Delete everything stored for *athlete_id*, *chunk_size* activities per transaction.
+
+    Used when an athlete revokes access; their ``athletes`` row and stored
+    OAuth tokens are removed last. Each chunk commits on its own, so
+    other writers (the webhook ingress, the sync) only ever wait for one
+    chunk instead of the whole purge; an interrupted purge continues where it
+    stopped when called again.
+
+    Args:
+        conn: Open SQLite connection to the activities database.
+        athlete_id: Strava athlete ID (``activities.owner_id``).
+        chunk_size: Activities deleted per transaction.
+        progress: Called with the running count after each chunk.
+
+    Returns:
+        Number of activities deleted.
+    """
+    purged = 0
+    while True:
+        with conn:
+            ids = [
+                row[0]
+                for row in conn.execute(
+                    "SELECT id FROM activities WHERE owner_id = ? LIMIT ?", (athlete_id, chunk_size)
+                )
+            ]
+            purged += delete_activities(conn, ids)
+        if not ids:
+            break
+        if progress is not None:
+            progress(purged)
+    with conn:
+        conn.execute("DELETE FROM derived_metrics WHERE athlete_id = ?", (athlete_id,))
+        conn.execute("DELETE FROM athlete_bests WHERE athlete_id = ?", (athlete_id,))
+        conn.execute(
+            "DELETE FROM oauth_tokens WHERE account IN (SELECT account FROM athletes WHERE athlete_id = ?)",
+            (athlete_id,),
+        )
+        conn.execute("DELETE FROM athletes WHERE athlete_id = ?", (athlete_id,))
+    return purged
@@ -0,0 +1,412 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+
+from strava.db import connect
+
+log = logging.getLogger(__name__)
+
+DEFAULT_VISIBILITY_TIMEOUT = 60.0  # seconds a claimed event stays hidden from other workers
+# Leases of events still being processed are extended this many times per visibility timeout.
+HEARTBEATS_PER_TIMEOUT = 3
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_RETRY_BASE = 2.0
+DEFAULT_RETRY_CAP = 300.0
+
+
+@dataclass
+class QueuedEvent:
+    """A webhook event claimed from the durable queue."""
+
+    id: int
+    event: dict
+    attempts: int  # including the current one
+    lease_until: float  # available_at written by the claim; identifies the claim in later updates
+
+
+def _coalesce_key(event: dict) -> str | None:
+    """Return the key under which *event* may be merged with other pending events.
+
+    Only activity events coalesce: a burst of ``create`` and ``update``
+    events ends in the same single ``get_activity`` fetch and upsert, and a
+    ``delete`` makes any pending fetch pointless.
+    """
+    if event.get("object_type") != "activity":
+        return None
+    if event.get("aspect_type") not in ("create", "update", "delete"):
+        return None
+    object_id = event.get("object_id")
+    if object_id is None:
+        return None
+    return f"activity:{object_id}"
+
+
+def merge_events(pending: dict, incoming: dict) -> dict:
+    """Collapse two events for the same activity into one.
+
+    A ``create`` absorbs any later updates, since fetching the activity after
+    the edits returns the edited version anyway. The ``updates`` dicts are
+    merged so the stored payload still lists every changed field. A
+    ``delete`` wins over everything: the activity is gone and must not be
+    fetched.
+    """
+    if "delete" in (pending.get("aspect_type"), incoming.get("aspect_type")):
+        merged = {**pending, **incoming, "aspect_type": "delete"}
+        merged.pop("updates", None)
+        return merged
+    merged = {**pending, **incoming}
+    if "create" in (pending.get("aspect_type"), incoming.get("aspect_type")):
+        merged["aspect_type"] = "create"
+    updates = {**pending.get("updates", {}), **incoming.get("updates", {})}
+    if updates:
+        merged["updates"] = updates
+    return merged
+
+
+def enqueue_event(conn: sqlite3.Connection, event: dict, coalesce_window: float = 0.0) -> int:
+    """Append a webhook event to the durable queue and commit.
+
+    With a positive *coalesce_window* the event is held back for that many
+    seconds, and activity events arriving for the same
+    ``object_id`` in the meantime are merged into the waiting row instead of
+    being queued again. The deadline is set by the first event, so a steady
+    stream of edits cannot postpone processing indefinitely. Events already
+    claimed by a worker are never merged into.
+
+    If *conn* already has an open transaction the event joins it and the
+    caller commits; otherwise the function runs and commits its own.
+
+    Args:
+        conn: Open SQLite connection to the activities database.
+        event: Parsed Strava webhook payload.
+        coalesce_window: Debounce window in seconds; 0 disables coalescing.
+
+    Returns:
+        ID of the queued row, which is the existing row's ID if the event was merged.
+    """
+    if conn.in_transaction:
+        return _insert_or_merge(conn, event, coalesce_window)
+    with conn:
+        # Take the write lock before looking for a row to merge into, so two
+        # concurrent deliveries for one activity cannot both insert.
+        conn.execute("BEGIN IMMEDIATE")
+        return _insert_or_merge(conn, event, coalesce_window)
+
+
+def _insert_or_merge(conn: sqlite3.Connection, event: dict, coalesce_window: float) -> int:
+    now = time.time()
+    key = _coalesce_key(event) if coalesce_window > 0 else None
+    if key is not None:
+        row = conn.execute(
+            """
+            SELECT id, payload FROM webhook_queue
+            WHERE coalesce_key = ? AND attempts = 0 AND status = 'pending'
+            ORDER BY id LIMIT 1
+            """,
+            (key,),
+        ).fetchone()
+        if row is not None:
+            merged = merge_events(json.loads(row[1]), event)
+            conn.execute(
+                "UPDATE webhook_queue SET payload = ? WHERE id = ?",
+                (json.dumps(merged), row[0]),
+            )
+            return row[0]
+    cursor = conn.execute(
+        """
+        INSERT INTO webhook_queue (payload, coalesce_key, available_at, created_at)
+        VALUES (?, ?, ?, ?)
+        """,
+        (json.dumps(event), key, now + coalesce_window, now),
+    )
+    return cursor.lastrowid
+
+
+def claim_event(
+    conn: sqlite3.Connection, visibility_timeout: float = DEFAULT_VISIBILITY_TIMEOUT
+) -> QueuedEvent | None:
+    """Atomically claim the oldest available event.
+
+    The claimed row is not deleted but hidden for *visibility_timeout*
+    seconds. If the worker dies before acknowledging it, the event becomes
+    visible again and another worker picks it up, so no event is lost. A
+    worker that is still busy keeps the event hidden with
+    :func:`extend_lease`.
+
+    Args:
+        conn: Open SQLite connection to the activities database.
+        visibility_timeout: Seconds before an unacknowledged event is redelivered.
+
+    Returns:
+        The claimed event, or None if nothing is available.
+    """
+    now = time.time()
+    with conn:
+        row = conn.execute(
+            """
+            UPDATE webhook_queue
+            SET attempts = attempts + 1, available_at = ?
+            WHERE id = (
+                SELECT id FROM webhook_queue
+                WHERE status = 'pending' AND available_at <= ?
+                ORDER BY available_at, id
+                LIMIT 1
+            )
+            RETURNING id, payload, attempts, available_at
+            """,
+            (now + visibility_timeout, now),
+        ).fetchone()
+    if row is None:
+        return None
+    return QueuedEvent(id=row[0], event=json.loads(row[1]), attempts=row[2], lease_until=row[3])
+
+
+# Matches the row only while the claim recorded in a QueuedEvent is still held:
+# a redelivery to another worker or a retry scheduled since rewrites available_at.
+_HELD_CLAIM = "id = ? AND status = 'pending' AND available_at = ?"
+
+
+def extend_lease(
+    conn: sqlite3.Connection,
+    queued: QueuedEvent,
+    visibility_timeout: float = DEFAULT_VISIBILITY_TIMEOUT,
+) -> bool:
+    """Keep a claimed event hidden for another *visibility_timeout* seconds.
+
+    Returns:
+        True if the lease was extended, False if the claim was lost because
+        the lease had expired and the event was claimed again.
+    """
+    lease_until = time.time() + visibility_timeout
+    with conn:
+        cursor = conn.execute(
+            f"UPDATE webhook_queue SET available_at = ? WHERE {_HELD_CLAIM}",
+            (lease_until, queued.id, queued.lease_until),
+        )
+    if cursor.rowcount == 0:
+        return False
+    queued.lease_until = lease_until
+    return True
+
+
+def ack_event(conn: sqlite3.Connection, queued: QueuedEvent) -> bool:
+    """Remove a successfully processed event from the queue.
+
+    Returns:
+        True if removed, False if the claim was lost and the row left to its new holder.
+    """
+    with conn:
+        cursor = conn.execute(
+            f"DELETE FROM webhook_queue WHERE {_HELD_CLAIM}", (queued.id, queued.lease_until)
+        )
+    return cursor.rowcount == 1
+
+
+def fail_event(
+    conn: sqlite3.Connection,
+    queued: QueuedEvent,
+    error: str,
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+    retry_base: float = DEFAULT_RETRY_BASE,
+    retry_cap: float = DEFAULT_RETRY_CAP,
+) -> bool:
+    """Record a failed processing attempt, scheduling a retry or dead-lettering the event.
+
+    Retries back off exponentially: ``min(retry_cap, retry_base * 2**(attempts - 1))``.
+    Nothing is recorded if the claim was lost; the event's new holder decides.
+
+    Args:
+        conn: Open SQLite connection to the activities database.
+        queued: The event whose processing failed.
+        error: Description of the failure, kept in ``last_error``.
+        max_attempts: Attempts after which the event is moved to the dead-letter state.
+        retry_base: Delay before the first retry, in seconds.
+        retry_cap: Maximum delay between retries, in seconds.
+
+    Returns:
+        True if the event was dead-lettered, False if it will be retried or
+        the claim was lost.
+    """
+    dead = queued.attempts >= max_attempts
+    delay = min(retry_cap, retry_base * 2 ** (queued.attempts - 1))
+    with conn:
+        cursor = conn.execute(
+            f"""
+            UPDATE webhook_queue
+            SET status = ?, available_at = ?, last_error = ?
+            WHERE {_HELD_CLAIM}
+            """,
+            (
+                "dead" if dead else "pending",
+                time.time() + delay,
+                error,
+                queued.id,
+                queued.lease_until,
+            ),
+        )
+    return dead and cursor.rowcount == 1
+
+
+def get_dead_events(conn: sqlite3.Connection) -> list[dict]:
+    """Return dead-lettered events with their attempt count and last error, oldest first."""
+    cursor = conn.execute(
+        """
+        SELECT id, payload, attempts, last_error FROM webhook_queue
+        WHERE status = 'dead' ORDER BY id
+        """
+    )
+    return [
+        {"id": row[0], "event": json.loads(row[1]), "attempts": row[2], "last_error": row[3]}
+        for row in cursor.fetchall()
+    ]
+
+
+def requeue_dead_events(conn: sqlite3.Connection) -> int:
+    """Give every dead-lettered event a fresh set of attempts; return how many were requeued."""
+    with conn:
+        cursor = conn.execute(
+            """
+            UPDATE webhook_queue SET status = 'pending', attempts = 0, available_at = ?
+            WHERE status = 'dead'
+            """,
+            (time.time(),),
+        )
+    return cursor.rowcount
+
+
+class WorkerPool:
+    """Background threads that drain the webhook queue.
+
+    Each worker owns its own SQLite connection, claims one event at a time and
+    passes it to *handler*. A handler that returns normally acknowledges the
+    event; an exception schedules a retry or, after *max_attempts*, moves the
+    event to the dead-letter state. Idle workers poll every *poll_interval*
+    seconds or wake up immediately when :meth:`notify` is called.
+
+    Handlers may take longer than *visibility_timeout* (API retries, rate
+    limiter sleeps), so a heartbeat thread extends the lease of every event
+    in flight :data:`HEARTBEATS_PER_TIMEOUT` times per timeout. Only a
+    crashed process stops renewing its leases and has its events redelivered.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        handler: Callable[[dict, sqlite3.Connection], object],
+        workers: int = 2,
+        visibility_timeout: float = DEFAULT_VISIBILITY_TIMEOUT,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        poll_interval: float = 1.0,
+    ) -> None:
+        """Configure the pool; threads start on :meth:`start`.
+
+        Args:
+            db_path: Path to the SQLite database holding the queue.
+            handler: Called as ``handler(event, conn)`` for every claimed event.
+            workers: Number of worker threads.
+            visibility_timeout: Seconds before an unacknowledged event is redelivered.
+            max_attempts: Attempts before an event is dead-lettered.
+            poll_interval: Seconds an idle worker waits before polling again.
+        """
+        self.db_path = db_path
+        self.handler = handler
+        self.workers = workers
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._threads: list[threading.Thread] = []
+        self._in_flight: dict[int, QueuedEvent] = {}
+        self._lease_lock = threading.Lock()
+
+    def start(self) -> None:
+        """Start the worker threads and the lease heartbeat."""
+        targets = [(self._run, f"webhook-worker-{i}") for i in range(self.workers)]
+        targets.append((self._heartbeat, "webhook-lease-heartbeat"))
+        for target, name in targets:
+            thread = threading.Thread(target=target, daemon=True, name=name)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float | None = None) -> None:
+        """Ask the workers to finish their current event and exit, then wait for them."""
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads.clear()
+
+    def notify(self) -> None:
+        """Wake idle workers because a new event was enqueued."""
+        self._wakeup.set()
+
+    def _run(self) -> None:
+        conn = connect(self.db_path)
+        try:
+            while not self._stop.is_set():
+                if not self.process_one(conn):
+                    self._wakeup.wait(self.poll_interval)
+                    self._wakeup.clear()
+        finally:
+            conn.close()
+
+    def _heartbeat(self) -> None:
+        conn = connect(self.db_path)
+        try:
+            while not self._stop.wait(self.visibility_timeout / HEARTBEATS_PER_TIMEOUT):
+                self.extend_leases(conn)
+        finally:
+            conn.close()
+
+    def extend_leases(self, conn: sqlite3.Connection) -> None:
+        """Extend the lease of every event a worker of this pool is processing."""
+        with self._lease_lock:
+            for queued in list(self._in_flight.values()):
+                try:
+                    if not extend_lease(conn, queued, self.visibility_timeout):
+                        log.warning("webhook event %s: lease lost to another worker", queued.id)
+                        del self._in_flight[queued.id]
+                except sqlite3.Error as e:
+                    log.warning("webhook event %s: extending lease failed: %r", queued.id, e)
+
+    def process_one(self, conn: sqlite3.Connection) -> bool:
+        """Claim and process a single event on *conn*.
+
+        Returns:
+            True if an event was claimed, False if the queue had nothing available.
+        """
+        queued = claim_event(conn, self.visibility_timeout)
+        if queued is None:
+            return False
+        with self._lease_lock:
+            self._in_flight[queued.id] = queued
+        try:
+            self.handler(queued.event, conn)
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            self._release(queued)
+            dead = fail_event(conn, queued, repr(e), self.max_attempts)
+            log.warning(
+                "webhook event %s failed (attempt %s%s): %r",
+                queued.id,
+                queued.attempts,
+                ", dead-lettered" if dead else "",
+                e,
+            )
+        else:
+            self._release(queued)
+            if not ack_event(conn, queued):
+                log.warning("webhook event %s processed after its lease was lost", queued.id)
+        return True
+
+    def _release(self, queued: QueuedEvent) -> None:
+        # Once out of _in_flight the heartbeat no longer rewrites lease_until,
+        # so ack/fail match on the value it last stored.
+        with self._lease_lock:
+            self._in_flight.pop(queued.id, None)
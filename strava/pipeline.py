@@ -0,0 +1,172 @@
+import queue
+import threading
+import time
+from collections.abc import Callable, Iterator, Sequence
+from dataclasses import dataclass
+from typing import Generic, TypeVar
+
+T = TypeVar("T")
+
+DEFAULT_PREFETCH = 2
+_POLL_INTERVAL = 0.1
+
+
+@dataclass
+class Item(Generic[T]):
+    """One produced item, tagged with the index of the producer that made it."""
+
+    source: int
+    value: T
+
+
+@dataclass
+class PipelineStats:
+    """Per-stage timings of one pipeline run, in seconds.
+
+    ``fetch_seconds`` is the time producers spent producing items (network),
+    ``write_seconds`` the time the consumer spent consuming them (disk).
+    ``producer_blocked_seconds`` grows when the queue is full, i.e. the
+    consumer is the bottleneck; ``consumer_idle_seconds`` grows when the queue
+    is empty, i.e. the producers are.
+    """
+
+    items: int = 0
+    batches: int = 0
+    fetch_seconds: float = 0.0
+    write_seconds: float = 0.0
+    producer_blocked_seconds: float = 0.0
+    consumer_idle_seconds: float = 0.0
+    wall_seconds: float = 0.0
+
+    @property
+    def bottleneck(self) -> str:
+        """Return ``"network"`` or ``"disk"``, whichever stage the other one waited on more."""
+        if self.consumer_idle_seconds >= self.producer_blocked_seconds:
+            return "network"
+        return "disk"
+
+
+_DONE = object()
+
+
+class _ProducerError:
+    def __init__(self, exc: BaseException) -> None:
+        self.exc = exc
+
+
+def run_pipeline(
+    producers: Sequence[Callable[[], Iterator[T]]],
+    consume: Callable[[list[Item[T]]], None],
+    prefetch: int = DEFAULT_PREFETCH,
+    max_batch: int = 8,
+) -> PipelineStats:
+    """Run *producers* in background threads and feed their items to *consume*.
+
+    Every producer runs in its own thread and pushes items into one bounded
+    queue of size *prefetch*; once the queue is full producers block, so
+    memory stays flat however far ahead the network could get. The calling
+    thread drains the queue and passes everything currently available (up to
+    *max_batch* items) to *consume* in one call, which lets it write several
+    pages in a single transaction. Because *consume* runs in the calling
+    thread it may use thread-bound resources such as a SQLite connection.
+
+    If a producer raises, the items it produced before the error are still
+    consumed, the remaining producers are stopped and the exception is
+    re-raised here. An exception from *consume* stops the producers as well.
+
+    Args:
+        producers: Zero-argument callables returning iterators of items.
+        consume: Called with a non-empty list of items in arrival order.
+        prefetch: Maximum number of items buffered between the stages.
+        max_batch: Maximum number of items handed to *consume* at once.
+
+    Returns:
+        PipelineStats with the per-stage timings.
+    """
+    stats = PipelineStats()
+    stats_lock = threading.Lock()
+    buffer: queue.Queue = queue.Queue(maxsize=max(prefetch, 1))
+    stop = threading.Event()
+
+    def put(entry) -> bool:
+        started = time.perf_counter()
+        try:
+            while not stop.is_set():
+                try:
+                    buffer.put(entry, timeout=_POLL_INTERVAL)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        finally:
+            with stats_lock:
+                stats.producer_blocked_seconds += time.perf_counter() - started
+
+    def run_producer(index: int, producer: Callable[[], Iterator[T]]) -> None:
+        try:
+            iterator = iter(producer())
+            while not stop.is_set():
+                started = time.perf_counter()
+                try:
+                    value = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    with stats_lock:
+                        stats.fetch_seconds += time.perf_counter() - started
+                if not put(Item(index, value)):
+                    return
+        except BaseException as exc:  # handed over to the consuming thread
+            put(_ProducerError(exc))
+            return
+        put(_DONE)
+
+    threads = [
+        threading.Thread(target=run_producer, args=(i, p), daemon=True, name=f"pipeline-producer-{i}")
+        for i, p in enumerate(producers)
+    ]
+    wall_started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+
+    running = len(threads)
+    error: BaseException | None = None
+    try:
+        while running:
+            started = time.perf_counter()
+            entries = [buffer.get()]
+            stats.consumer_idle_seconds += time.perf_counter() - started
+            while len(entries) < max_batch:
+                try:
+                    entries.append(buffer.get_nowait())
+                except queue.Empty:
+                    break
+
+            batch: list[Item[T]] = []
+            for entry in entries:
+                if entry is _DONE:
+                    running -= 1
+                elif isinstance(entry, _ProducerError):
+                    running -= 1
+                    if error is None:
+                        error = entry.exc
+                        stop.set()
+                else:
+                    batch.append(entry)
+            if batch:
+                started = time.perf_counter()
+                consume(batch)
+                stats.write_seconds += time.perf_counter() - started
+                stats.items += len(batch)
+                stats.batches += 1
+            if error is not None:
+                break
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        stats.wall_seconds = time.perf_counter() - wall_started
+
+    if error is not None:
+        raise error
+    return stats
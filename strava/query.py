@@ -0,0 +1,242 @@
+import base64
+import json
+import sqlite3
+from collections.abc import Iterator
+from datetime import date, datetime, timedelta, timezone
+
+from strava.compression import decode_raw
+
+# Every column except raw_json, which dashboards rarely need and which
+# dominates the row size.
+SUMMARY_COLUMNS = (
+    "id",
+    "name",
+    "type",
+    "sport_type",
+    "distance",
+    "moving_time",
+    "elapsed_time",
+    "total_elevation_gain",
+    "start_date",
+    "start_date_local",
+    "timezone",
+    "synced_at",
+    "average_heartrate",
+    "average_watts",
+    "kudos_count",
+    "gear_id",
+)
+
+DEFAULT_CHUNK_SIZE = 500
+
+
+def _iso(value: str | date | datetime) -> str:
+    """Normalise a bound to the ``YYYY-MM-DDTHH:MM:SSZ`` form stored in ``start_date``."""
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc)
+        return value.strftime("%Y-%m-%dT%H:%M:%SZ")
+    if isinstance(value, date):
+        return value.strftime("%Y-%m-%dT00:00:00Z")
+    if len(value) == 10:  # plain YYYY-MM-DD
+        return f"{value}T00:00:00Z"
+    return value
+
+
+def encode_cursor(activity: dict) -> str:
+    """Return the cursor pointing just past *activity* in :func:`list_activities` order."""
+    raw = json.dumps([activity["start_date"], activity["id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[str, int]:
+    """Decode a cursor made by :func:`encode_cursor` into ``(start_date, id)``.
+
+    Raises:
+        ValueError: If *cursor* is malformed.
+    """
+    try:
+        start_date, activity_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"invalid cursor: {cursor!r}") from e
+    if not isinstance(start_date, str) or not isinstance(activity_id, int):
+        raise ValueError(f"invalid cursor: {cursor!r}")
+    return start_date, activity_id
+
+
+def list_activities(
+    conn: sqlite3.Connection,
+    after: str | date | datetime | None = None,
+    before: str | date | datetime | None = None,
+    sport_type: str | None = None,
+    gear_id: str | None = None,
+    min_average_heartrate: float | None = None,
+    limit: int | None = None,
+    cursor: str | None = None,
+    include_raw: bool = False,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Iterator[dict]:
+    """Yield stored activities, newest first, filtered in SQL.
+
+    Rows are read in chunks of *chunk_size* using keyset pagination on
+    ``(start_date, id)``: each chunk continues strictly below the last row of
+    the previous one, so every chunk is an index range scan over
+    ``idx_activities_start_date`` (or ``idx_activities_sport_type_start_date``
+    with *sport_type*, ``idx_activities_gear_id_start_date`` with *gear_id*) no
+    matter how deep into the history it is. Activities
+    without a ``start_date`` are never returned.
+
+    To page a dashboard, take *limit* rows, pass ``encode_cursor(last_row)`` as
+    *cursor* for the next page.
+
+    Args:
+        conn: Open SQLite connection to the activities database.
+        after: Only activities starting at or after this time (ISO string, date or datetime).
+        before: Only activities starting before this time.
+        sport_type: Only activities of this sport type, e.g. ``"Run"``.
+        gear_id: Only activities with this gear, e.g. ``"g123"``.
+        min_average_heartrate: Only activities with at least this average heart rate.
+        limit: Maximum number of rows to yield; None for all.
+        cursor: Continue after the row this cursor was made from.
+        include_raw: Also return the ``raw_json`` column, decoded to JSON text.
+        chunk_size: Rows fetched per query.
+
+    Yields:
+        Activity rows as plain dicts.
+    """
+    columns = SUMMARY_COLUMNS + (("raw_json", "raw_format") if include_raw else ())
+    where = ["start_date IS NOT NULL"]
+    params: list = []
+    if after is not None:
+        where.append("start_date >= ?")
+        params.append(_iso(after))
+    if before is not None:
+        where.append("start_date < ?")
+        params.append(_iso(before))
+    if sport_type is not None:
+        where.append("sport_type = ?")
+        params.append(sport_type)
+    if gear_id is not None:
+        where.append("gear_id = ?")
+        params.append(gear_id)
+    if min_average_heartrate is not None:
+        where.append("average_heartrate >= ?")
+        params.append(min_average_heartrate)
+    position = decode_cursor(cursor) if cursor is not None else None
+
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = chunk_size if remaining is None else min(chunk_size, remaining)
+        clauses, args = list(where), list(params)
+        if position is not None:
+            clauses.append("(start_date, id) < (?, ?)")
+            args.extend(position)
+        rows = conn.execute(
+            f"""
+            SELECT {", ".join(columns)} FROM activities
+            WHERE {" AND ".join(clauses)}
+            ORDER BY start_date DESC, id DESC
+            LIMIT ?
+            """,
+            (*args, size),
+        ).fetchall()
+        for row in rows:
+            activity = dict(zip(columns, row))
+            if include_raw:
+                activity["raw_json"] = decode_raw(conn, activity["raw_json"], activity.pop("raw_format"))
+            yield activity
+        if len(rows) < size:
+            return
+        position = (rows[-1][columns.index("start_date")], rows[-1][0])
+        if remaining is not None:
+            remaining -= len(rows)
+
+
+_TOTAL_COLUMNS = (
+    "sport_type",
+    "activity_count",
+    "distance",
+    "moving_time",
+    "elapsed_time",
+    "total_elevation_gain",
+)
+
+
+def _totals(
+    conn: sqlite3.Connection,
+    table: str,
+    period: str,
+    sport_type: str | None,
+    start: str | None,
+    end: str | None,
+) -> list[dict]:
+    where, params = [], []
+    if sport_type is not None:
+        where.append("sport_type = ?")
+        params.append(sport_type)
+    if start is not None:
+        where.append(f"{period} >= ?")
+        params.append(start)
+    if end is not None:
+        where.append(f"{period} < ?")
+        params.append(end)
+    columns = (period, *_TOTAL_COLUMNS)
+    rows = conn.execute(
+        f"""
+        SELECT {", ".join(columns)} FROM {table}
+        {"WHERE " + " AND ".join(where) if where else ""}
+        ORDER BY {period}, sport_type
+        """,
+        params,
+    ).fetchall()
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def weekly_totals(
+    conn: sqlite3.Connection,
+    sport_type: str | None = None,
+    start: str | date | None = None,
+    end: str | date | None = None,
+) -> list[dict]:
+    """Return per-week, per-sport totals from the ``agg_weekly`` rollup.
+
+    Reads one row per week and sport type instead of scanning activities;
+    the rollup is kept current by triggers on ``activities``. Weeks start on
+    Monday of the athlete's local calendar.
+
+    Args:
+        conn: Open SQLite connection to the activities database.
+        sport_type: Only this sport type, e.g. ``"Run"``.
+        start: First week to include, as a date inside it or ``YYYY-MM-DD``.
+        end: Only weeks starting before this date.
+
+    Returns:
+        Dicts with ``week`` (Monday, ``YYYY-MM-DD``), ``sport_type``,
+        ``activity_count`` and summed ``distance``, ``moving_time``,
+        ``elapsed_time`` and ``total_elevation_gain``, oldest first.
+    """
+    if start is not None:
+        day = date.fromisoformat(str(start)[:10])
+        start = (day - timedelta(days=day.weekday())).isoformat()
+    return _totals(conn, "agg_weekly", "week", sport_type, start, None if end is None else str(end)[:10])
+
+
+def monthly_totals(
+    conn: sqlite3.Connection,
+    sport_type: str | None = None,
+    start: str | date | None = None,
+    end: str | date | None = None,
+) -> list[dict]:
+    """Return per-month, per-sport totals from the ``agg_monthly`` rollup.
+
+    Like :func:`weekly_totals`, with ``month`` as ``YYYY-MM``; *start* and
+    *end* may be dates or ``YYYY-MM`` strings, *end* exclusive.
+    """
+    return _totals(
+        conn,
+        "agg_monthly",
+        "month",
+        sport_type,
+        None if start is None else str(start)[:7],
+        None if end is None else str(end)[:7],
+    )
@@ -0,0 +1,207 @@
+import logging
+import sqlite3
+import threading
+import time
+from collections.abc import Callable, Iterator, Mapping
+from contextlib import contextmanager
+from dataclasses import dataclass, fields
+
+from strava.db import RATE_LIMIT_TABLE_SQL
+
+log = logging.getLogger(__name__)
+
+SHORT_WINDOW = 15 * 60   # Strava's short budget resets every quarter hour
+LONG_WINDOW = 24 * 3600  # the daily budget resets at midnight UTC
+
+DEFAULT_SHORT_LIMIT = 200
+DEFAULT_LONG_LIMIT = 2000
+
+
+@dataclass
+class RateLimitState:
+    """Snapshot of both Strava rate-limit budgets."""
+
+    short_limit: int = DEFAULT_SHORT_LIMIT
+    short_usage: int = 0
+    short_window: int = 0    # Unix timestamp at which the current 15-minute window started
+    long_limit: int = DEFAULT_LONG_LIMIT
+    long_usage: int = 0
+    long_window: int = 0     # Unix timestamp at which the current day started (UTC)
+
+
+_STATE_COLUMNS = tuple(f.name for f in fields(RateLimitState))
+
+
+def parse_rate_limit_headers(headers: Mapping[str, str]) -> tuple[int, int, int, int] | None:
+    """Parse Strava's ``X-RateLimit-Limit`` / ``X-RateLimit-Usage`` headers.
+
+    Both headers carry two comma-separated integers: the 15-minute value and
+    the daily value.
+
+    Returns:
+        ``(short_limit, long_limit, short_usage, long_usage)``, or None when the
+        headers are missing or malformed.
+    """
+    limit = headers.get("X-RateLimit-Limit")
+    usage = headers.get("X-RateLimit-Usage")
+    if not isinstance(limit, str) or not isinstance(usage, str):
+        return None
+    try:
+        short_limit, long_limit = (int(v) for v in limit.split(","))
+        short_usage, long_usage = (int(v) for v in usage.split(","))
+    except ValueError:
+        return None
+    return short_limit, long_limit, short_usage, long_usage
+
+
+class RateLimiter:
+    """Token-bucket scheduler for the Strava 15-minute and daily request budgets.
+
+    Each call to :meth:`acquire` takes one token from both buckets; the buckets
+    refill when their window rolls over. After every response :meth:`update`
+    raises the local counters to the usage reported by Strava. When either budget is exhausted, ``acquire`` sleeps until the
+    window resets instead of letting the request fail with 429.
+
+    With a ``db_path`` the state lives in the ``rate_limit_state`` table and
+    every reservation runs inside ``BEGIN IMMEDIATE``, so several processes
+    sharing the database (``sync.py`` next to ``webhook_server.py``) draw from
+    one budget. Without it the state is kept in memory.
+    """
+
+    def __init__(
+        self,
+        db_path: str | None = None,
+        reserve: int = 2,
+        clock: Callable[[], float] = time.time,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        """Create the limiter.
+
+        Args:
+            db_path: Optional SQLite database holding the shared budget state.
+            reserve: Number of requests per window kept back as a safety margin,
+                e.g. for requests other processes already have in flight.
+            clock: Time source returning Unix seconds (injectable for tests).
+            sleep: Sleep function (injectable for tests).
+        """
+        self.reserve = reserve
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._state = RateLimitState()
+        self._conn: sqlite3.Connection | None = None
+        if db_path is not None:
+            self._conn = sqlite3.connect(
+                db_path, timeout=30, isolation_level=None, check_same_thread=False
+            )
+            # The budget is advisory; losing the last write on power loss is harmless.
+            self._conn.execute("PRAGMA synchronous=OFF")
+            self._conn.execute(RATE_LIMIT_TABLE_SQL)
+            self._conn.execute("INSERT OR IGNORE INTO rate_limit_state (id) VALUES (1)")
+
+    def close(self) -> None:
+        """Close the state database connection, if any."""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def state(self) -> RateLimitState:
+        """Return a copy of the current budget state, with expired windows reset."""
+        with self._transaction() as state:
+            return RateLimitState(**vars(state))
+
+    def reserve_token(self) -> float:
+        """Try to take one token from both budgets without blocking.
+
+        Returns:
+            0.0 when the token was granted, otherwise the number of seconds
+            until the exhausted window resets.
+        """
+        with self._transaction() as state:
+            now = self._clock()
+            if state.long_usage >= state.long_limit - self.reserve:
+                return max(state.long_window + LONG_WINDOW - now, 0.0) or 1.0
+            if state.short_usage >= state.short_limit - self.reserve:
+                return max(state.short_window + SHORT_WINDOW - now, 0.0) or 1.0
+            state.short_usage += 1
+            state.long_usage += 1
+            return 0.0
+
+    def acquire(self) -> None:
+        """Block until a request may be sent within both budgets."""
+        while True:
+            delay = self.reserve_token()
+            if delay <= 0:
+                return
+            log.warning("Strava rate limit budget exhausted, sleeping %.0f s", delay)
+            self._sleep(delay)
+
+    def update(self, headers: Mapping[str, str]) -> None:
+        """Synchronise the budgets with the usage reported in a response's headers.
+
+        The reported usage only raises the local counters. A response counts
+        requests up to its own, so with several calls in flight it may arrive
+        after reservations it does not know about yet. Only a new window
+        brings the counters back down.
+        """
+        parsed = parse_rate_limit_headers(headers)
+        if parsed is None:
+            return
+        short_limit, long_limit, short_usage, long_usage = parsed
+        with self._transaction() as state:
+            state.short_limit, state.long_limit = short_limit, long_limit
+            state.short_usage = max(state.short_usage, short_usage)
+            state.long_usage = max(state.long_usage, long_usage)
+
+    def exhaust(self, headers: Mapping[str, str]) -> None:
+        """Mark the budget as spent after a 429 so that the next acquire waits for the reset.
+
+        The daily budget is marked spent only when the headers show it is;
+        otherwise the 15-minute budget is assumed to be the one exceeded.
+        """
+        parsed = parse_rate_limit_headers(headers)
+        with self._transaction() as state:
+            if parsed is not None:
+                state.short_limit, state.long_limit, _, long_usage = parsed
+                if long_usage >= state.long_limit:
+                    state.long_usage = state.long_limit
+                    return
+            state.short_usage = state.short_limit
+
+    # ------------------------------------------------------------------
+
+    def _roll_windows(self, state: RateLimitState) -> None:
+        now = int(self._clock())
+        short_window = now - now % SHORT_WINDOW
+        long_window = now - now % LONG_WINDOW
+        if state.short_window != short_window:
+            state.short_window, state.short_usage = short_window, 0
+        if state.long_window != long_window:
+            state.long_window, state.long_usage = long_window, 0
+
+    @contextmanager
+    def _transaction(self) -> Iterator[RateLimitState]:
+        """Load, yield and store the budget state atomically across threads and processes."""
+        with self._lock:
+            conn = self._conn
+            if conn is None:
+                self._roll_windows(self._state)
+                yield self._state
+                return
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    f"SELECT {', '.join(_STATE_COLUMNS)} FROM rate_limit_state WHERE id = 1"
+                ).fetchone()
+                self._state = RateLimitState(*row)
+                self._roll_windows(self._state)
+                yield self._state
+                assignments = ", ".join(f"{c} = ?" for c in _STATE_COLUMNS)
+                conn.execute(
+                    f"UPDATE rate_limit_state SET {assignments} WHERE id = 1",
+                    [getattr(self._state, c) for c in _STATE_COLUMNS],
+                )
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
@@ -0,0 +1,89 @@
+import random
+import threading
+from collections.abc import Callable
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+RETRYABLE_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """How often and how long to wait before retrying a failed Strava API call.
+
+    Delays use exponential backoff with full jitter: before retry *n* (0-based)
+    the client sleeps a random time between 0 and
+    ``min(backoff_cap, backoff_base * 2**n)`` seconds. A ``Retry-After`` header
+    on the response raises the delay to at least the requested time.
+    """
+
+    max_attempts: int = 5
+    backoff_base: float = 0.5
+    backoff_cap: float = 30.0
+    retry_statuses: frozenset[int] = RETRYABLE_STATUSES
+
+    def delay(
+        self,
+        retry: int,
+        retry_after: float | None = None,
+        rand: Callable[[], float] = random.random,
+    ) -> float:
+        """Return the number of seconds to sleep before retry number *retry* (0-based).
+
+        Args:
+            retry: How many retries have already been made for this call.
+            retry_after: Delay requested by the server, if any.
+            rand: Source of uniform random numbers in [0, 1), injectable for tests.
+        """
+        backoff = rand() * min(self.backoff_cap, self.backoff_base * 2**retry)
+        if retry_after is not None:
+            return max(retry_after, backoff)
+        return backoff
+
+
+def parse_retry_after(value: object, now: datetime | None = None) -> float | None:
+    """Parse a ``Retry-After`` header given either as seconds or as an HTTP date.
+
+    Returns:
+        Seconds to wait (never negative), or None if the value is missing or invalid.
+    """
+    if not isinstance(value, str) or not value.strip():
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    now = now or datetime.now(timezone.utc)
+    return max((when - now).total_seconds(), 0.0)
+
+
+class RetryCounters:
+    """Thread-safe per-endpoint counters of retries and of calls that gave up."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counts: dict[str, dict[str, int]] = {}
+
+    def _bump(self, endpoint: str, key: str) -> None:
+        with self._lock:
+            counts = self._counts.setdefault(endpoint, {"retries": 0, "gave_up": 0})
+            counts[key] += 1
+
+    def record_retry(self, endpoint: str) -> None:
+        """Count one retry of a call to *endpoint*."""
+        self._bump(endpoint, "retries")
+
+    def record_give_up(self, endpoint: str) -> None:
+        """Count one call to *endpoint* that failed after exhausting its retries."""
+        self._bump(endpoint, "gave_up")
+
+    def snapshot(self) -> dict[str, dict[str, int]]:
+        """Return a copy of the counters, e.g. ``{"activity": {"retries": 3, "gave_up": 0}}``."""
+        with self._lock:
+            return {endpoint: dict(counts) for endpoint, counts in self._counts.items()}
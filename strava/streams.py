@@ -0,0 +1,129 @@
+import sys
+from array import array
+from dataclasses import dataclass
+from itertools import accumulate
+
+try:
+    import numpy
+except ImportError:  # optional: pip install .[analytics]
+    numpy = None
+
+
+@dataclass(frozen=True)
+class StreamSpec:
+    """How one stream channel is packed into a BLOB.
+
+    Values are multiplied by *scale*, rounded to integers and stored as
+    deltas from the previous sample of the same component, so slowly changing
+    channels (time, distance, altitude, position) turn into runs of small
+    numbers. *width* is the number of components per sample (2 for latlng).
+    """
+
+    typecode: str  # array module typecode of the stored deltas: "h" (int16) or "i" (int32)
+    scale: float = 1.0
+    width: int = 1
+
+
+# Channels fetched from /activities/{id}/streams and how they are stored.
+STREAM_SPECS = {
+    "time": StreamSpec("h"),  # seconds since start
+    "distance": StreamSpec("i", 10.0),  # metres, 0.1 m resolution
+    "latlng": StreamSpec("i", 1e6, 2),  # degrees, ~0.1 m resolution
+    "altitude": StreamSpec("i", 10.0),  # metres, 0.1 m resolution
+    "heartrate": StreamSpec("h"),  # bpm
+    "watts": StreamSpec("h"),  # W
+    "cadence": StreamSpec("h"),  # rpm
+}
+STREAM_TYPES = tuple(STREAM_SPECS)
+
+# BLOBs are always little-endian so a database file moves between machines.
+_SWAP = sys.byteorder != "little"
+
+
+@dataclass(frozen=True)
+class PackedStream:
+    """A stream channel as stored in the ``streams`` table."""
+
+    typecode: str
+    scale: float
+    width: int
+    length: int  # number of samples
+    data: bytes
+
+
+def _require_numpy() -> None:
+    if numpy is None:
+        raise RuntimeError("NumPy arrays require the numpy package: pip install .[analytics]")
+
+
+def encode_stream(stream_type: str, values: list) -> PackedStream:
+    """Pack the ``data`` list of one Strava stream channel.
+
+    Missing samples (``None``, e.g. power meter dropouts) are stored as 0.
+    Deltas that do not fit the channel's int16 type fall back to int32; the
+    chosen typecode is stored with the row.
+
+    Args:
+        stream_type: Channel name, one of :data:`STREAM_TYPES`.
+        values: Samples as returned by the API; ``[lat, lng]`` pairs for latlng.
+
+    Returns:
+        The packed stream.
+    """
+    spec = STREAM_SPECS[stream_type]
+    flat = [c for v in values for c in v] if spec.width > 1 else values
+    quantized = [0 if v is None else round(v * spec.scale) for v in flat]
+    w = spec.width
+    deltas = quantized[:w] + [quantized[i] - quantized[i - w] for i in range(w, len(quantized))]
+    try:
+        packed = array(spec.typecode, deltas)
+        typecode = spec.typecode
+    except OverflowError:
+        packed = array("i", deltas)
+        typecode = "i"
+    if _SWAP:
+        packed.byteswap()
+    return PackedStream(typecode, spec.scale, w, len(values), packed.tobytes())
+
+
+def decode_stream(packed: PackedStream) -> array:
+    """Unpack a stream into an ``array.array``.
+
+    Unscaled channels come back as integers (typecode ``q``), scaled ones as
+    doubles. latlng is flat: ``[lat0, lng0, lat1, lng1, ...]``.
+    """
+    deltas = array(packed.typecode)
+    deltas.frombytes(packed.data)
+    if _SWAP:
+        deltas.byteswap()
+    w = packed.width
+    if w == 1:
+        values = array("q", accumulate(deltas))
+    else:
+        values = array("q", bytes(8 * len(deltas)))
+        for component in range(w):
+            values[component::w] = array("q", accumulate(deltas[component::w]))
+    if packed.scale == 1.0:
+        return values
+    return array("d", (v / packed.scale for v in values))
+
+
+def decode_stream_numpy(packed: PackedStream):
+    """Unpack a stream into a NumPy array without copying the BLOB first.
+
+    The stored bytes are viewed in place with ``numpy.frombuffer`` and the
+    deltas summed in one vectorised ``cumsum``. latlng comes back with shape
+    ``(n, 2)``.
+
+    Raises:
+        RuntimeError: If numpy is not installed.
+    """
+    _require_numpy()
+    dtype = numpy.dtype(packed.typecode).newbyteorder("<")
+    deltas = numpy.frombuffer(memoryview(packed.data), dtype=dtype)
+    if packed.width > 1:
+        deltas = deltas.reshape(-1, packed.width)
+    values = numpy.cumsum(deltas, axis=0, dtype=numpy.int64)
+    if packed.scale == 1.0:
+        return values
+    return values / packed.scale
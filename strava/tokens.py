@@ -0,0 +1,213 @@
+import asyncio
+import fcntl
+import sqlite3
+import threading
+import time
+from collections.abc import Awaitable, Callable
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import TypeVar
+
+from strava.client import refresh_access_token
+from strava.db import OAUTH_TOKENS_TABLE_SQL
+
+T = TypeVar("T")
+
+DEFAULT_ACCOUNT = "default"
+DEFAULT_REFRESH_MARGIN = 300  # refresh this many seconds before the token expires
+
+
+@dataclass
+class StoredToken:
+    """OAuth tokens of one account as persisted in the ``oauth_tokens`` table."""
+
+    access_token: str
+    refresh_token: str
+    expires_at: int  # Unix time; 0 if unknown
+
+
+def _is_unauthorized(exc: BaseException) -> bool:
+    """Return True if *exc* is an HTTP 401 from either the requests or the aiohttp client."""
+    response = getattr(exc, "response", None)
+    if getattr(response, "status_code", None) == 401:
+        return True
+    return getattr(exc, "status", None) == 401
+
+
+class TokenManager:
+    """Keeps a valid Strava access token shared by every process using one database.
+
+    The access token, the refresh token and ``expires_at`` live in the
+    ``oauth_tokens`` table. :meth:`access_token` returns the stored token
+    while it is more than *refresh_margin* seconds from expiry and refreshes
+    it otherwise. Refreshes are serialised across threads and processes by an
+    exclusive lock on ``<db>.token.lock``; a waiter re-reads the table after
+    getting the lock, so when several processes notice expiry at once only
+    the first calls the OAuth endpoint. Strava rotates the refresh token on
+    refresh and the new one is stored before the lock is released, so no
+    process is left holding an invalidated refresh token.
+
+    Usage::
+
+        tokens = TokenManager("strava.db", client_id, client_secret)
+        tokens.seed(os.environ["STRAVA_ACCESS_TOKEN"], os.environ["STRAVA_REFRESH_TOKEN"])
+        activities = tokens.call(lambda token: get_activities(token))
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        client_id: str,
+        client_secret: str,
+        account: str = DEFAULT_ACCOUNT,
+        refresh_margin: float = DEFAULT_REFRESH_MARGIN,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        """Open the token store.
+
+        Args:
+            db_path: Path to the SQLite database holding ``oauth_tokens``.
+            client_id: Strava application client ID.
+            client_secret: Strava application client secret.
+            account: Row key in ``oauth_tokens``; one per authorised athlete.
+            refresh_margin: Seconds before expiry at which the token is refreshed.
+            clock: Time source returning Unix seconds (injectable for tests).
+        """
+        self.db_path = db_path
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.account = account
+        self.refresh_margin = refresh_margin
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            db_path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute(OAUTH_TOKENS_TABLE_SQL)
+
+    def close(self) -> None:
+        """Close the token store connection."""
+        self._conn.close()
+
+    def seed(self, access_token: str, refresh_token: str, expires_at: int = 0) -> None:
+        """Store tokens from the environment unless the database already has newer ones.
+
+        The stored row is kept as long as it descends from the same
+        *refresh_token*: it then holds the rotated tokens of earlier refreshes,
+        while the environment still has the original, possibly revoked ones.
+        A different *refresh_token* means the account was re-authorised, so
+        the row is replaced. With the default ``expires_at=0`` the first use
+        refreshes the token, since its real expiry is unknown.
+        """
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO oauth_tokens
+                    (account, access_token, refresh_token, expires_at, seed_refresh_token, updated_at)
+                VALUES (?, ?, ?, ?, ?, datetime('now'))
+                ON CONFLICT(account) DO UPDATE SET
+                    access_token = excluded.access_token,
+                    refresh_token = excluded.refresh_token,
+                    expires_at = excluded.expires_at,
+                    seed_refresh_token = excluded.seed_refresh_token,
+                    updated_at = excluded.updated_at
+                WHERE oauth_tokens.seed_refresh_token IS NOT excluded.seed_refresh_token
+                """,
+                (self.account, access_token, refresh_token, expires_at, refresh_token),
+            )
+
+    def stored(self) -> StoredToken | None:
+        """Return the tokens currently stored for this account, or None if never seeded."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT access_token, refresh_token, expires_at FROM oauth_tokens WHERE account = ?",
+                (self.account,),
+            ).fetchone()
+        return None if row is None else StoredToken(*row)
+
+    def _is_fresh(self, token: StoredToken) -> bool:
+        return token.expires_at - self.refresh_margin > self._clock()
+
+    @contextmanager
+    def _refresh_lock(self):
+        with self._lock, open(f"{self.db_path}.token.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def access_token(self) -> str:
+        """Return a valid access token, refreshing it first if it is close to expiry."""
+        token = self.stored()
+        if token is None:
+            raise LookupError(f"no OAuth tokens stored for account {self.account!r}")
+        if self._is_fresh(token):
+            return token.access_token
+        return self.refresh()
+
+    def refresh(self, rejected_token: str | None = None) -> str:
+        """Refresh the access token unless another thread or process already has.
+
+        Args:
+            rejected_token: Access token the API just answered 401 to. If the
+                stored token differs, someone refreshed in the meantime and
+                the stored one is returned; otherwise it is refreshed even if
+                not yet near expiry.
+
+        Returns:
+            The new (or concurrently refreshed) access token.
+        """
+        with self._refresh_lock():
+            row = self._conn.execute(
+                "SELECT access_token, refresh_token, expires_at FROM oauth_tokens WHERE account = ?",
+                (self.account,),
+            ).fetchone()
+            if row is None:
+                raise LookupError(f"no OAuth tokens stored for account {self.account!r}")
+            token = StoredToken(*row)
+            if rejected_token is None and self._is_fresh(token):
+                return token.access_token
+            if rejected_token is not None and token.access_token != rejected_token:
+                return token.access_token
+
+            response = refresh_access_token(self.client_id, self.client_secret, token.refresh_token)
+            self._conn.execute(
+                """
+                UPDATE oauth_tokens
+                SET access_token = ?, refresh_token = ?, expires_at = ?, updated_at = datetime('now')
+                WHERE account = ?
+                """,
+                (
+                    response["access_token"],
+                    response.get("refresh_token", token.refresh_token),
+                    int(response.get("expires_at", 0)),
+                    self.account,
+                ),
+            )
+            return response["access_token"]
+
+    def call(self, fn: Callable[[str], T]) -> T:
+        """Call ``fn(access_token)``, refreshing the token and retrying once on HTTP 401.
+
+        Strava can revoke a token before its ``expires_at``; the retry covers
+        that case without every caller handling it.
+        """
+        token = self.access_token()
+        try:
+            return fn(token)
+        except Exception as exc:
+            if not _is_unauthorized(exc):
+                raise
+        return fn(self.refresh(rejected_token=token))
+
+    async def call_async(self, fn: Callable[[str], Awaitable[T]]) -> T:
+        """Async counterpart of :meth:`call`: await ``fn(access_token)``, retrying once on 401.
+
+        The token lookup and any refresh run in a worker thread, so the
+        event loop never blocks on SQLite or the OAuth endpoint.
+        """
+        token = await asyncio.to_thread(self.access_token)
+        try:
+            return await fn(token)
+        except Exception as exc:
+            if not _is_unauthorized(exc):
+                raise
+        return await fn(await asyncio.to_thread(self.refresh, token))
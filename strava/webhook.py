@@ -1,8 +1,19 @@
+import logging
 import sqlite3
+import time
 from typing import TypedDict
 
-from strava.client import get_activity
-from strava.db import upsert_activity
+import requests
+
+from strava.analytics import forget_bests, refresh_derived_metrics
+from strava.client import get_activity, get_activity_streams
+from strava.db import delete_activities, purge_athlete, upsert_activity, upsert_streams
+from strava.event_queue import enqueue_event
+from strava.tokens import TokenManager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DELIVERY_TTL = 24 * 3600  # seconds a delivery key is remembered; Strava retries within minutes
 
 
 class StravaEvent(TypedDict, total=False):
@@ -14,6 +25,16 @@ class StravaEvent(TypedDict, total=False):
     owner_id: int      # Athlete ID that owns the object
     subscription_id: int
     event_time: int    # Unix timestamp of the event
+    updates: dict[str, str]  # Changed fields on update events, e.g. {"title": "..."}
+
+
+def _is_deauthorization(event: StravaEvent) -> bool:
+    """Return True for the event Strava sends when an athlete revokes access."""
+    updates = event.get("updates") or {}
+    return (
+        event.get("object_type") == "athlete"
+        and str(updates.get("authorized", "")).lower() == "false"
+    )
 
 
 def handle_verify(args: dict[str, str], verify_token: str) -> dict[str, str] | None:
@@ -35,30 +56,155 @@ def handle_verify(args: dict[str, str], verify_token: str) -> dict[str, str] | N
 
 
 def handle_event(
-    event: StravaEvent, access_token: str, conn: sqlite3.Connection
+    event: StravaEvent, tokens: TokenManager, conn: sqlite3.Connection
 ) -> str | None:
-    """Process an incoming Strava webhook event and persist new activities.
+    """Process an incoming Strava webhook event and persist its effect.
 
-    Only ``object_type=activity`` / ``aspect_type=create`` events are acted on;
-    all other events return ``"ignored"``.
+    ``object_type=activity`` events with ``aspect_type`` ``create`` or
+    ``update`` fetch the activity and upsert it. A ``create`` also fetches
+    and stores the activity's streams (one more call through the same rate
+    budget), so its best efforts and power curve count towards the
+    athlete's bests right away; streams of edited activities are refreshed
+    by ``sync.py --streams`` only. ``delete`` removes the
+    activity with its streams, cached metrics and share of the aggregates,
+    without any API call. An athlete update with ``authorized: "false"``
+    (deauthorization) purges all of that athlete's data in chunked
+    transactions. All other events return ``"ignored"``. Bursts of updates
+    are merged before they get here (see
+    :func:`strava.event_queue.enqueue_event`), so each call costs at most one fetch.
+
+    A token is only taken from *tokens* on the fetch path. Deletes and
+    deauthorizations never touch it: after a deauthorization the athlete's
+    refresh token is already revoked, and a refresh attempt would fail
+    before the purge could run.
 
     Args:
         event: Parsed webhook event payload from Strava.
-        access_token: Valid Strava OAuth access token used to fetch activity details.
+        tokens: Token manager of the event's athlete; the fetch retries once on 401.
         conn: Open SQLite connection used to store the fetched activity.
 
     Returns:
-        ``"saved"`` when the activity was fetched and stored, ``"ignored"`` when the
-        event type is not handled, or ``None`` if the object ID is missing/invalid.
+        ``"saved"`` when the activity was fetched and stored, ``"deleted"`` or
+        ``"deauthorized"`` after removing data, ``"ignored"`` when the event
+        type is not handled, or ``None`` if the object ID is missing/invalid.
     """
+    if _is_deauthorization(event):
+        try:
+            athlete_id = int(event["object_id"])
+        except (KeyError, ValueError, TypeError):
+            return None
+        purged = purge_athlete(conn, athlete_id)
+        logger.info("athlete %s deauthorized, purged %d activities", athlete_id, purged)
+        return "deauthorized"
     if event.get("object_type") != "activity":
         return "ignored"
-    if event.get("aspect_type") != "create":
+    if event.get("aspect_type") not in ("create", "update", "delete"):
         return "ignored"
     try:
         activity_id = int(event["object_id"])
     except (KeyError, ValueError, TypeError):
         return None
-    activity = get_activity(access_token, activity_id)
+    if event["aspect_type"] == "delete":
+        with conn:
+            delete_activities(conn, [activity_id])
+            forget_bests(conn, [activity_id])
+        return "deleted"
+    activity = tokens.call(lambda access_token: get_activity(access_token, activity_id))
     upsert_activity(conn, activity)
+    if event["aspect_type"] == "create":
+        upsert_streams(conn, activity_id, _fetch_streams(tokens, activity_id))
+    # Computes the new activity's metrics, or recomputes them after an edit.
+    refresh_derived_metrics(conn, [activity_id])
     return "saved"
+
+
+def _fetch_streams(tokens: TokenManager, activity_id: int) -> dict:
+    """Return the activity's streams; ``{}`` for manual activities, which have none (404)."""
+    try:
+        return tokens.call(lambda access_token: get_activity_streams(access_token, activity_id))
+    except requests.exceptions.HTTPError as e:
+        if e.response is None or e.response.status_code != 404:
+            raise
+        return {}
+
+
+def _delivery_key(event: StravaEvent) -> tuple | None:
+    key = (
+        event.get("subscription_id"),
+        event.get("object_id"),
+        event.get("aspect_type"),
+        event.get("event_time"),
+    )
+    if any(part is None for part in key):
+        return None
+    return key
+
+
+def record_delivery(conn: sqlite3.Connection, event: StravaEvent, now: float | None = None) -> bool:
+    """Remember that *event* was received; return False if it was seen before.
+
+    A delivery is identified by ``(subscription_id, object_id, aspect_type,
+    event_time)``, which is identical across Strava's redeliveries of one
+    event and across ingress replicas sharing the database. Events missing
+    any of these fields cannot be deduplicated and always count as new.
+    Does not commit.
+
+    Args:
+        conn: Open SQLite connection to the activities database.
+        event: Parsed webhook event payload from Strava.
+        now: Current Unix time; defaults to ``time.time()``.
+
+    Returns:
+        True for the first delivery of the event, False for a duplicate.
+    """
+    key = _delivery_key(event)
+    if key is None:
+        return True
+    cursor = conn.execute(
+        """
+        INSERT OR IGNORE INTO webhook_deliveries
+            (subscription_id, object_id, aspect_type, event_time, received_at)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        (*key, time.time() if now is None else now),
+    )
+    return cursor.rowcount == 1
+
+
+def prune_deliveries(conn: sqlite3.Connection, ttl: float = DEFAULT_DELIVERY_TTL) -> int:
+    """Forget delivery keys older than *ttl* seconds and commit.
+
+    Returns:
+        Number of keys removed.
+    """
+    with conn:
+        cursor = conn.execute(
+            "DELETE FROM webhook_deliveries WHERE received_at < ?", (time.time() - ttl,)
+        )
+    return cursor.rowcount
+
+
+def accept_event(
+    conn: sqlite3.Connection, event: StravaEvent, coalesce_window: float = 0.0
+) -> str:
+    """Deduplicate an incoming delivery and queue it for processing.
+
+    Recording the delivery and queueing the event happen in one transaction,
+    so a crash between the two can never mark an event as seen without
+    queueing it. Duplicates return before anything is queued, hence before
+    any Strava API call.
+
+    Args:
+        conn: Open SQLite connection to the activities database.
+        event: Parsed webhook event payload from Strava.
+        coalesce_window: Passed to :func:`strava.event_queue.enqueue_event`.
+
+    Returns:
+        ``"queued"`` for a new event, ``"duplicate"`` for a redelivery.
+    """
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        if not record_delivery(conn, event):
+            return "duplicate"
+        enqueue_event(conn, event, coalesce_window)
+    return "queued"
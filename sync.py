@@ -1,80 +1,509 @@
 #!/usr/bin/env python3
+import asyncio
 import os
 import sqlite3
 import sys
-from datetime import datetime, timezone
+import time
+import uuid
+from collections.abc import Iterator
+from datetime import datetime, timedelta, timezone
 
 import click
 import requests
 
-from strava.client import get_activities, refresh_access_token
-from strava.db import init_db, upsert_activity, get_activity_ids
+from strava.analytics import refresh_derived_metrics
+from strava.athletes import DEFAULT_WORKERS, AthleteSyncResult, sync_all_athletes
+from strava.client import (
+    DEFAULT_POOL_SIZE,
+    StravaClient,
+    get_activities,
+    get_activity_streams,
+    get_client,
+    set_client,
+)
+from strava.db import (
+    advance_high_water_mark,
+    checkpoint_sync_window,
+    connect,
+    create_sync_run,
+    get_resumable_sync_run,
+    get_sync_windows,
+    update_sync_run,
+    get_high_water_mark,
+    init_db,
+    UpsertStats,
+    upsert_activities,
+    filter_new_ids,
+    get_summary_activity_ids,
+    get_activity_ids_without_streams,
+    mark_details_missing,
+    set_synchronous,
+    upsert_streams,
+)
+from strava.pipeline import DEFAULT_PREFETCH, Item, PipelineStats, run_pipeline
+from strava.ratelimit import RateLimiter
+from strava.tokens import TokenManager
+
+
+_DETAIL_BATCH_SIZE = 50
+_PER_PAGE = 200
+_STRAVA_EPOCH = int(datetime(2009, 1, 1, tzinfo=timezone.utc).timestamp())
+
+
+def _incremental_after(high_water_mark: str, overlap_days: int) -> int:
+    """Return the ``after`` timestamp for an incremental sync from a stored high-water mark.
+
+    The overlap re-requests a few days before the mark so that activities
+    uploaded late (a watch synced days after the run) are still picked up.
+    """
+    mark = datetime.fromisoformat(high_water_mark.replace("Z", "+00:00"))
+    return int((mark - timedelta(days=overlap_days)).timestamp())
+
+
+def _split_windows(
+    after_ts: int | None, windows: int, now: int | None = None
+) -> list[tuple[int | None, int | None]]:
+    """Split the range from *after_ts* (or Strava's launch) until now into *windows* time slices.
+
+    Adjacent windows overlap by one second because Strava's ``after`` and
+    ``before`` filters are both exclusive; an activity on a boundary may then
+    arrive twice and is deduplicated by ID. The last window is left open so
+    that activities uploaded during the sync are not missed.
+
+    Returns:
+        List of ``(after, before)`` pairs for get_activities.
+    """
+    if windows <= 1:
+        return [(after_ts, None)]
+    start = _STRAVA_EPOCH if after_ts is None else after_ts
+    end = int(time.time()) if now is None else now
+    step = max((end - start) // windows, 1)
+    bounds = [start + i * step for i in range(windows)]
+    return [
+        (after_ts if i == 0 else bound - 1, bounds[i + 1] if i + 1 < windows else None)
+        for i, bound in enumerate(bounds)
+    ]
+
+
+def _iter_pages(
+    tokens: TokenManager, after_ts: int | None, before_ts: int | None = None, page: int = 1
+) -> Iterator[tuple[int, list[dict]]]:
+    """Yield ``(page_number, activities)`` for consecutive pages, ending with the first short page.
+
+    The access token is looked up per page, so a backfill outliving the token
+    picks up the refreshed one.
+    """
+    while True:
+        activities = tokens.call(
+            lambda token: get_activities(
+                token, page=page, per_page=_PER_PAGE, after=after_ts, before=before_ts
+            )
+        )
+        yield page, activities
+        if len(activities) < _PER_PAGE:
+            return
+        page += 1
+
+
+class _PageWriter:
+    """Pipeline consumer: stores fetched pages, checkpoints their windows and keeps the run's counters."""
+
+    def __init__(
+        self,
+        conn: sqlite3.Connection,
+        run_id: str,
+        window_indexes: list[int],
+        refresh_existing: bool = False,
+    ) -> None:
+        self.conn = conn
+        self.run_id = run_id
+        self.window_indexes = window_indexes  # producer index -> window index
+        self.refresh_existing = refresh_existing
+        self.saved = 0
+        self.skipped = 0
+        self.upsert_stats = UpsertStats()
+        self.newest_start_date: str | None = None
+
+    def __call__(self, items: list[Item[tuple[int, list[dict]]]]) -> None:
+        """Write every page in *items* in a single transaction and echo the new activities."""
+        activities = [a for item in items for a in item.value[1]]
+        if activities:
+            page_newest = max(a["start_date"] for a in activities)
+            if self.newest_start_date is None or page_newest > self.newest_start_date:
+                self.newest_start_date = page_newest
+
+        # Adjacent windows overlap, so the same activity may arrive twice. Only
+        # this call's pages are deduplicated here: a copy in a later call finds
+        # the row stored (or unchanged), so no ID set has to grow with the history.
+        unseen = list({a["id"]: a for a in activities}.values())
+        if self.refresh_existing:
+            new_activities = unseen
+        else:
+            new_ids = set(filter_new_ids(self.conn, [a["id"] for a in unseen]))
+            new_activities = [a for a in unseen if a["id"] in new_ids]
+            self.skipped += len(unseen) - len(new_activities)
+        self.upsert_stats += upsert_activities(
+            self.conn, new_activities, batch_size=max(len(new_activities), 1)
+        )
+        for item in items:
+            page, page_activities = item.value
+            checkpoint_sync_window(
+                self.conn,
+                self.run_id,
+                self.window_indexes[item.source],
+                page,
+                done=len(page_activities) < _PER_PAGE,
+            )
+        if self.newest_start_date is not None:
+            update_sync_run(self.conn, self.run_id, newest_start_date=self.newest_start_date)
+
+        if self.refresh_existing:
+            # Only a summary is printed at the end; listing every row would drown it.
+            return
+        for activity in new_activities:
+            self.saved += 1
+            distance_km = activity.get("distance", 0) / 1000
+            name = activity.get("name", "")
+            date = activity.get("start_date_local", activity.get("start_date", ""))[:10]
+            click.echo(f"[{self.saved}] {name} — {distance_km:.1f} km — {date}")
+
+
+def _echo_stats(stats: PipelineStats) -> None:
+    """Print per-stage timings so it is visible whether the network or the disk is the bottleneck."""
+    click.echo(
+        f"Časy: stahování {stats.fetch_seconds:.1f} s, zápis {stats.write_seconds:.1f} s, "
+        f"čekání na síť {stats.consumer_idle_seconds:.1f} s, "
+        f"čekání na disk {stats.producer_blocked_seconds:.1f} s, "
+        f"celkem {stats.wall_seconds:.1f} s (úzké hrdlo: {stats.bottleneck})."
+    )
+    for endpoint, counts in sorted(get_client().retry_metrics().items()):
+        click.echo(f"Opakování {endpoint}: {counts['retries']}, vzdáno: {counts['gave_up']}")
+
+
+async def _fetch_details(
+    conn: sqlite3.Connection,
+    tokens: TokenManager,
+    activity_ids: list[int],
+    concurrency: int,
+    rate_limiter: RateLimiter,
+) -> tuple[int, int]:
+    """Fetch detail payloads for *activity_ids* concurrently, upserting them in batches as they arrive.
+
+    Activities answered with 404 are marked by ``mark_details_missing`` so
+    later runs do not ask again. Whatever arrived is stored even if the run
+    fails half-way.
+
+    Returns:
+        The number of details stored and the number of missing activities.
+    """
+    from strava.aio import AsyncStravaClient
+
+    fetched = 0
+    batch: list[dict] = []
+    missing: list[int] = []
+    try:
+        async with AsyncStravaClient(concurrency=concurrency, rate_limiter=rate_limiter) as client:
+            async for activity in client.iter_activity_details(tokens, activity_ids, missing):
+                batch.append(activity)
+                if len(batch) >= _DETAIL_BATCH_SIZE:
+                    fetched += upsert_activities(conn, batch).written
+                    batch.clear()
+    finally:
+        fetched += upsert_activities(conn, batch).written
+        mark_details_missing(conn, missing)
+    return fetched, len(missing)
+
+
+def _sync_all_athletes(db: str, workers: int, overlap_days: int, full: bool) -> None:
+    """Run the multi-athlete sync and print one line per page and a summary per athlete."""
+
+    def progress(result: AthleteSyncResult, saved: int) -> None:
+        click.echo(f"[{result.athlete_id}] stránka {result.pages}: {saved} nových aktivit")
+
+    results = sync_all_athletes(
+        db,
+        os.environ["STRAVA_CLIENT_ID"],
+        os.environ["STRAVA_CLIENT_SECRET"],
+        workers=workers,
+        overlap_days=overlap_days,
+        full=full,
+        progress=progress,
+    )
+    if not results:
+        click.echo("Žádní registrovaní sportovci (maintenance.py add-athlete).")
+    for result in results:
+        if result.error is not None:
+            click.echo(f"Sportovec {result.athlete_id}: chyba — {result.error}")
+        else:
+            click.echo(
+                f"Sportovec {result.athlete_id}: {result.saved} aktivit uloženo, "
+                f"{result.skipped} přeskočeno."
+            )
+    conn = connect(db)
+    refresh_derived_metrics(conn)
+    conn.close()
+    if any(result.error is not None for result in results):
+        sys.exit(1)
+
+
+def _fetch_streams(conn: sqlite3.Connection, tokens: TokenManager, activity_ids: list[int]) -> int:
+    """Fetch and store streams for *activity_ids* one by one; returns how many activities got some."""
+    fetched = 0
+    for activity_id in activity_ids:
+        try:
+            streams = tokens.call(lambda token: get_activity_streams(token, activity_id))
+        except requests.exceptions.HTTPError as e:
+            # Manual activities have no recorded streams; remember that so they are not asked again.
+            if e.response is None or e.response.status_code != 404:
+                raise
+            streams = {}
+        if upsert_streams(conn, activity_id, streams):
+            fetched += 1
+    return fetched
 
 
 @click.command()
 @click.option("--db", default="strava.db", show_default=True, help="Path to SQLite database")
 @click.option("--after", default=None, help="Only sync activities after this date (YYYY-MM-DD)")
-def main(db: str, after: str | None) -> None:
+@click.option(
+    "--full", is_flag=True, help="Page through the whole history, ignoring the stored high-water mark"
+)
+@click.option(
+    "--overlap-days",
+    default=7,
+    show_default=True,
+    help="How far before the high-water mark an incremental sync starts",
+)
+@click.option(
+    "--refresh-existing",
+    is_flag=True,
+    help="Re-save already stored activities too; only changed ones are written",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="Continue the last interrupted run from its checkpoints instead of starting a new one",
+)
+@click.option(
+    "--parallel-windows",
+    default=1,
+    show_default=True,
+    help="Split the range into N time windows and page through them concurrently",
+)
+@click.option(
+    "--details",
+    is_flag=True,
+    help="Afterwards fetch full detail payloads for stored summary-only activities (needs aiohttp)",
+)
+@click.option(
+    "--streams",
+    "fetch_streams",
+    is_flag=True,
+    help="Afterwards fetch time/GPS/HR/power streams for stored activities that have none",
+)
+@click.option(
+    "--concurrency", default=16, show_default=True, help="Parallel detail requests for --details"
+)
+@click.option(
+    "--prefetch",
+    default=DEFAULT_PREFETCH,
+    show_default=True,
+    help="How many pages the fetcher may get ahead of the database writer",
+)
+@click.option(
+    "--all-athletes",
+    is_flag=True,
+    help="Sync every athlete registered in the athletes table instead of the one from env",
+)
+@click.option(
+    "--workers",
+    default=DEFAULT_WORKERS,
+    show_default=True,
+    help="Worker threads for --all-athletes",
+)
+@click.option(
+    "--fast-writes",
+    is_flag=True,
+    help="Use PRAGMA synchronous=NORMAL (fewer fsyncs; a power loss may drop the last pages)",
+)
+def main(
+    db: str,
+    after: str | None,
+    full: bool,
+    overlap_days: int,
+    prefetch: int,
+    refresh_existing: bool,
+    resume: bool,
+    parallel_windows: int,
+    details: bool,
+    fetch_streams: bool,
+    concurrency: int,
+    all_athletes: bool,
+    workers: int,
+    fast_writes: bool,
+) -> None:
     """Sync Strava activities to a local SQLite database.
 
-    Refreshes the OAuth access token, then pages through the Strava API and
+    Obtains a valid OAuth access token from the shared token store, then pages through the Strava API and
     upserts each activity that is not already present in the database.
+    Without ``--after`` or ``--full`` only activities newer than the stored
+    high-water mark (minus ``--overlap-days``) are requested; the mark moves
+    forward after every successful run.
+
+    Pages are fetched in a background thread that stays up to ``--prefetch``
+    pages ahead of the database writer; per-stage timings are printed at the end.
+    With ``--parallel-windows N`` the range is split into N ``after``/``before``
+    windows, each paged by its own fetcher and checkpointed separately.
+    Every run is journaled in ``sync_runs``; after a crash or an API error
+    ``--resume`` continues the interrupted run from the page after each
+    window's last checkpoint.
+    ``--refresh-existing`` also passes already stored activities to the
+    upsert, which compares content hashes and rewrites only the ones edited on
+    Strava, then reports new / changed / unchanged counts.
+    With ``--details`` the summary-only rows are then enriched with detail
+    payloads fetched concurrently by the asyncio client, and with ``--streams``
+    the sample streams of activities that have none are stored. Derived
+    metrics (best efforts, power curve, HR zones) are then refreshed for
+    activities with new streams or changed content (needs numpy).
+
+    ``--all-athletes`` syncs every athlete in the ``athletes`` table with
+    their own tokens and high-water mark on ``--workers`` threads, taking
+    turns page by page under the one shared rate budget; only ``--full``
+    and ``--overlap-days`` apply in that mode.
     """
-    client_id = os.environ["STRAVA_CLIENT_ID"]
-    client_secret = os.environ["STRAVA_CLIENT_SECRET"]
-    access_token = os.environ["STRAVA_ACCESS_TOKEN"]
-    refresh_token = os.environ["STRAVA_REFRESH_TOKEN"]
+    if all_athletes and (
+        after
+        or resume
+        or parallel_windows > 1
+        or refresh_existing
+        or details
+        or fetch_streams
+        or fast_writes
+        or prefetch != DEFAULT_PREFETCH
+    ):
+        raise click.UsageError(
+            "--all-athletes cannot be combined with --after, --resume, --parallel-windows, "
+            "--refresh-existing, --details, --streams, --fast-writes or --prefetch"
+        )
+    init_db(db)
+    rate_limiter = RateLimiter(db)
+    set_client(
+        StravaClient(
+            rate_limiter=rate_limiter,
+            pool_size=max(DEFAULT_POOL_SIZE, workers),
+        )
+    )
+    if all_athletes:
+        _sync_all_athletes(db, workers, overlap_days, full)
+        return
 
-    # Refresh token upfront to ensure it's valid
-    tokens = refresh_access_token(client_id, client_secret, refresh_token)
-    access_token = tokens["access_token"]
+    # Reuses the stored token while valid; refreshes (and persists the rotated
+    # refresh token) only when it is about to expire.
+    tokens = TokenManager(db, os.environ["STRAVA_CLIENT_ID"], os.environ["STRAVA_CLIENT_SECRET"])
+    tokens.seed(os.environ["STRAVA_ACCESS_TOKEN"], os.environ["STRAVA_REFRESH_TOKEN"])
 
     after_ts = None
     if after:
         dt = datetime.strptime(after, "%Y-%m-%d").replace(tzinfo=timezone.utc)
         after_ts = int(dt.timestamp())
 
-    init_db(db)
-    conn = sqlite3.connect(db)
-    conn.row_factory = sqlite3.Row
-    existing_ids = get_activity_ids(conn)
+    conn = connect(db)
+    if fast_writes:
+        set_synchronous(conn, "NORMAL")
 
-    click.echo("Stahuju aktivity...")
+    run = get_resumable_sync_run(conn) if resume else None
+    if run is not None:
+        run_id = run["run_id"]
+        click.echo(f"Navazuju na přerušený běh {run_id} ({run['status']})...")
+        refresh_existing = run["params"].get("refresh_existing", refresh_existing)
+        update_sync_run(conn, run_id, status="running")
+        pending = [w for w in get_sync_windows(conn, run_id) if not w["done"]]
+        producers = [
+            lambda w=w: _iter_pages(tokens, w["after_ts"], w["before_ts"], w["last_page"] + 1)
+            for w in pending
+        ]
+        sources = [w["window_index"] for w in pending]
+    else:
+        if resume:
+            click.echo("Žádný přerušený běh, spouštím nový.")
+        high_water_mark = None if full or after_ts is not None else get_high_water_mark(conn)
+        if high_water_mark is not None:
+            after_ts = _incremental_after(high_water_mark, overlap_days)
+            click.echo(f"Stahuju aktivity od {high_water_mark[:10]} (minus {overlap_days} dní)...")
+        else:
+            click.echo("Stahuju aktivity...")
 
-    saved = 0
-    skipped = 0
-    page = 1
-    per_page = 200
+        run_id = uuid.uuid4().hex
+        windows = _split_windows(after_ts, parallel_windows)
+        create_sync_run(
+            conn,
+            run_id,
+            {
+                "after_ts": after_ts,
+                "full": full,
+                "parallel_windows": parallel_windows,
+                "refresh_existing": refresh_existing,
+            },
+            windows,
+        )
+        producers = [
+            lambda after=after, before=before: _iter_pages(tokens, after, before)
+            for after, before in windows
+        ]
+        sources = list(range(len(windows)))
 
-    while True:
-        try:
-            activities = get_activities(access_token, page=page, per_page=per_page, after=after_ts)
-            if not activities:
-                break
-
-            for activity in activities:
-                activity_id = activity["id"]
-                if activity_id in existing_ids:
-                    skipped += 1
-                    continue
-
-                upsert_activity(conn, activity)
-                saved += 1
-                distance_km = activity.get("distance", 0) / 1000
-                name = activity.get("name", "")
-                date = activity.get("start_date_local", activity.get("start_date", ""))[:10]
-                click.echo(f"[{saved}] {name} — {distance_km:.1f} km — {date}")
-
-            if len(activities) < per_page:
-                break
-            page += 1
-        except requests.exceptions.RequestException as e:
-            print(f"Chyba při stahování aktivit: {e}")
-            print(f"Uloženo aktivit před chybou: {saved}")
-            sys.exit(1)
+    writer = _PageWriter(conn, run_id, sources, refresh_existing)
+    if run is not None:
+        # A resumed run also counts what its earlier attempts stored.
+        writer.newest_start_date = run["newest_start_date"]
+    try:
+        stats = run_pipeline(producers, writer, prefetch=max(prefetch, len(producers)))
+    except requests.exceptions.RequestException as e:
+        update_sync_run(conn, run_id, status="failed", error=str(e))
+        print(f"Chyba při stahování aktivit: {e}")
+        print(f"Uloženo aktivit před chybou: {writer.saved}")
+        print("Pokračovat lze pomocí --resume.")
+        sys.exit(1)
+    except BaseException as e:
+        update_sync_run(conn, run_id, status="failed", error=repr(e))
+        raise
+
+    update_sync_run(conn, run_id, status="completed")
+    # Only a run that completed without errors may move the mark forward.
+    if writer.newest_start_date is not None:
+        advance_high_water_mark(conn, writer.newest_start_date)
+    if refresh_existing:
+        upserted = writer.upsert_stats
+        click.echo(
+            f"Hotovo: {upserted.inserted} nových, {upserted.updated} změněných, "
+            f"{upserted.unchanged} beze změny."
+        )
+    else:
+        click.echo(
+            f"Hotovo: {writer.saved} aktivit uloženo, {writer.skipped} přeskočeno (již existují)."
+        )
+    _echo_stats(stats)
+
+    if details:
+        summary_ids = get_summary_activity_ids(conn)
+        click.echo(f"Stahuju detaily {len(summary_ids)} aktivit...")
+        fetched, missing = asyncio.run(
+            _fetch_details(conn, tokens, summary_ids, concurrency, rate_limiter)
+        )
+        click.echo(f"Detaily staženy: {fetched}, nedostupné (404): {missing}.")
+
+    if fetch_streams:
+        missing = get_activity_ids_without_streams(conn)
+        click.echo(f"Stahuju streamy {len(missing)} aktivit...")
+        click.echo(f"Streamy staženy: {_fetch_streams(conn, tokens, missing)}.")
+
+    # New streams and edited activities get their best efforts / power curve
+    # (re)computed; everything else is served from the derived_metrics cache.
+    computed = refresh_derived_metrics(conn)
+    if computed:
+        click.echo(f"Metriky přepočítány: {computed} aktivit.")
 
     conn.close()
-    click.echo(f"Hotovo: {saved} aktivit uloženo, {skipped} přeskočeno (již existují).")
 
 
 if __name__ == "__main__":
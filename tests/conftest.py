@@ -0,0 +1,36 @@
+import sqlite3
+
+import pytest
+
+from strava.db import init_db
+
+
+def make_activity(activity_id, start_date="2024-03-15T06:00:00Z", sport_type="Run", **fields):
+    """Return a summary activity with every column upsert_activity needs; *fields* are added on top."""
+    return {
+        "id": activity_id,
+        "name": f"Run {activity_id}",
+        "type": sport_type,
+        "sport_type": sport_type,
+        "distance": 5000.0,
+        "moving_time": 1800,
+        "elapsed_time": 1850,
+        "total_elevation_gain": 20.0,
+        "start_date": start_date,
+        "start_date_local": start_date.rstrip("Z"),
+        "timezone": "Europe/Prague",
+        **fields,
+    }
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "test.db")
+
+
+@pytest.fixture
+def conn(db_path):
+    init_db(db_path)
+    c = sqlite3.connect(db_path)
+    yield c
+    c.close()
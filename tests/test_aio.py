@@ -0,0 +1,160 @@
+import asyncio
+
+import pytest
+
+aiohttp = pytest.importorskip("aiohttp")
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from strava.aio import AsyncStravaClient
+
+
+def make_app(state):
+    async def activities(request):
+        state["auth"].append(request.headers.get("Authorization"))
+        state["params"].append(dict(request.query))
+        return web.json_response([{"id": 1}, {"id": 2}])
+
+    async def activity(request):
+        valid = state.get("valid_token")
+        if valid is not None and request.headers.get("Authorization") != f"Bearer {valid}":
+            return web.json_response({"message": "Authorization Error"}, status=401)
+        state["in_flight"] += 1
+        state["max_in_flight"] = max(state["max_in_flight"], state["in_flight"])
+        await asyncio.sleep(0.01)
+        state["in_flight"] -= 1
+        activity_id = int(request.match_info["activity_id"])
+        if activity_id in state.get("gone", set()):
+            return web.json_response({"message": "Record Not Found"}, status=404)
+        if activity_id in state.get("fail", set()):
+            state["fail"].remove(activity_id)
+            return web.json_response({"message": "Bad Gateway"}, status=502)
+        if activity_id in state["throttle"]:
+            state["throttle"].remove(activity_id)
+            return web.json_response(
+                {"message": "Rate Limit Exceeded"},
+                status=429,
+                headers={"X-RateLimit-Limit": "100,1000", "X-RateLimit-Usage": "100,200"},
+            )
+        return web.json_response(
+            {"id": activity_id, "resource_state": 3},
+            headers={"X-RateLimit-Limit": "100,1000", "X-RateLimit-Usage": "10,200"},
+        )
+
+    app = web.Application()
+    app.router.add_get("/athlete/activities", activities)
+    app.router.add_get("/activities/{activity_id}", activity)
+    return app
+
+
+def run(coro_fn, state=None):
+    state = state or {}
+    state.setdefault("auth", [])
+    state.setdefault("params", [])
+    state.setdefault("throttle", set())
+    state.update(in_flight=0, max_in_flight=0)
+
+    async def runner():
+        async with TestServer(make_app(state)) as server:
+            return await coro_fn(str(server.make_url("")))
+
+    return asyncio.run(runner()), state
+
+
+def test_get_activities_sends_token_and_params():
+    async def go(base_url):
+        async with AsyncStravaClient(base_url=base_url) as client:
+            return await client.get_activities("token123", page=2, per_page=50, after=1700000000)
+
+    result, state = run(go)
+    assert result == [{"id": 1}, {"id": 2}]
+    assert state["auth"] == ["Bearer token123"]
+    assert state["params"] == [{"page": "2", "per_page": "50", "after": "1700000000"}]
+
+
+def test_get_activity_returns_dict():
+    async def go(base_url):
+        async with AsyncStravaClient(base_url=base_url) as client:
+            return await client.get_activity("token123", 42)
+
+    result, _ = run(go)
+    assert result == {"id": 42, "resource_state": 3}
+
+
+def test_iter_activity_details_bounded_concurrency():
+    async def go(base_url):
+        async with AsyncStravaClient(concurrency=4, base_url=base_url) as client:
+            return [a["id"] async for a in client.iter_activity_details("token123", range(1, 41))]
+
+    result, state = run(go)
+    assert sorted(result) == list(range(1, 41))
+    assert 1 < state["max_in_flight"] <= 4
+
+
+def test_iter_activity_details_skips_missing_activities():
+    missing = []
+
+    async def go(base_url):
+        async with AsyncStravaClient(concurrency=4, base_url=base_url) as client:
+            return [a["id"] async for a in client.iter_activity_details("token123", range(1, 11), missing)]
+
+    result, _ = run(go, {"gone": {3, 7}})
+    assert sorted(result) == [1, 2, 4, 5, 6, 8, 9, 10]
+    assert sorted(missing) == [3, 7]
+
+
+def test_iter_activity_details_refreshes_token_on_401(tmp_path, mocker):
+    from strava.tokens import TokenManager
+
+    refresh = mocker.patch(
+        "strava.tokens.refresh_access_token",
+        return_value={"access_token": "fresh", "refresh_token": "r2", "expires_at": 10**10},
+    )
+    tokens = TokenManager(str(tmp_path / "test.db"), "cid", "secret")
+    tokens.seed("revoked", "r1", expires_at=10**10)
+
+    async def go(base_url):
+        async with AsyncStravaClient(concurrency=4, base_url=base_url) as client:
+            return [a["id"] async for a in client.iter_activity_details(tokens, range(1, 9))]
+
+    result, _ = run(go, {"valid_token": "fresh"})
+    tokens.close()
+    assert sorted(result) == list(range(1, 9))
+    refresh.assert_called_once()
+
+
+def test_rate_limited_detail_is_retried_after_reset():
+    import time
+    from strava.ratelimit import SHORT_WINDOW, RateLimiter
+
+    # Shift the limiter's clock to 50 ms before a window boundary so the
+    # wait after the 429 is real but short.
+    start = time.time()
+    offset = (start - start % SHORT_WINDOW + SHORT_WINDOW - 0.05) - start
+    limiter = RateLimiter(reserve=0, clock=lambda: time.time() + offset)
+
+    async def go(base_url):
+        async with AsyncStravaClient(base_url=base_url, rate_limiter=limiter) as client:
+            return await client.get_activity("token123", 7)
+
+    result, _ = run(go, {"throttle": {7}})
+    assert result["id"] == 7
+    assert limiter.state().short_usage == 10  # synced from the successful response
+
+
+def test_transient_error_is_retried():
+    from strava.retry import RetryPolicy
+
+    async def go(base_url):
+        policy = RetryPolicy(backoff_base=0.001)
+        async with AsyncStravaClient(base_url=base_url, retry_policy=policy) as client:
+            return await client.get_activity("token123", 5), client.retry_metrics()
+
+    (result, metrics), _ = run(go, {"fail": {5}})
+    assert result["id"] == 5
+    assert metrics == {"activity": {"retries": 1, "gave_up": 0}}
+
+
+def test_get_requires_context_manager():
+    with pytest.raises(RuntimeError):
+        asyncio.run(AsyncStravaClient().get_activity("token123", 1))
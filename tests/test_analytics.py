@@ -0,0 +1,126 @@
+import pytest
+
+numpy = pytest.importorskip("numpy")
+
+from strava.analytics import (
+    best_efforts,
+    get_athlete_bests,
+    get_derived_metrics,
+    hr_zone_times,
+    power_curve,
+    rebuild_athlete_bests,
+    refresh_derived_metrics,
+)
+from strava.db import upsert_activity, upsert_streams
+from tests.conftest import make_activity
+
+ATHLETE = {"id": 7}
+
+
+def make_streams(seconds, speed=4.0, watts=200, heartrate=150):
+    return {
+        "time": {"data": list(range(seconds))},
+        "distance": {"data": [i * speed for i in range(seconds)]},
+        "watts": {"data": [watts] * seconds},
+        "heartrate": {"data": [heartrate] * seconds},
+    }
+
+
+def test_best_efforts_finds_fastest_segment():
+    time = numpy.arange(600)
+    # 2 m/s, except 5 m/s between seconds 100 and 300
+    speed = numpy.where((time >= 100) & (time < 300), 5.0, 2.0)
+    distance = numpy.concatenate(([0.0], numpy.cumsum(speed[:-1])))
+    efforts = best_efforts(time, distance)
+    assert efforts["effort_1k"] == 200.0
+    assert efforts["effort_5k"] is None
+
+
+def test_power_curve_takes_best_window():
+    watts = numpy.full(120, 100.0)
+    watts[30:40] = 400.0
+    curve = power_curve(numpy.arange(120), watts, durations=(1, 10, 20, 600))
+    assert curve["power_1s"] == 400.0
+    assert curve["power_10s"] == 400.0
+    assert curve["power_20s"] == 250.0
+    assert curve["power_600s"] is None
+
+
+def test_power_curve_treats_long_gaps_as_zero():
+    curve = power_curve([0, 1, 100, 101], [300, 300, 300, 300], durations=(50,))
+    assert curve["power_50s"] < 300
+
+
+def test_hr_zone_times():
+    zones = hr_zone_times([0, 1, 2, 3, 4], [100, 140, 140, 0, 190], zones=(0, 130, 180))
+    assert zones == {"hr_zone_1": 1.0, "hr_zone_2": 2.0, "hr_zone_3": 0.0}
+
+
+def test_refresh_computes_once_and_caches(conn):
+    upsert_activity(conn, make_activity(1, athlete=ATHLETE))
+    upsert_streams(conn, 1, make_streams(400))
+    assert refresh_derived_metrics(conn) == 1
+    assert get_derived_metrics(conn, 1)["effort_1k"] == 250.0
+    assert refresh_derived_metrics(conn) == 0
+
+
+def test_refresh_skips_activities_without_streams(conn):
+    upsert_activity(conn, make_activity(1, athlete=ATHLETE))
+    assert refresh_derived_metrics(conn) == 0
+
+
+def test_edit_or_new_streams_trigger_recompute(conn):
+    upsert_activity(conn, make_activity(1, athlete=ATHLETE))
+    upsert_streams(conn, 1, make_streams(400))
+    refresh_derived_metrics(conn)
+    upsert_activity(conn, make_activity(1, name="Renamed", athlete=ATHLETE))
+    assert refresh_derived_metrics(conn) == 1
+    upsert_streams(conn, 1, make_streams(400, speed=5.0))
+    assert refresh_derived_metrics(conn, [1]) == 1
+    assert get_derived_metrics(conn, 1)["effort_1k"] == 200.0
+
+
+def test_athlete_bests_are_updated_incrementally(conn):
+    upsert_activity(conn, make_activity(1, athlete=ATHLETE))
+    upsert_streams(conn, 1, make_streams(400, speed=4.0, watts=200))
+    upsert_activity(conn, make_activity(2, athlete=ATHLETE))
+    upsert_streams(conn, 2, make_streams(400, speed=5.0, watts=150))
+    refresh_derived_metrics(conn)
+    bests = get_athlete_bests(conn, 7)
+    assert bests["effort_1k"] == {"value": 200.0, "activity_id": 2}
+    assert bests["power_60s"] == {"value": 200.0, "activity_id": 1}
+
+
+def test_worse_record_holder_falls_back_to_next_best(conn):
+    upsert_activity(conn, make_activity(1, athlete=ATHLETE))
+    upsert_streams(conn, 1, make_streams(400, speed=4.0))
+    upsert_activity(conn, make_activity(2, athlete=ATHLETE))
+    upsert_streams(conn, 2, make_streams(400, speed=5.0))
+    refresh_derived_metrics(conn)
+    upsert_streams(conn, 2, make_streams(400, speed=2.0))
+    refresh_derived_metrics(conn)
+    assert get_athlete_bests(conn, 7)["effort_1k"] == {"value": 250.0, "activity_id": 1}
+
+
+def test_rebuild_athlete_bests(conn):
+    upsert_activity(conn, make_activity(1, athlete=ATHLETE))
+    upsert_streams(conn, 1, make_streams(400))
+    refresh_derived_metrics(conn)
+    conn.execute("DELETE FROM athlete_bests")
+    rebuild_athlete_bests(conn, 7)
+    assert get_athlete_bests(conn, 7)["effort_1k"]["value"] == 250.0
+
+
+def test_forget_bests_falls_back_after_delete(conn):
+    from strava.analytics import forget_bests
+    from strava.db import delete_activities
+
+    upsert_activity(conn, make_activity(1, athlete=ATHLETE))
+    upsert_streams(conn, 1, make_streams(400, speed=4.0))
+    upsert_activity(conn, make_activity(2, athlete=ATHLETE))
+    upsert_streams(conn, 2, make_streams(400, speed=5.0))
+    refresh_derived_metrics(conn)
+    with conn:
+        delete_activities(conn, [2])
+        forget_bests(conn, [2])
+    assert get_athlete_bests(conn, 7)["effort_1k"] == {"value": 250.0, "activity_id": 1}
@@ -0,0 +1,106 @@
+import sqlite3
+
+import pytest
+
+from strava.athletes import list_athletes, register_athlete, sync_all_athletes
+from strava.db import get_activity_ids, init_db, purge_athlete
+from tests.conftest import make_activity
+
+
+@pytest.fixture
+def db_path(db_path, mocker):
+    init_db(db_path)
+    mocker.patch(
+        "strava.tokens.refresh_access_token",
+        side_effect=lambda cid, secret, refresh: {
+            "access_token": f"access-{refresh}",
+            "refresh_token": refresh,
+            "expires_at": 9999999999,
+        },
+    )
+    register_athlete(db_path, "cid", "secret", 1, "a1", "r1", name="Big backlog")
+    register_athlete(db_path, "cid", "secret", 2, "a2", "r2")
+    return db_path
+
+
+@pytest.fixture
+def pages(mocker):
+    """Athlete 1 has three full pages of 2, athlete 2 a single short page."""
+    mocker.patch("strava.athletes.PER_PAGE", 2)
+    data = {
+        "access-r1": [
+            [make_activity(11, athlete={"id": 1}), make_activity(12, athlete={"id": 1})],
+            [make_activity(13, athlete={"id": 1}), make_activity(14, "2024-04-01T06:00:00Z", athlete={"id": 1})],
+            [],
+        ],
+        "access-r2": [[make_activity(21, athlete={"id": 2})]],
+    }
+    calls = []
+
+    def get_activities(token, page, per_page, after):
+        calls.append((token, page))
+        return data[token][page - 1]
+
+    mocker.patch("strava.athletes.get_activities", side_effect=get_activities)
+    return calls
+
+
+def test_register_and_list_athletes(db_path):
+    athletes = list_athletes(sqlite3.connect(db_path))
+    assert [(a["athlete_id"], a["name"], a["account"]) for a in athletes] == [
+        (1, "Big backlog", "athlete:1"),
+        (2, None, "athlete:2"),
+    ]
+
+
+def test_pages_are_scheduled_round_robin(db_path, pages):
+    results = sync_all_athletes(db_path, "cid", "secret", workers=1)
+    assert pages == [("access-r1", 1), ("access-r2", 1), ("access-r1", 2), ("access-r1", 3)]
+    assert [(r.athlete_id, r.saved, r.error) for r in results] == [(1, 4, None), (2, 1, None)]
+    assert get_activity_ids(sqlite3.connect(db_path)) == {11, 12, 13, 14, 21}
+
+
+def test_sync_records_per_athlete_high_water_mark(db_path, pages):
+    sync_all_athletes(db_path, "cid", "secret", workers=2)
+    marks = {a["athlete_id"]: a["high_water_mark"] for a in list_athletes(sqlite3.connect(db_path))}
+    assert marks == {1: "2024-04-01T06:00:00Z", 2: "2024-03-15T06:00:00Z"}
+
+
+def test_activity_repeated_on_a_later_page_is_skipped(db_path, mocker):
+    mocker.patch("strava.athletes.PER_PAGE", 2)
+    data = [
+        [make_activity(11, athlete={"id": 1}), make_activity(12, athlete={"id": 1})],
+        [make_activity(12, athlete={"id": 1})],
+    ]
+
+    def get_activities(token, page, per_page, after):
+        return data[page - 1] if token == "access-r1" else []
+
+    mocker.patch("strava.athletes.get_activities", side_effect=get_activities)
+    results = sync_all_athletes(db_path, "cid", "secret", workers=1)
+    assert [(r.athlete_id, r.saved, r.skipped) for r in results] == [(1, 2, 1), (2, 0, 0)]
+
+
+def test_failing_athlete_does_not_stop_others(db_path, mocker):
+    def get_activities(token, page, per_page, after):
+        if token == "access-r1":
+            raise RuntimeError("boom")
+        return [make_activity(21, athlete={"id": 2})]
+
+    mocker.patch("strava.athletes.get_activities", side_effect=get_activities)
+    results = sync_all_athletes(db_path, "cid", "secret", workers=2)
+    assert [(r.athlete_id, r.error) for r in results] == [(1, "boom"), (2, None)]
+    athletes = {a["athlete_id"]: a for a in list_athletes(sqlite3.connect(db_path))}
+    assert athletes[1]["last_status"] == "failed"
+    assert athletes[1]["high_water_mark"] is None
+    assert athletes[2]["last_status"] == "completed"
+
+
+def test_purge_removes_athlete_and_tokens(db_path, pages):
+    sync_all_athletes(db_path, "cid", "secret")
+    conn = sqlite3.connect(db_path)
+    purge_athlete(conn, 1)
+    assert [a["athlete_id"] for a in list_athletes(conn)] == [2]
+    accounts = [row[0] for row in conn.execute("SELECT account FROM oauth_tokens")]
+    assert accounts == ["athlete:2"]
+    assert get_activity_ids(conn) == {21}
@@ -1,6 +1,6 @@
 import pytest
 from unittest.mock import patch, MagicMock
-from strava.client import get_activities, get_activity, refresh_access_token
+from strava.client import get_activities, get_activity, get_activity_streams, refresh_access_token
 
 STRAVA_API = "https://www.strava.com/api/v3"
 
@@ -14,7 +14,7 @@ def make_response(data, status_code=200):
 
 
 def test_get_activities_calls_correct_endpoint(mocker):
-    mock_get = mocker.patch("requests.get", return_value=make_response([]))
+    mock_get = mocker.patch("requests.Session.get", return_value=make_response([]))
     get_activities("token123")
     mock_get.assert_called_once()
     url = mock_get.call_args[0][0]
@@ -22,14 +22,14 @@ def test_get_activities_calls_correct_endpoint(mocker):
 
 
 def test_get_activities_sends_access_token(mocker):
-    mock_get = mocker.patch("requests.get", return_value=make_response([]))
+    mock_get = mocker.patch("requests.Session.get", return_value=make_response([]))
     get_activities("token123")
     headers = mock_get.call_args[1]["headers"]
     assert headers["Authorization"] == "Bearer token123"
 
 
 def test_get_activities_passes_page_and_per_page(mocker):
-    mock_get = mocker.patch("requests.get", return_value=make_response([]))
+    mock_get = mocker.patch("requests.Session.get", return_value=make_response([]))
     get_activities("token123", page=2, per_page=50)
     params = mock_get.call_args[1]["params"]
     assert params["page"] == 2
@@ -37,14 +37,14 @@ def test_get_activities_passes_page_and_per_page(mocker):
 
 
 def test_get_activities_passes_after_param(mocker):
-    mock_get = mocker.patch("requests.get", return_value=make_response([]))
+    mock_get = mocker.patch("requests.Session.get", return_value=make_response([]))
     get_activities("token123", after=1700000000)
     params = mock_get.call_args[1]["params"]
     assert params["after"] == 1700000000
 
 
 def test_get_activities_no_after_by_default(mocker):
-    mock_get = mocker.patch("requests.get", return_value=make_response([]))
+    mock_get = mocker.patch("requests.Session.get", return_value=make_response([]))
     get_activities("token123")
     params = mock_get.call_args[1]["params"]
     assert "after" not in params
@@ -52,20 +52,20 @@ def test_get_activities_no_after_by_default(mocker):
 
 def test_get_activities_returns_list(mocker):
     data = [{"id": 1, "name": "Run"}]
-    mocker.patch("requests.get", return_value=make_response(data))
+    mocker.patch("requests.Session.get", return_value=make_response(data))
     result = get_activities("token123")
     assert result == data
 
 
 def test_get_activity_calls_correct_endpoint(mocker):
-    mock_get = mocker.patch("requests.get", return_value=make_response({"id": 42}))
+    mock_get = mocker.patch("requests.Session.get", return_value=make_response({"id": 42}))
     get_activity("token123", 42)
     url = mock_get.call_args[0][0]
     assert url == f"{STRAVA_API}/activities/42"
 
 
 def test_get_activity_sends_access_token(mocker):
-    mock_get = mocker.patch("requests.get", return_value=make_response({"id": 42}))
+    mock_get = mocker.patch("requests.Session.get", return_value=make_response({"id": 42}))
     get_activity("token123", 42)
     headers = mock_get.call_args[1]["headers"]
     assert headers["Authorization"] == "Bearer token123"
@@ -73,14 +73,22 @@ def test_get_activity_sends_access_token(mocker):
 
 def test_get_activity_returns_dict(mocker):
     data = {"id": 42, "name": "Morning Run"}
-    mocker.patch("requests.get", return_value=make_response(data))
+    mocker.patch("requests.Session.get", return_value=make_response(data))
     result = get_activity("token123", 42)
     assert result == data
 
 
+def test_get_activity_streams_requests_keys_by_type(mocker):
+    data = {"time": {"data": [0, 1, 2]}}
+    mock_get = mocker.patch("requests.Session.get", return_value=make_response(data))
+    assert get_activity_streams("token123", 42, keys=("time", "heartrate")) == data
+    assert mock_get.call_args[0][0] == f"{STRAVA_API}/activities/42/streams"
+    assert mock_get.call_args[1]["params"] == {"keys": "time,heartrate", "key_by_type": "true"}
+
+
 def test_refresh_access_token_calls_token_endpoint(mocker):
     mock_post = mocker.patch(
-        "requests.post",
+        "requests.Session.post",
         return_value=make_response({"access_token": "new", "refresh_token": "r2"}),
     )
     refresh_access_token("cid", "csecret", "old_refresh")
@@ -90,7 +98,7 @@ def test_refresh_access_token_calls_token_endpoint(mocker):
 
 def test_refresh_access_token_sends_correct_params(mocker):
     mock_post = mocker.patch(
-        "requests.post",
+        "requests.Session.post",
         return_value=make_response({"access_token": "new", "refresh_token": "r2"}),
     )
     refresh_access_token("cid", "csecret", "old_refresh")
@@ -103,6 +111,135 @@ def test_refresh_access_token_sends_correct_params(mocker):
 
 def test_refresh_access_token_returns_dict(mocker):
     response_data = {"access_token": "new_token", "refresh_token": "new_refresh"}
-    mocker.patch("requests.post", return_value=make_response(response_data))
+    mocker.patch("requests.Session.post", return_value=make_response(response_data))
     result = refresh_access_token("cid", "csecret", "old")
     assert result == response_data
+
+
+def test_shared_client_is_reused():
+    from strava.client import get_client
+    assert get_client() is get_client()
+
+
+def test_set_client_replaces_shared_client(mocker):
+    from strava.client import StravaClient, get_client, set_client
+    mocker.patch("strava.client._client", None)
+    client = StravaClient(pool_size=3, timeout=7)
+    set_client(client)
+    assert get_client() is client
+    mock_get = mocker.patch("requests.Session.get", return_value=make_response({"id": 1}))
+    get_activity("token123", 1)
+    assert mock_get.call_args[1]["timeout"] == 7
+
+
+def test_client_mounts_pooled_adapter():
+    from strava.client import StravaClient
+    client = StravaClient(pool_size=4)
+    adapter = client.session.get_adapter(STRAVA_API)
+    assert adapter._pool_maxsize == 4
+
+
+def test_rate_limited_call_waits_and_retries(mocker):
+    from strava.client import StravaClient
+    limiter = MagicMock()
+    throttled = make_response(None, status_code=429)
+    ok = make_response([{"id": 1}])
+    mock_get = mocker.patch("requests.Session.get", side_effect=[throttled, ok])
+    client = StravaClient(rate_limiter=limiter)
+    assert client.get_activities("token123") == [{"id": 1}]
+    assert mock_get.call_count == 2
+    assert limiter.acquire.call_count == 2
+    limiter.exhaust.assert_called_once_with(throttled.headers)
+
+
+def test_token_refresh_does_not_draw_from_budget(mocker):
+    from strava.client import StravaClient
+    limiter = MagicMock()
+    mocker.patch("requests.Session.post", return_value=make_response({"access_token": "a"}))
+    StravaClient(rate_limiter=limiter).refresh_access_token("cid", "secret", "r")
+    limiter.acquire.assert_not_called()
+
+
+def test_get_activities_passes_before_param(mocker):
+    mock_get = mocker.patch("requests.Session.get", return_value=make_response([]))
+    get_activities("token123", after=1600000000, before=1700000000)
+    params = mock_get.call_args[1]["params"]
+    assert params["before"] == 1700000000
+
+
+def make_error_response(status_code, headers=None):
+    import requests
+    mock = MagicMock()
+    mock.status_code = status_code
+    mock.headers = headers or {}
+    mock.raise_for_status.side_effect = requests.exceptions.HTTPError(f"{status_code} Error")
+    return mock
+
+
+def test_transient_server_error_is_retried(mocker):
+    from strava.client import StravaClient
+    sleep = mocker.patch("strava.client.time.sleep")
+    mock_get = mocker.patch(
+        "requests.Session.get",
+        side_effect=[make_error_response(502), make_error_response(503), make_response({"id": 1})],
+    )
+    client = StravaClient()
+    assert client.get_activity("token123", 1) == {"id": 1}
+    assert mock_get.call_count == 3
+    assert sleep.call_count == 2
+    assert client.retry_metrics() == {"activity": {"retries": 2, "gave_up": 0}}
+
+
+def test_connection_error_is_retried(mocker):
+    import requests
+    from strava.client import StravaClient
+    mocker.patch("strava.client.time.sleep")
+    mocker.patch(
+        "requests.Session.get",
+        side_effect=[requests.exceptions.ConnectionError("reset"), make_response([])],
+    )
+    assert StravaClient().get_activities("token123") == []
+
+
+def test_retry_gives_up_after_max_attempts(mocker):
+    import requests
+    from strava.client import StravaClient
+    from strava.retry import RetryPolicy
+    mocker.patch("strava.client.time.sleep")
+    mock_get = mocker.patch("requests.Session.get", return_value=make_error_response(500))
+    client = StravaClient(retry_policy=RetryPolicy(max_attempts=3))
+    with pytest.raises(requests.exceptions.HTTPError):
+        client.get_activity("token123", 1)
+    assert mock_get.call_count == 3
+    assert client.retry_metrics()["activity"] == {"retries": 2, "gave_up": 1}
+
+
+def test_client_error_is_not_retried(mocker):
+    import requests
+    from strava.client import StravaClient
+    mock_get = mocker.patch("requests.Session.get", return_value=make_error_response(404))
+    with pytest.raises(requests.exceptions.HTTPError):
+        StravaClient().get_activity("token123", 1)
+    assert mock_get.call_count == 1
+
+
+def test_retry_after_header_is_honoured(mocker):
+    from strava.client import StravaClient
+    sleep = mocker.patch("strava.client.time.sleep")
+    mocker.patch(
+        "requests.Session.get",
+        side_effect=[make_error_response(503, {"Retry-After": "42"}), make_response({"id": 1})],
+    )
+    StravaClient().get_activity("token123", 1)
+    sleep.assert_called_once_with(42.0)
+
+
+def test_token_refresh_is_retried(mocker):
+    from strava.client import StravaClient
+    mocker.patch("strava.client.time.sleep")
+    mock_post = mocker.patch(
+        "requests.Session.post",
+        side_effect=[make_error_response(502), make_response({"access_token": "a"})],
+    )
+    assert StravaClient().refresh_access_token("cid", "secret", "r") == {"access_token": "a"}
+    assert mock_post.call_count == 2
@@ -0,0 +1,112 @@
+import json
+
+import pytest
+
+from strava.compression import (
+    JSON_CODEC,
+    RawCodec,
+    codec_for_marker,
+    get_write_codec,
+    set_write_codec,
+    train_dictionary,
+)
+from strava.db import (
+    get_activity,
+    get_summary_activity_ids,
+    recompress_activities,
+    upsert_activities,
+    upsert_activity,
+)
+from tests.conftest import make_activity
+
+
+# Laps make the payload long and repetitive, like real detail payloads.
+LAPS = [{"lap_index": i, "distance": 1000.0, "elapsed_time": 300} for i in range(10)]
+
+
+def activity_with_laps(activity_id, resource_state=2):
+    return make_activity(activity_id, resource_state=resource_state, laps=LAPS)
+
+
+TEXT = json.dumps(activity_with_laps(1))
+
+
+@pytest.mark.parametrize("codec", [JSON_CODEC, RawCodec("zlib")])
+def test_codec_roundtrip(codec):
+    assert codec.decode(codec.encode(TEXT)) == TEXT
+
+
+def test_zlib_dictionary_roundtrip_and_shrinks():
+    samples = [json.dumps(activity_with_laps(i)).encode() for i in range(20)]
+    plain = RawCodec("zlib")
+    with_dict = RawCodec("zlib", train_dictionary("zlib", samples))
+    encoded = with_dict.encode(TEXT)
+    assert with_dict.decode(encoded) == TEXT
+    assert len(encoded) < len(plain.encode(TEXT))
+
+
+def test_marker_includes_dictionary_id():
+    codec = RawCodec("zlib", b"dictionary")
+    assert codec.marker == f"zlib:{codec.dict_id}"
+    assert JSON_CODEC.marker == "json"
+
+
+def test_codec_for_unknown_marker_raises(conn):
+    with pytest.raises(ValueError):
+        codec_for_marker(conn, "lz4")
+
+
+def test_write_codec_defaults_to_json(conn):
+    assert get_write_codec(conn) == JSON_CODEC
+
+
+def test_upsert_uses_configured_codec_and_get_activity_decodes(conn):
+    codec = RawCodec("zlib", train_dictionary("zlib", [TEXT.encode()]))
+    set_write_codec(conn, codec)
+    upsert_activity(conn, activity_with_laps(1))
+    raw, raw_format = conn.execute("SELECT raw_json, raw_format FROM activities").fetchone()
+    assert isinstance(raw, bytes)
+    assert raw_format == codec.marker
+    assert json.loads(get_activity(conn, 1)["raw_json"]) == activity_with_laps(1)
+
+
+def test_dictionary_is_loaded_from_database(conn):
+    codec = RawCodec("zlib", b'{"laps": [{"lap_index": ')
+    set_write_codec(conn, codec)
+    upsert_activity(conn, activity_with_laps(1))
+    from strava import compression
+
+    compression._dictionaries.clear()
+    assert json.loads(get_activity(conn, 1)["raw_json"])["id"] == 1
+
+
+def test_recompress_converts_rows_in_batches(conn):
+    upsert_activities(conn, [activity_with_laps(i) for i in range(5)])
+    codec = RawCodec("zlib")
+    set_write_codec(conn, codec)
+    progress = []
+    assert recompress_activities(conn, codec, batch_size=2, progress=progress.append) == 5
+    assert progress == [2, 4, 5]
+    formats = {row[0] for row in conn.execute("SELECT raw_format FROM activities")}
+    assert formats == {"zlib"}
+    assert recompress_activities(conn, codec) == 0
+    assert json.loads(get_activity(conn, 3)["raw_json"]) == activity_with_laps(3)
+
+
+def test_recompress_back_to_json(conn):
+    set_write_codec(conn, RawCodec("zlib"))
+    upsert_activity(conn, activity_with_laps(1))
+    assert recompress_activities(conn, JSON_CODEC) == 1
+    assert json.loads(conn.execute("SELECT raw_json FROM activities").fetchone()[0])["id"] == 1
+
+
+def test_summary_ids_work_on_compressed_rows(conn):
+    set_write_codec(conn, RawCodec("zlib"))
+    upsert_activities(conn, [activity_with_laps(1, resource_state=2), activity_with_laps(2, resource_state=3)])
+    assert get_summary_activity_ids(conn) == [1]
+
+
+def test_zstd_roundtrip():
+    pytest.importorskip("zstandard")
+    codec = RawCodec("zstd")
+    assert codec.decode(codec.encode(TEXT)) == TEXT
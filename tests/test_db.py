@@ -2,7 +2,32 @@ import sqlite3
 import tempfile
 import os
 import pytest
-from strava.db import init_db, upsert_activity, get_activity_ids, get_activity
+from strava.db import (
+    SCHEMA_VERSION,
+    ConnectionPool,
+    migrate,
+    connect,
+    init_db,
+    upsert_activity,
+    get_activity_ids,
+    filter_new_ids,
+    get_activity,
+    get_summary_activity_ids,
+    mark_details_missing,
+    set_synchronous,
+    upsert_activities,
+    activity_content_hash,
+    get_sync_state,
+    set_sync_state,
+    get_high_water_mark,
+    advance_high_water_mark,
+    create_sync_windows,
+    checkpoint_sync_window,
+    get_sync_windows,
+    create_sync_run,
+    update_sync_run,
+    get_resumable_sync_run,
+)
 
 
 @pytest.fixture
@@ -93,3 +118,403 @@ def test_get_activity_returns_dict(conn):
 
 def test_get_activity_returns_none_for_missing(conn):
     assert get_activity(conn, 99999) is None
+
+
+def test_get_summary_activity_ids(conn):
+    upsert_activity(conn, dict(SAMPLE_ACTIVITY, resource_state=2))
+    upsert_activity(conn, dict(SAMPLE_ACTIVITY, id=99999, resource_state=3))
+    assert get_summary_activity_ids(conn) == [12345]
+
+
+def test_get_summary_activity_ids_skips_missing_details(conn):
+    upsert_activity(conn, dict(SAMPLE_ACTIVITY, resource_state=2))
+    upsert_activity(conn, dict(SAMPLE_ACTIVITY, id=99999, resource_state=2))
+    mark_details_missing(conn, [99999])
+    assert get_summary_activity_ids(conn) == [12345]
+
+
+def test_summary_does_not_downgrade_stored_detail(conn):
+    import json
+
+    detail = dict(
+        SAMPLE_ACTIVITY,
+        resource_state=3,
+        description="Easy pace",
+        map={"id": "a1", "polyline": "full", "summary_polyline": "short", "resource_state": 3},
+    )
+    summary = dict(
+        SAMPLE_ACTIVITY, resource_state=2, map={"id": "a1", "summary_polyline": "short", "resource_state": 2}
+    )
+    upsert_activity(conn, detail)
+
+    assert upsert_activities(conn, [summary]).unchanged == 1
+    assert get_summary_activity_ids(conn) == []
+
+    assert upsert_activities(conn, [dict(summary, name="Renamed")]).updated == 1
+    stored = json.loads(get_activity(conn, 12345)["raw_json"])
+    assert stored["name"] == "Renamed"
+    assert stored["description"] == "Easy pace"
+    assert stored["map"]["polyline"] == "full"
+    assert stored["resource_state"] == 3
+    assert get_summary_activity_ids(conn) == []
+
+
+def test_upsert_activities_inserts_all(conn):
+    activities = [dict(SAMPLE_ACTIVITY, id=i, name=f"Run {i}") for i in range(1, 6)]
+    stats = upsert_activities(conn, activities)
+    assert (stats.inserted, stats.updated, stats.unchanged) == (5, 0, 0)
+    assert get_activity_ids(conn) == {1, 2, 3, 4, 5}
+
+
+def test_upsert_activities_commits_once_per_batch(conn):
+    statements = []
+    conn.set_trace_callback(statements.append)
+    activities = (dict(SAMPLE_ACTIVITY, id=i) for i in range(1, 8))
+    upsert_activities(conn, activities, batch_size=3)
+    conn.set_trace_callback(None)
+    assert sum(1 for s in statements if s == "COMMIT") == 3
+
+
+def test_upsert_activities_replaces_existing(conn):
+    upsert_activity(conn, SAMPLE_ACTIVITY)
+    upsert_activities(conn, [dict(SAMPLE_ACTIVITY, name="Evening Run")])
+    assert get_activity(conn, 12345)["name"] == "Evening Run"
+
+
+def test_upsert_activities_rolls_back_failed_batch(conn):
+    broken = {"id": 2}  # missing required columns
+    with pytest.raises(sqlite3.ProgrammingError):
+        upsert_activities(conn, [dict(SAMPLE_ACTIVITY, id=1), broken])
+    assert get_activity_ids(conn) == set()
+
+
+def test_upsert_activities_empty(conn):
+    assert upsert_activities(conn, []).written == 0
+
+
+def test_set_synchronous(conn):
+    set_synchronous(conn, "normal")
+    assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+    with pytest.raises(ValueError):
+        set_synchronous(conn, "bogus")
+
+
+def test_sync_state_roundtrip(conn):
+    assert get_sync_state(conn, "foo") is None
+    set_sync_state(conn, "foo", "bar")
+    set_sync_state(conn, "foo", "baz")
+    assert get_sync_state(conn, "foo") == "baz"
+
+
+def test_high_water_mark_only_moves_forward(conn):
+    assert get_high_water_mark(conn) is None
+    advance_high_water_mark(conn, "2024-03-15T06:00:00Z")
+    advance_high_water_mark(conn, "2023-01-01T06:00:00Z")
+    assert get_high_water_mark(conn) == "2024-03-15T06:00:00Z"
+    advance_high_water_mark(conn, "2024-04-01T06:00:00Z")
+    assert get_high_water_mark(conn) == "2024-04-01T06:00:00Z"
+
+
+def test_sync_window_checkpoints(conn):
+    create_sync_windows(conn, "run1", [(None, 100), (99, None)])
+    checkpoint_sync_window(conn, "run1", 1, 3, done=False)
+    checkpoint_sync_window(conn, "run1", 1, 4, done=True)
+    windows = get_sync_windows(conn, "run1")
+    assert windows == [
+        {"window_index": 0, "after_ts": None, "before_ts": 100, "last_page": 0, "done": 0},
+        {"window_index": 1, "after_ts": 99, "before_ts": None, "last_page": 4, "done": 1},
+    ]
+
+
+def test_sync_run_journal(conn):
+    assert get_resumable_sync_run(conn) is None
+    create_sync_run(conn, "run1", {"after_ts": 100}, [(100, None)])
+    update_sync_run(conn, "run1", newest_start_date="2024-03-20T06:00:00Z")
+    update_sync_run(conn, "run1", newest_start_date="2024-03-01T06:00:00Z")
+    update_sync_run(conn, "run1", status="failed", error="boom")
+    run = get_resumable_sync_run(conn)
+    assert run == {
+        "run_id": "run1",
+        "params": {"after_ts": 100},
+        "status": "failed",
+        "newest_start_date": "2024-03-20T06:00:00Z",
+        "error": "boom",
+    }
+    update_sync_run(conn, "run1", status="completed")
+    assert get_resumable_sync_run(conn) is None
+
+
+def test_content_hash_ignores_key_order():
+    reordered = dict(reversed(list(SAMPLE_ACTIVITY.items())))
+    assert activity_content_hash(reordered) == activity_content_hash(SAMPLE_ACTIVITY)
+    assert activity_content_hash(dict(SAMPLE_ACTIVITY, name="x")) != activity_content_hash(SAMPLE_ACTIVITY)
+
+
+def test_upsert_stores_content_hash(conn):
+    upsert_activity(conn, SAMPLE_ACTIVITY)
+    row = conn.execute("SELECT content_hash FROM activities WHERE id = 12345").fetchone()
+    assert row["content_hash"] == activity_content_hash(SAMPLE_ACTIVITY)
+
+
+def test_upsert_activities_classifies_new_changed_unchanged(conn):
+    upsert_activities(conn, [SAMPLE_ACTIVITY, dict(SAMPLE_ACTIVITY, id=2)])
+    stats = upsert_activities(
+        conn,
+        [SAMPLE_ACTIVITY, dict(SAMPLE_ACTIVITY, id=2, name="Renamed"), dict(SAMPLE_ACTIVITY, id=3)],
+    )
+    assert (stats.inserted, stats.updated, stats.unchanged) == (1, 1, 1)
+    assert get_activity(conn, 2)["name"] == "Renamed"
+
+
+def test_unchanged_activities_cost_no_writes(conn):
+    upsert_activities(conn, [SAMPLE_ACTIVITY])
+    changes_before = conn.total_changes
+    stats = upsert_activities(conn, [SAMPLE_ACTIVITY])
+    upsert_activity(conn, SAMPLE_ACTIVITY)
+    assert stats.unchanged == 1
+    assert conn.total_changes == changes_before
+
+
+# activities as created by the first release, before any added column.
+FIRST_RELEASE_TABLE_SQL = """
+CREATE TABLE activities (
+    id INTEGER PRIMARY KEY, name TEXT, type TEXT, sport_type TEXT, distance REAL,
+    moving_time INTEGER, elapsed_time INTEGER, total_elevation_gain REAL, start_date TEXT,
+    start_date_local TEXT, timezone TEXT, raw_json TEXT, synced_at TEXT DEFAULT (datetime('now'))
+)
+"""
+
+
+def test_init_db_adds_content_hash_to_old_table(db_path):
+    import json
+
+    old = sqlite3.connect(db_path)
+    old.execute(FIRST_RELEASE_TABLE_SQL)
+    old.execute(
+        "INSERT INTO activities (id, raw_json) VALUES (1, ?)",
+        (json.dumps({**SAMPLE_ACTIVITY, "gear_id": "g1"}),),
+    )
+    old.commit()
+    old.close()
+    init_db(db_path)
+    c = sqlite3.connect(db_path)
+    columns = {row[1] for row in c.execute("PRAGMA table_info(activities)")}
+    assert {"content_hash", "raw_format", "resource_state"} <= columns
+    assert c.execute("SELECT gear_id, raw_format FROM activities").fetchone() == ("g1", "json")
+    assert c.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+    c.close()
+
+
+def test_init_db_enables_wal(db_path):
+    init_db(db_path)
+    c = sqlite3.connect(db_path)
+    assert c.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    c.close()
+
+
+def test_connect_applies_pragmas(db_path):
+    init_db(db_path)
+    c = connect(db_path, busy_timeout=2.5, mmap_size=1024 * 1024)
+    assert c.execute("PRAGMA busy_timeout").fetchone()[0] == 2500
+    assert c.execute("PRAGMA mmap_size").fetchone()[0] == 1024 * 1024
+    assert c.row_factory is sqlite3.Row
+    c.close()
+
+
+def test_connection_pool_reuses_connections(db_path):
+    init_db(db_path)
+    pool = ConnectionPool(db_path, size=1)
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        assert second is first
+    pool.close()
+
+
+def test_connection_pool_rolls_back_abandoned_transaction(db_path):
+    init_db(db_path)
+    pool = ConnectionPool(db_path)
+    with pool.connection() as c:
+        c.execute("INSERT INTO sync_state (key, value) VALUES ('k', 'v')")
+    with pool.connection() as c:
+        assert not c.in_transaction
+        assert get_sync_state(c, "k") is None
+    pool.close()
+
+
+def test_connection_pool_closes_surplus_connections(db_path):
+    init_db(db_path)
+    pool = ConnectionPool(db_path, size=1)
+    with pool.connection():
+        with pool.connection():
+            pass
+    assert len(pool._idle) == 1
+    pool.close()
+
+
+def test_filter_new_ids_returns_unstored_ids_in_order(conn):
+    upsert_activity(conn, SAMPLE_ACTIVITY)
+    assert filter_new_ids(conn, [3, 12345, 1, 2]) == [3, 1, 2]
+
+
+def test_filter_new_ids_handles_more_ids_than_one_chunk(conn, mocker):
+    mocker.patch("strava.db._LOOKUP_CHUNK", 2)
+    upsert_activity(conn, SAMPLE_ACTIVITY)
+    assert filter_new_ids(conn, [1, 12345, 2, 3, 4]) == [1, 2, 3, 4]
+
+
+def test_filter_new_ids_empty(conn):
+    assert filter_new_ids(conn, []) == []
+
+
+DETAILED_ACTIVITY = {
+    **SAMPLE_ACTIVITY,
+    "average_heartrate": 151.5,
+    "average_watts": 230.0,
+    "kudos_count": 4,
+    "gear_id": "g123",
+    "map": {"summary_polyline": "abc"},
+}
+
+
+def test_init_db_sets_schema_version(db_path):
+    init_db(db_path)
+    c = sqlite3.connect(db_path)
+    assert c.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+    assert migrate(c) == 0
+    c.close()
+
+
+def test_upsert_fills_extracted_columns(conn):
+    upsert_activity(conn, DETAILED_ACTIVITY)
+    row = conn.execute(
+        "SELECT average_heartrate, average_watts, kudos_count, gear_id, summary_polyline FROM activities"
+    ).fetchone()
+    assert tuple(row) == (151.5, 230.0, 4, "g123", "abc")
+
+
+def test_migration_backfills_plain_and_compressed_rows(db_path):
+    import json
+    import zlib
+
+    old = sqlite3.connect(db_path)
+    old.execute(FIRST_RELEASE_TABLE_SQL)
+    old.execute("ALTER TABLE activities ADD COLUMN raw_format TEXT DEFAULT 'json'")
+    old.execute(
+        "INSERT INTO activities (id, raw_json) VALUES (1, ?)", (json.dumps(DETAILED_ACTIVITY),)
+    )
+    old.execute(
+        "INSERT INTO activities (id, raw_json, raw_format) VALUES (2, ?, 'zlib')",
+        (zlib.compress(json.dumps({**DETAILED_ACTIVITY, "gear_id": "g9"}).encode()),),
+    )
+    old.commit()
+    old.close()
+    init_db(db_path)
+    c = sqlite3.connect(db_path)
+    rows = c.execute("SELECT id, gear_id, average_heartrate FROM activities ORDER BY id").fetchall()
+    assert rows == [(1, "g123", 151.5), (2, "g9", 151.5)]
+    c.close()
+
+
+def test_owner_id_migration_adds_and_backfills_column(db_path):
+    import json
+    from strava.db import MIGRATIONS
+
+    old = sqlite3.connect(db_path)
+    old.execute(FIRST_RELEASE_TABLE_SQL)
+    old.execute("ALTER TABLE activities ADD COLUMN raw_format TEXT DEFAULT 'json'")
+    old.execute(
+        "INSERT INTO activities (id, raw_json) VALUES (1, ?)",
+        (json.dumps({**SAMPLE_ACTIVITY, "athlete": {"id": 7}}),),
+    )
+    for number, migration in enumerate(MIGRATIONS[:4], start=1):
+        migration(old)
+        old.execute(f"PRAGMA user_version = {number}")
+    columns = {row[1] for row in old.execute("PRAGMA table_info(activities)")}
+    assert "owner_id" not in columns
+    old.commit()
+    old.close()
+    init_db(db_path)
+    c = sqlite3.connect(db_path)
+    assert c.execute("SELECT owner_id FROM activities").fetchone()[0] == 7
+    c.close()
+
+
+def test_migrate_refuses_newer_schema(conn):
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION + 1}")
+    with pytest.raises(RuntimeError):
+        migrate(conn)
+
+
+def test_heartrate_and_gear_queries_use_indexes(conn):
+    for sql in (
+        "SELECT id FROM activities WHERE average_heartrate > 150",
+        "SELECT id FROM activities WHERE gear_id = 'g1' ORDER BY start_date DESC",
+    ):
+        plan = " ".join(row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql))
+        assert "USING" in plan and "INDEX" in plan, plan
+        assert "TEMP B-TREE" not in plan
+
+
+def weekly(c):
+    return {
+        (row[0], row[1]): (row[2], row[3])
+        for row in c.execute("SELECT week, sport_type, activity_count, distance FROM agg_weekly")
+    }
+
+
+def test_aggregates_follow_insert_update_and_delete(conn):
+    upsert_activities(conn, [SAMPLE_ACTIVITY, dict(SAMPLE_ACTIVITY, id=2, distance=800.0)])
+    assert weekly(conn) == {("2024-03-11", "Run"): (2, 11000.0)}
+    upsert_activity(
+        conn,
+        dict(SAMPLE_ACTIVITY, id=2, sport_type="Ride", distance=900.0, start_date_local="2024-03-18T07:00:00"),
+    )
+    assert weekly(conn) == {("2024-03-11", "Run"): (1, 10200.0), ("2024-03-18", "Ride"): (1, 900.0)}
+    with conn:
+        conn.execute("DELETE FROM activities WHERE id = 2")
+    assert weekly(conn) == {("2024-03-11", "Run"): (1, 10200.0)}
+    month = conn.execute("SELECT month, activity_count FROM agg_monthly").fetchall()
+    assert [tuple(row) for row in month] == [("2024-03", 1)]
+
+
+def test_aggregates_handle_insert_or_replace(db_path):
+    init_db(db_path)
+    c = connect(db_path)
+    upsert_activity(c, SAMPLE_ACTIVITY)
+    with c:
+        c.execute(
+            "INSERT OR REPLACE INTO activities (id, sport_type, distance, start_date_local) "
+            "VALUES (12345, 'Ride', 500.0, '2024-04-02T07:00:00')"
+        )
+    assert weekly(c) == {("2024-04-01", "Ride"): (1, 500.0)}
+    c.close()
+
+
+def test_rebuild_aggregates_matches_triggers(conn):
+    from strava.db import rebuild_aggregates
+
+    upsert_activities(conn, [dict(SAMPLE_ACTIVITY, id=i, distance=100.0 * i) for i in range(1, 6)])
+    before = weekly(conn)
+    conn.execute("DELETE FROM agg_weekly")
+    rebuild_aggregates(conn)
+    assert weekly(conn) == before
+
+
+def test_purge_athlete_deletes_in_chunks(conn):
+    from strava.db import purge_athlete
+
+    upsert_activities(
+        conn,
+        [dict(SAMPLE_ACTIVITY, id=i, athlete={"id": 7 if i <= 5 else 8}) for i in range(1, 8)],
+    )
+    progress = []
+    assert purge_athlete(conn, 7, chunk_size=2, progress=progress.append) == 5
+    assert progress == [2, 4, 5]
+    assert get_activity_ids(conn) == {6, 7}
+    assert weekly(conn) == {("2024-03-11", "Run"): (2, 20400.0)}
+
+
+def test_owner_id_is_extracted(conn):
+    upsert_activity(conn, dict(SAMPLE_ACTIVITY, athlete={"id": 7, "resource_state": 1}))
+    assert conn.execute("SELECT owner_id FROM activities").fetchone()[0] == 7
@@ -0,0 +1,231 @@
+import json
+import threading
+import time
+
+import pytest
+
+from strava.db import init_db
+from strava.event_queue import (
+    WorkerPool,
+    ack_event,
+    claim_event,
+    enqueue_event,
+    extend_lease,
+    fail_event,
+    get_dead_events,
+    requeue_dead_events,
+)
+
+EVENT = {"object_type": "activity", "aspect_type": "create", "object_id": 42, "owner_id": 1}
+
+
+@pytest.fixture
+def db_path(db_path):
+    init_db(db_path)
+    return db_path
+
+
+def test_enqueue_and_claim_returns_event(conn):
+    enqueue_event(conn, EVENT)
+    queued = claim_event(conn)
+    assert queued.event == EVENT
+    assert queued.attempts == 1
+
+
+def test_claim_returns_none_on_empty_queue(conn):
+    assert claim_event(conn) is None
+
+
+def test_claimed_event_is_hidden_until_visibility_timeout(conn, mocker):
+    enqueue_event(conn, EVENT)
+    claim_event(conn, visibility_timeout=60)
+    assert claim_event(conn) is None
+
+    mocker.patch("strava.event_queue.time.time", return_value=10**10)
+    redelivered = claim_event(conn)
+    assert redelivered.event == EVENT
+    assert redelivered.attempts == 2
+
+
+def test_claim_is_fifo(conn):
+    for object_id in (1, 2, 3):
+        enqueue_event(conn, {**EVENT, "object_id": object_id})
+    assert [claim_event(conn).event["object_id"] for _ in range(3)] == [1, 2, 3]
+
+
+def test_ack_removes_event(conn):
+    enqueue_event(conn, EVENT)
+    queued = claim_event(conn)
+    ack_event(conn, queued)
+    assert conn.execute("SELECT COUNT(*) FROM webhook_queue").fetchone()[0] == 0
+
+
+def test_lost_claim_is_not_acked_or_failed(conn, mocker):
+    enqueue_event(conn, EVENT)
+    stale = claim_event(conn, visibility_timeout=60)
+    mocker.patch("strava.event_queue.time.time", return_value=10**10)
+    current = claim_event(conn)
+    assert extend_lease(conn, stale) is False
+    assert ack_event(conn, stale) is False
+    assert fail_event(conn, stale, "boom", max_attempts=1) is False
+    row = conn.execute("SELECT status, last_error FROM webhook_queue").fetchone()
+    assert row == ("pending", None)
+    assert ack_event(conn, current) is True
+
+
+def test_extend_lease_keeps_event_hidden(conn, mocker):
+    enqueue_event(conn, EVENT)
+    queued = claim_event(conn, visibility_timeout=60)
+    clock = mocker.patch("strava.event_queue.time.time", return_value=10**10)
+    assert extend_lease(conn, queued, visibility_timeout=60) is True
+    clock.return_value = 10**10 + 30
+    assert claim_event(conn) is None
+    assert ack_event(conn, queued) is True
+
+
+def test_fail_event_schedules_retry(conn):
+    enqueue_event(conn, EVENT)
+    queued = claim_event(conn)
+    assert fail_event(conn, queued, "boom", max_attempts=3) is False
+    status, last_error = conn.execute("SELECT status, last_error FROM webhook_queue").fetchone()
+    assert (status, last_error) == ("pending", "boom")
+    assert claim_event(conn) is None  # backing off
+
+
+def test_fail_event_dead_letters_after_max_attempts(conn):
+    enqueue_event(conn, EVENT)
+    queued = claim_event(conn)
+    assert fail_event(conn, queued, "boom", max_attempts=1) is True
+    dead = get_dead_events(conn)
+    assert dead == [{"id": queued.id, "event": EVENT, "attempts": 1, "last_error": "boom"}]
+
+
+def test_requeue_dead_events(conn):
+    enqueue_event(conn, EVENT)
+    fail_event(conn, claim_event(conn), "boom", max_attempts=1)
+    assert requeue_dead_events(conn) == 1
+    assert get_dead_events(conn) == []
+    assert claim_event(conn).attempts == 1
+
+
+def test_process_one_acks_on_success(db_path, conn):
+    handler = []
+    pool = WorkerPool(db_path, lambda event, c: handler.append(event))
+    enqueue_event(conn, EVENT)
+    assert pool.process_one(conn) is True
+    assert handler == [EVENT]
+    assert conn.execute("SELECT COUNT(*) FROM webhook_queue").fetchone()[0] == 0
+
+
+def test_process_one_records_failure(db_path, conn):
+    def handler(event, c):
+        raise RuntimeError("api down")
+
+    pool = WorkerPool(db_path, handler, max_attempts=1)
+    enqueue_event(conn, EVENT)
+    assert pool.process_one(conn) is True
+    assert get_dead_events(conn)[0]["last_error"] == "RuntimeError('api down')"
+
+
+def test_process_one_returns_false_when_idle(db_path, conn):
+    pool = WorkerPool(db_path, lambda event, c: None)
+    assert pool.process_one(conn) is False
+
+
+def test_worker_pool_processes_each_event_once(db_path, conn):
+    seen = []
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def handler(event, c):
+        with lock:
+            seen.append(event["object_id"])
+            if len(seen) == 20:
+                done.set()
+
+    for object_id in range(20):
+        enqueue_event(conn, {**EVENT, "object_id": object_id})
+    pool = WorkerPool(db_path, handler, workers=4, poll_interval=0.01)
+    pool.start()
+    try:
+        assert done.wait(5)
+    finally:
+        pool.stop(timeout=5)
+    assert sorted(seen) == list(range(20))
+
+
+def test_worker_pool_extends_lease_of_slow_handler(db_path, conn):
+    enqueue_event(conn, EVENT)
+    started, release = threading.Event(), threading.Event()
+
+    def handler(event, c):
+        started.set()
+        release.wait(5)
+
+    pool = WorkerPool(db_path, handler, visibility_timeout=0.3, poll_interval=0.01)
+    pool.start()
+    try:
+        assert started.wait(5)
+        time.sleep(0.6)  # two visibility timeouts
+        assert claim_event(conn) is None
+        release.set()
+    finally:
+        pool.stop(timeout=5)
+    assert conn.execute("SELECT COUNT(*) FROM webhook_queue").fetchone()[0] == 0
+
+
+def test_coalesce_merges_updates_into_one_row(conn):
+    update = {**EVENT, "aspect_type": "update"}
+    first = enqueue_event(conn, {**update, "updates": {"title": "A"}}, coalesce_window=10)
+    second = enqueue_event(conn, {**update, "updates": {"type": "Ride"}}, coalesce_window=10)
+    assert first == second
+    payload = conn.execute("SELECT payload FROM webhook_queue").fetchall()
+    assert len(payload) == 1
+
+
+def test_coalesce_create_absorbs_updates(conn, mocker):
+    enqueue_event(conn, EVENT, coalesce_window=10)
+    enqueue_event(conn, {**EVENT, "aspect_type": "update", "updates": {"title": "A"}}, coalesce_window=10)
+    mocker.patch("strava.event_queue.time.time", return_value=10**10)
+    queued = claim_event(conn)
+    assert queued.event["aspect_type"] == "create"
+    assert queued.event["updates"] == {"title": "A"}
+    assert claim_event(conn) is None
+
+
+def test_coalesce_holds_event_for_window(conn):
+    enqueue_event(conn, EVENT, coalesce_window=10)
+    assert claim_event(conn) is None
+
+
+def test_coalesce_keeps_deadline_of_first_event(conn, mocker):
+    clock = mocker.patch("strava.event_queue.time.time", return_value=1000.0)
+    enqueue_event(conn, EVENT, coalesce_window=10)
+    clock.return_value = 1008.0
+    enqueue_event(conn, {**EVENT, "aspect_type": "update"}, coalesce_window=10)
+    clock.return_value = 1010.0
+    assert claim_event(conn) is not None
+
+
+def test_coalesce_does_not_merge_into_claimed_event(conn, mocker):
+    clock = mocker.patch("strava.event_queue.time.time", return_value=1000.0)
+    enqueue_event(conn, EVENT, coalesce_window=10)
+    clock.return_value = 1010.0
+    claim_event(conn)
+    enqueue_event(conn, {**EVENT, "aspect_type": "update"}, coalesce_window=10)
+    assert conn.execute("SELECT COUNT(*) FROM webhook_queue").fetchone()[0] == 2
+
+
+def test_coalesce_keeps_other_activities_separate(conn):
+    enqueue_event(conn, EVENT, coalesce_window=10)
+    enqueue_event(conn, {**EVENT, "object_id": 43}, coalesce_window=10)
+    assert conn.execute("SELECT COUNT(*) FROM webhook_queue").fetchone()[0] == 2
+
+
+def test_coalesced_delete_replaces_pending_fetch(conn):
+    enqueue_event(conn, {**EVENT, "aspect_type": "update", "updates": {"title": "x"}}, coalesce_window=10)
+    enqueue_event(conn, {**EVENT, "aspect_type": "delete"}, coalesce_window=10)
+    enqueue_event(conn, {**EVENT, "aspect_type": "update"}, coalesce_window=10)
+    payloads = [row[0] for row in conn.execute("SELECT payload FROM webhook_queue")]
+    assert len(payloads) == 1
+    assert json.loads(payloads[0]) == {**EVENT, "aspect_type": "delete"}
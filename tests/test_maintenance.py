@@ -0,0 +1,40 @@
+import sqlite3
+
+import pytest
+from click.testing import CliRunner
+
+import maintenance
+from strava.db import init_db, upsert_activity
+from tests.conftest import make_activity
+
+
+@pytest.fixture
+def db_path(db_path):
+    init_db(db_path)
+    conn = sqlite3.connect(db_path)
+    upsert_activity(conn, make_activity(1))
+    conn.close()
+    return db_path
+
+
+def invoke(*args):
+    return CliRunner().invoke(maintenance.cli, list(args), catch_exceptions=False)
+
+
+def test_rebuild_aggregates_restores_rollups(db_path):
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.execute("DELETE FROM agg_weekly")
+    result = invoke("rebuild-aggregates", "--db", db_path)
+    assert result.exit_code == 0
+    assert "1 týdenních a 1 měsíčních" in result.output
+    assert conn.execute("SELECT activity_count FROM agg_weekly").fetchone()[0] == 1
+    conn.close()
+
+
+def test_compress_rewrites_rows(db_path):
+    result = invoke("compress", "--db", db_path, "--no-dictionary")
+    assert result.exit_code == 0
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT raw_format FROM activities").fetchone()[0] == "zlib"
+    conn.close()
@@ -0,0 +1,87 @@
+import threading
+import time
+
+import pytest
+from strava.pipeline import run_pipeline
+
+
+def test_items_consumed_in_order():
+    consumed = []
+    stats = run_pipeline([lambda: iter(range(10))], lambda items: consumed.extend(items))
+    assert [item.value for item in consumed] == list(range(10))
+    assert stats.items == 10
+    assert stats.batches >= 1
+
+
+def test_consume_runs_in_calling_thread():
+    threads = set()
+    run_pipeline([lambda: iter(range(3))], lambda items: threads.add(threading.get_ident()))
+    assert threads == {threading.get_ident()}
+
+
+def test_multiple_producers_are_tagged():
+    consumed = []
+    run_pipeline(
+        [lambda: iter("ab"), lambda: iter("cd")],
+        lambda items: consumed.extend((item.source, item.value) for item in items),
+    )
+    assert sorted(consumed) == [(0, "a"), (0, "b"), (1, "c"), (1, "d")]
+
+
+def test_backpressure_limits_prefetch():
+    produced = []
+    max_ahead = 0
+    consumed = 0
+
+    def producer():
+        for i in range(20):
+            produced.append(i)
+            yield i
+
+    def consume(items):
+        nonlocal max_ahead, consumed
+        max_ahead = max(max_ahead, len(produced) - consumed)
+        consumed += len(items)
+        time.sleep(0.005)
+
+    run_pipeline([producer], consume, prefetch=2, max_batch=1)
+    # queue holds 2, one item is in the producer's hand, one just handed over
+    assert max_ahead <= 4
+
+
+def test_producer_error_is_reraised_after_earlier_items():
+    consumed = []
+
+    def producer():
+        yield 1
+        yield 2
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError, match="boom"):
+        run_pipeline([producer], lambda items: consumed.extend(i.value for i in items))
+    assert consumed == [1, 2]
+
+
+def test_consumer_error_stops_producers():
+    def producer():
+        i = 0
+        while True:
+            i += 1
+            yield i
+
+    def consume(items):
+        raise ValueError("disk full")
+
+    with pytest.raises(ValueError):
+        run_pipeline([producer], consume)
+
+
+def test_stats_report_slow_stage():
+    def slow_producer():
+        for i in range(3):
+            time.sleep(0.02)
+            yield i
+
+    stats = run_pipeline([slow_producer], lambda items: None)
+    assert stats.fetch_seconds >= 0.05
+    assert stats.bottleneck == "network"
@@ -0,0 +1,133 @@
+from datetime import date, datetime, timezone
+
+import pytest
+
+from strava.db import upsert_activities
+from strava.query import decode_cursor, encode_cursor, list_activities, monthly_totals, weekly_totals
+from tests.conftest import make_activity
+
+
+@pytest.fixture
+def conn(conn):
+    upsert_activities(
+        conn,
+        [
+            make_activity(1, "2024-01-01T06:00:00Z"),
+            make_activity(2, "2024-01-02T06:00:00Z", "Ride"),
+            make_activity(3, "2024-01-03T06:00:00Z"),
+            make_activity(4, "2024-01-03T06:00:00Z"),  # same start as 3
+            make_activity(5, "2024-01-05T06:00:00Z", "Ride"),
+        ],
+    )
+    return conn
+
+
+def ids(rows):
+    return [row["id"] for row in rows]
+
+
+def test_list_activities_newest_first(conn):
+    assert ids(list_activities(conn)) == [5, 4, 3, 2, 1]
+
+
+def test_list_activities_filters_by_sport_type(conn):
+    assert ids(list_activities(conn, sport_type="Ride")) == [5, 2]
+
+
+def test_list_activities_filters_by_date_range(conn):
+    rows = list_activities(conn, after="2024-01-02", before=date(2024, 1, 5))
+    assert ids(rows) == [4, 3, 2]
+
+
+def test_list_activities_accepts_aware_datetime(conn):
+    after = datetime(2024, 1, 3, 6, 0, tzinfo=timezone.utc)
+    assert ids(list_activities(conn, after=after)) == [5, 4, 3]
+
+
+def test_list_activities_limit(conn):
+    assert ids(list_activities(conn, limit=2)) == [5, 4]
+
+
+def test_list_activities_cursor_continues_after_last_row(conn):
+    first = list(list_activities(conn, limit=2))
+    second = list(list_activities(conn, limit=2, cursor=encode_cursor(first[-1])))
+    assert ids(second) == [3, 2]
+
+
+def test_list_activities_chunks_cover_every_row(conn):
+    assert ids(list_activities(conn, chunk_size=2)) == [5, 4, 3, 2, 1]
+
+
+def test_list_activities_is_lazy(conn):
+    rows = list_activities(conn, chunk_size=1)
+    assert next(rows)["id"] == 5
+
+
+def test_list_activities_omits_raw_json_by_default(conn):
+    row = next(list_activities(conn))
+    assert "raw_json" not in row
+    assert "raw_json" in next(list_activities(conn, include_raw=True))
+
+
+def test_list_activities_filters_by_gear_and_heartrate(conn):
+    upsert_activities(
+        conn,
+        [
+            {**make_activity(6, "2024-01-06T06:00:00Z"), "gear_id": "g1", "average_heartrate": 160.0},
+            {**make_activity(7, "2024-01-07T06:00:00Z"), "gear_id": "g1", "average_heartrate": 130.0},
+        ],
+    )
+    assert ids(list_activities(conn, gear_id="g1")) == [7, 6]
+    assert ids(list_activities(conn, min_average_heartrate=150)) == [6]
+
+
+def test_decode_cursor_rejects_garbage():
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor")
+
+
+def test_cursor_roundtrip():
+    assert decode_cursor(encode_cursor({"id": 7, "start_date": "2024-01-01T00:00:00Z"})) == (
+        "2024-01-01T00:00:00Z",
+        7,
+    )
+
+
+def test_list_activities_uses_index(conn):
+    plan = conn.execute(
+        """
+        EXPLAIN QUERY PLAN
+        SELECT id FROM activities
+        WHERE start_date IS NOT NULL AND sport_type = ? AND (start_date, id) < (?, ?)
+        ORDER BY start_date DESC, id DESC LIMIT 10
+        """,
+        ("Run", "2024-01-03T06:00:00Z", 4),
+    ).fetchall()
+    detail = " ".join(row[3] for row in plan)
+    assert "idx_activities_sport_type_start_date" in detail
+    assert "TEMP B-TREE" not in detail
+
+
+def test_weekly_totals_read_rollup(conn):
+    # 2024-01-01 is a Monday; the fixture's activities fall into one week.
+    assert weekly_totals(conn, sport_type="Run") == [
+        {
+            "week": "2024-01-01",
+            "sport_type": "Run",
+            "activity_count": 3,
+            "distance": 15000.0,
+            "moving_time": 5400,
+            "elapsed_time": 5550,
+            "total_elevation_gain": 60.0,
+        }
+    ]
+    assert [row["sport_type"] for row in weekly_totals(conn, start=date(2024, 1, 3))] == ["Ride", "Run"]
+    assert weekly_totals(conn, end="2024-01-01") == []
+
+
+def test_monthly_totals_read_rollup(conn):
+    rows = monthly_totals(conn, start="2024-01", end="2024-02")
+    assert [(row["month"], row["sport_type"], row["activity_count"]) for row in rows] == [
+        ("2024-01", "Ride", 2),
+        ("2024-01", "Run", 3),
+    ]
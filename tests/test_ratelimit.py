@@ -0,0 +1,113 @@
+from strava.ratelimit import (
+    LONG_WINDOW,
+    SHORT_WINDOW,
+    RateLimiter,
+    parse_rate_limit_headers,
+)
+
+# 2024-03-15 06:05:00 UTC — 5 minutes into a 15-minute window
+NOW = 1710482700.0
+
+
+class FakeClock:
+    def __init__(self, now=NOW):
+        self.now = now
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def make_limiter(clock, db_path=None, reserve=0):
+    return RateLimiter(db_path, reserve=reserve, clock=clock, sleep=clock.sleep)
+
+
+def headers(limit="100,1000", usage="10,50"):
+    return {"X-RateLimit-Limit": limit, "X-RateLimit-Usage": usage}
+
+
+def test_parse_rate_limit_headers():
+    assert parse_rate_limit_headers(headers()) == (100, 1000, 10, 50)
+
+
+def test_parse_rate_limit_headers_missing_or_malformed():
+    assert parse_rate_limit_headers({}) is None
+    assert parse_rate_limit_headers(headers(usage="oops")) is None
+
+
+def test_acquire_counts_usage():
+    limiter = make_limiter(FakeClock())
+    limiter.acquire()
+    limiter.acquire()
+    state = limiter.state()
+    assert state.short_usage == 2
+    assert state.long_usage == 2
+
+
+def test_update_takes_usage_from_headers():
+    limiter = make_limiter(FakeClock())
+    limiter.update(headers())
+    state = limiter.state()
+    assert (state.short_limit, state.long_limit) == (100, 1000)
+    assert (state.short_usage, state.long_usage) == (10, 50)
+
+
+def test_update_does_not_lower_usage_reserved_in_flight():
+    limiter = make_limiter(FakeClock())
+    limiter.update(headers(usage="10,50"))
+    for _ in range(16):
+        limiter.acquire()
+    # A response sent before the other fifteen reports only its own request.
+    limiter.update(headers(usage="11,51"))
+    state = limiter.state()
+    assert (state.short_usage, state.long_usage) == (26, 66)
+
+    limiter.update(headers(usage="30,70"))
+    state = limiter.state()
+    assert (state.short_usage, state.long_usage) == (30, 70)
+
+
+def test_acquire_sleeps_until_short_window_resets():
+    clock = FakeClock()
+    limiter = make_limiter(clock)
+    limiter.update(headers(usage="100,50"))
+    limiter.acquire()
+    assert clock.sleeps == [SHORT_WINDOW - 300]
+    assert limiter.state().short_usage == 1
+
+
+def test_acquire_sleeps_until_daily_window_resets():
+    clock = FakeClock()
+    limiter = make_limiter(clock)
+    limiter.update(headers(usage="10,1000"))
+    limiter.acquire()
+    assert clock.sleeps == [LONG_WINDOW - NOW % LONG_WINDOW]
+
+
+def test_reserve_keeps_margin():
+    clock = FakeClock()
+    limiter = make_limiter(clock, reserve=2)
+    limiter.update(headers(usage="98,50"))
+    assert limiter.reserve_token() > 0
+
+
+def test_exhaust_blocks_short_window():
+    limiter = make_limiter(FakeClock())
+    limiter.exhaust(headers(usage="10,50"))
+    assert limiter.reserve_token() == SHORT_WINDOW - 300
+
+
+def test_budget_shared_through_database(tmp_path):
+    db_path = str(tmp_path / "test.db")
+    clock = FakeClock()
+    first = make_limiter(clock, db_path)
+    second = make_limiter(clock, db_path)
+    first.update(headers(usage="40,400"))
+    second.acquire()
+    assert first.state().short_usage == 41
+    first.close()
+    second.close()
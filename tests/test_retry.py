@@ -0,0 +1,48 @@
+from datetime import datetime, timezone
+
+from strava.retry import RetryCounters, RetryPolicy, parse_retry_after
+
+
+def test_delay_is_full_jitter_exponential():
+    policy = RetryPolicy(backoff_base=1.0, backoff_cap=10.0)
+    assert policy.delay(0, rand=lambda: 1.0) == 1.0
+    assert policy.delay(3, rand=lambda: 1.0) == 8.0
+    assert policy.delay(3, rand=lambda: 0.5) == 4.0
+    assert policy.delay(0, rand=lambda: 0.0) == 0.0
+
+
+def test_delay_is_capped():
+    policy = RetryPolicy(backoff_base=1.0, backoff_cap=10.0)
+    assert policy.delay(20, rand=lambda: 1.0) == 10.0
+
+
+def test_delay_honours_retry_after():
+    policy = RetryPolicy(backoff_base=1.0)
+    assert policy.delay(0, retry_after=30.0, rand=lambda: 1.0) == 30.0
+
+
+def test_parse_retry_after_seconds():
+    assert parse_retry_after("120") == 120.0
+
+
+def test_parse_retry_after_http_date():
+    now = datetime(2024, 3, 15, 6, 0, 0, tzinfo=timezone.utc)
+    assert parse_retry_after("Fri, 15 Mar 2024 06:01:30 GMT", now=now) == 90.0
+    assert parse_retry_after("Fri, 15 Mar 2024 05:00:00 GMT", now=now) == 0.0
+
+
+def test_parse_retry_after_invalid():
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("") is None
+    assert parse_retry_after("soon") is None
+
+
+def test_retry_counters():
+    counters = RetryCounters()
+    counters.record_retry("activity")
+    counters.record_retry("activity")
+    counters.record_give_up("token")
+    assert counters.snapshot() == {
+        "activity": {"retries": 2, "gave_up": 0},
+        "token": {"retries": 0, "gave_up": 1},
+    }
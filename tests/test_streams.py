@@ -0,0 +1,99 @@
+import json
+
+import pytest
+
+from strava.db import (
+    get_activity_ids_without_streams,
+    get_streams,
+    upsert_activity,
+    upsert_streams,
+)
+from strava.streams import decode_stream, decode_stream_numpy, encode_stream
+from tests.conftest import make_activity
+
+N = 1000
+STREAMS = {
+    "time": {"data": list(range(N))},
+    "distance": {"data": [i * 2.7 for i in range(N)]},
+    "latlng": {"data": [[50.0875 + i * 1e-5, 14.4213 - i * 2e-5] for i in range(N)]},
+    "altitude": {"data": [240.0 + (i % 50) / 10 for i in range(N)]},
+    "heartrate": {"data": [120 + i % 40 for i in range(N)]},
+    "watts": {"data": [None if i % 100 == 0 else 200 + i % 30 for i in range(N)]},
+    "cadence": {"data": [85] * N},
+}
+
+
+@pytest.fixture
+def conn(conn):
+    upsert_activity(conn, make_activity(1))
+    return conn
+
+
+@pytest.mark.parametrize("stream_type", ["time", "heartrate", "cadence"])
+def test_integer_streams_roundtrip_exactly(stream_type):
+    values = STREAMS[stream_type]["data"]
+    assert list(decode_stream(encode_stream(stream_type, values))) == values
+
+
+@pytest.mark.parametrize("stream_type", ["distance", "altitude"])
+def test_scaled_streams_roundtrip_to_resolution(stream_type):
+    values = STREAMS[stream_type]["data"]
+    decoded = decode_stream(encode_stream(stream_type, values))
+    assert max(abs(a - b) for a, b in zip(decoded, values)) < 0.051
+
+
+def test_latlng_roundtrip_is_flat_pairs():
+    values = STREAMS["latlng"]["data"]
+    decoded = decode_stream(encode_stream("latlng", values))
+    assert len(decoded) == 2 * N
+    assert decoded[2] == pytest.approx(values[1][0], abs=1e-6)
+    assert decoded[3] == pytest.approx(values[1][1], abs=1e-6)
+
+
+def test_missing_samples_become_zero():
+    assert list(decode_stream(encode_stream("watts", [None, 250, None]))) == [0, 250, 0]
+
+
+def test_large_deltas_fall_back_to_int32():
+    packed = encode_stream("time", [0, 40000])
+    assert packed.typecode == "i"
+    assert list(decode_stream(packed)) == [0, 40000]
+
+
+def test_packed_streams_are_much_smaller_than_json():
+    packed = sum(len(encode_stream(t, s["data"]).data) for t, s in STREAMS.items())
+    assert packed * 2 < len(json.dumps(STREAMS))
+
+
+def test_numpy_decode_matches_array_decode():
+    pytest.importorskip("numpy")
+    for stream_type, stream in STREAMS.items():
+        packed = encode_stream(stream_type, stream["data"])
+        assert list(decode_stream_numpy(packed).ravel()) == pytest.approx(list(decode_stream(packed)))
+    assert decode_stream_numpy(encode_stream("latlng", STREAMS["latlng"]["data"])).shape == (N, 2)
+
+
+def test_upsert_and_get_streams(conn):
+    assert upsert_streams(conn, 1, {**STREAMS, "temp": {"data": [20] * N}}) == len(STREAMS)
+    streams = get_streams(conn, 1)
+    assert set(streams) == set(STREAMS)
+    assert list(streams["heartrate"]) == STREAMS["heartrate"]["data"]
+    assert set(get_streams(conn, 1, types=["time", "watts"])) == {"time", "watts"}
+
+
+def test_upsert_streams_replaces_previous(conn):
+    upsert_streams(conn, 1, STREAMS)
+    upsert_streams(conn, 1, {"time": {"data": [0, 1]}})
+    assert list(get_streams(conn, 1)) == ["time"]
+
+
+def test_get_activity_ids_without_streams(conn):
+    upsert_activity(conn, make_activity(2, "2024-03-16T06:00:00Z"))
+    upsert_streams(conn, 1, STREAMS)
+    assert get_activity_ids_without_streams(conn) == [2]
+
+
+def test_activity_without_streams_is_checked_once(conn):
+    upsert_activity(conn, make_activity(2, "2024-03-16T06:00:00Z"))
+    assert upsert_streams(conn, 2, {}) == 0
+    assert get_activity_ids_without_streams(conn) == [1]
@@ -0,0 +1,239 @@
+import sqlite3
+
+import pytest
+from click.testing import CliRunner
+
+import sync
+from strava.db import get_activity_ids, get_high_water_mark, get_streams
+from tests.conftest import make_activity
+
+ENV = {
+    "STRAVA_CLIENT_ID": "cid",
+    "STRAVA_CLIENT_SECRET": "secret",
+    "STRAVA_ACCESS_TOKEN": "access",
+    "STRAVA_REFRESH_TOKEN": "refresh",
+}
+
+TOKEN_RESPONSE = {"access_token": "fresh", "refresh_token": "refresh", "expires_at": 9999999999}
+
+
+@pytest.fixture
+def api(mocker):
+    mocker.patch("strava.tokens.refresh_access_token", return_value=TOKEN_RESPONSE)
+    mocker.patch("sync.set_client")
+    return mocker.patch("sync.get_activities")
+
+
+def invoke(db_path, *args):
+    return CliRunner().invoke(sync.main, ["--db", db_path, *args], env=ENV, catch_exceptions=False)
+
+
+def test_sync_saves_all_pages(api, db_path, mocker):
+    mocker.patch("sync._PER_PAGE", 2)
+    api.side_effect = [
+        [make_activity(1), make_activity(2)],
+        [make_activity(3)],
+    ]
+    result = invoke(db_path)
+    assert result.exit_code == 0
+    assert "Hotovo: 3 aktivit uloženo, 0 přeskočeno" in result.output
+    assert "úzké hrdlo" in result.output
+    conn = sqlite3.connect(db_path)
+    assert get_activity_ids(conn) == {1, 2, 3}
+
+
+def test_sync_request_error_exits_with_code_1(api, db_path):
+    import requests
+    api.side_effect = requests.exceptions.ConnectionError("reset")
+    result = invoke(db_path)
+    assert result.exit_code == 1
+    assert "Chyba při stahování aktivit" in result.output
+
+
+def test_sync_records_high_water_mark_and_resumes_from_it(api, db_path):
+    api.return_value = [make_activity(1, "2024-03-15T06:00:00Z"), make_activity(2, "2024-03-20T06:00:00Z")]
+    invoke(db_path)
+    assert get_high_water_mark(sqlite3.connect(db_path)) == "2024-03-20T06:00:00Z"
+
+    api.reset_mock(return_value=True)
+    api.return_value = []
+    invoke(db_path)
+    assert api.call_args[1]["after"] == sync._incremental_after("2024-03-20T06:00:00Z", 7)
+
+
+def test_sync_full_ignores_high_water_mark(api, db_path):
+    api.return_value = [make_activity(1)]
+    invoke(db_path)
+    api.return_value = []
+    invoke(db_path, "--full")
+    assert api.call_args[1]["after"] is None
+
+
+def test_sync_skips_existing(api, db_path):
+    api.return_value = [make_activity(1)]
+    invoke(db_path)
+    result = invoke(db_path, "--full")
+    assert "Hotovo: 0 aktivit uloženo, 1 přeskočeno" in result.output
+
+
+def test_split_windows_single_is_open_range():
+    assert sync._split_windows(100, 1) == [(100, None)]
+
+
+def test_split_windows_cover_range_with_overlap():
+    windows = sync._split_windows(1000, 4, now=2000)
+    assert windows == [(1000, 1250), (1249, 1500), (1499, 1750), (1749, None)]
+
+
+def test_parallel_windows_merge_without_duplicates(api, db_path):
+    def fake_get_activities(token, page, per_page, after, before):
+        if page > 1:
+            return []
+        # every window sees activity 1 (boundary overlap) plus one of its own
+        return [make_activity(1), make_activity(1000 + (after or 0) % 997)]
+
+    api.side_effect = fake_get_activities
+    result = invoke(db_path, "--after", "2020-01-01", "--parallel-windows", "3")
+    assert result.exit_code == 0
+    assert api.call_count == 3
+    conn = sqlite3.connect(db_path)
+    assert len(get_activity_ids(conn)) == 4
+    rows = conn.execute("SELECT done, last_page FROM sync_windows").fetchall()
+    assert rows == [(1, 1)] * 3
+
+
+def test_failed_run_is_resumed_from_checkpoint(api, db_path, mocker):
+    import requests
+    mocker.patch("sync._PER_PAGE", 2)
+    api.side_effect = [
+        [make_activity(1), make_activity(2)],
+        requests.exceptions.HTTPError("502 Bad Gateway"),
+    ]
+    result = invoke(db_path, "--after", "2024-01-01")
+    assert result.exit_code == 1
+    assert "--resume" in result.output
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT status FROM sync_runs").fetchone()[0] == "failed"
+
+    api.reset_mock(side_effect=True)
+    api.side_effect = [[make_activity(3, "2024-03-20T06:00:00Z")]]
+    result = invoke(db_path, "--resume")
+    assert result.exit_code == 0
+    assert api.call_count == 1
+    assert api.call_args[1]["page"] == 2
+    assert api.call_args[1]["after"] == 1704067200
+    assert get_activity_ids(conn) == {1, 2, 3}
+    assert conn.execute("SELECT status FROM sync_runs").fetchone()[0] == "completed"
+    assert get_high_water_mark(conn) == "2024-03-20T06:00:00Z"
+
+
+def test_resume_without_interrupted_run_starts_new_one(api, db_path):
+    api.return_value = []
+    result = invoke(db_path, "--resume")
+    assert result.exit_code == 0
+    assert "Žádný přerušený běh" in result.output
+
+
+def test_refresh_existing_reports_new_changed_unchanged(api, db_path):
+    api.return_value = [make_activity(1), make_activity(2)]
+    invoke(db_path)
+    renamed = dict(make_activity(2), name="Renamed")
+    api.return_value = [make_activity(1), renamed, make_activity(3)]
+    result = invoke(db_path, "--full", "--refresh-existing")
+    assert "Hotovo: 1 nových, 1 změněných, 1 beze změny." in result.output
+    from strava.db import get_activity
+    assert get_activity(sqlite3.connect(db_path), 2)["name"] == "Renamed"
+
+
+def test_refresh_existing_run_checkpoints_and_resumes_in_refresh_mode(api, db_path, mocker):
+    import requests
+    mocker.patch("sync._PER_PAGE", 2)
+    api.side_effect = [[make_activity(1), make_activity(2)], []]
+    invoke(db_path)
+    api.side_effect = [
+        [make_activity(1), dict(make_activity(2), name="Renamed")],
+        requests.exceptions.HTTPError("502 Bad Gateway"),
+    ]
+    assert invoke(db_path, "--full", "--refresh-existing").exit_code == 1
+    conn = sqlite3.connect(db_path)
+    failed = conn.execute("SELECT run_id FROM sync_runs WHERE status = 'failed'").fetchone()[0]
+    window = conn.execute("SELECT done, last_page FROM sync_windows WHERE run_id = ?", (failed,))
+    assert window.fetchone() == (0, 1)
+
+    api.reset_mock(side_effect=True)
+    api.side_effect = [[dict(make_activity(3), name="Renamed 3")]]
+    result = invoke(db_path, "--resume")
+    assert result.exit_code == 0
+    assert api.call_args[1]["page"] == 2
+    assert "Hotovo: 1 nových, 0 změněných, 0 beze změny." in result.output
+
+
+def test_streams_flag_stores_streams_and_skips_manual_activities(api, db_path, mocker):
+    import requests
+
+    api.side_effect = [[make_activity(1), make_activity(2)], []]
+    not_found = requests.exceptions.HTTPError(response=mocker.Mock(status_code=404))
+    fetch = mocker.patch(
+        "sync.get_activity_streams",
+        side_effect=lambda token, activity_id: (
+            {"time": {"data": [0, 1, 2]}} if activity_id == 1 else (_ for _ in ()).throw(not_found)
+        ),
+    )
+    result = invoke(db_path, "--streams")
+    assert result.exit_code == 0
+    assert "Streamy staženy: 1." in result.output
+    conn = sqlite3.connect(db_path)
+    assert list(get_streams(conn, 1)["time"]) == [0, 1, 2]
+
+    fetch.reset_mock()
+    api.side_effect = [[]]
+    assert invoke(db_path, "--streams").exit_code == 0
+    fetch.assert_not_called()
+
+
+def test_details_flag_marks_missing_activities_and_keeps_the_rest(api, db_path, mocker):
+    aiohttp = pytest.importorskip("aiohttp")
+
+    async def get_activity(self, token, activity_id):
+        if activity_id == 2:
+            raise aiohttp.ClientResponseError(mocker.Mock(), (), status=404)
+        return make_activity(activity_id, resource_state=3)
+
+    mocker.patch("strava.aio.AsyncStravaClient.get_activity", get_activity)
+    api.side_effect = [[make_activity(i, resource_state=2) for i in (1, 2, 3)], []]
+    result = invoke(db_path, "--details")
+    assert result.exit_code == 0
+    assert "Detaily staženy: 2, nedostupné (404): 1." in result.output
+
+    api.side_effect = [[]]
+    result = invoke(db_path, "--details")
+    assert "Stahuju detaily 0 aktivit..." in result.output
+
+
+def test_all_athletes_mode_syncs_registered_athletes(db_path, mocker):
+    from strava.athletes import AthleteSyncResult
+
+    mocker.patch("sync.set_client")
+    run = mocker.patch("sync.sync_all_athletes", return_value=[AthleteSyncResult(1, saved=3)])
+    result = invoke(db_path, "--all-athletes", "--workers", "3")
+    assert result.exit_code == 0
+    assert "Sportovec 1: 3 aktivit uloženo" in result.output
+    assert run.call_args.kwargs["workers"] == 3
+
+
+@pytest.mark.parametrize(
+    "flags",
+    [
+        ["--resume"],
+        ["--details"],
+        ["--streams"],
+        ["--fast-writes"],
+        ["--prefetch", "8"],
+    ],
+)
+def test_all_athletes_rejects_single_athlete_flags(db_path, mocker, flags):
+    run = mocker.patch("sync.sync_all_athletes")
+    result = CliRunner().invoke(sync.main, ["--db", db_path, "--all-athletes", *flags], env=ENV)
+    assert result.exit_code == 2
+    assert "--all-athletes cannot be combined" in result.output
+    run.assert_not_called()
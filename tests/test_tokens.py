@@ -0,0 +1,147 @@
+import threading
+
+import pytest
+import requests
+
+from strava.db import init_db
+from strava.tokens import TokenManager
+
+NOW = 1_700_000_000
+
+
+@pytest.fixture
+def db_path(db_path):
+    init_db(db_path)
+    return db_path
+
+
+@pytest.fixture
+def refresh(mocker):
+    counter = iter(range(1, 100))
+
+    def fake_refresh(client_id, client_secret, refresh_token):
+        n = next(counter)
+        return {"access_token": f"access-{n}", "refresh_token": f"refresh-{n}", "expires_at": NOW + 21600}
+
+    return mocker.patch("strava.tokens.refresh_access_token", side_effect=fake_refresh)
+
+
+@pytest.fixture
+def tokens(db_path):
+    manager = TokenManager(db_path, "cid", "secret", clock=lambda: NOW)
+    yield manager
+    manager.close()
+
+
+def unauthorized():
+    response = requests.Response()
+    response.status_code = 401
+    return requests.HTTPError("401 Unauthorized", response=response)
+
+
+def test_fresh_token_is_returned_without_refresh(tokens, refresh):
+    tokens.seed("env-access", "env-refresh", expires_at=NOW + 3600)
+    assert tokens.access_token() == "env-access"
+    refresh.assert_not_called()
+
+
+def test_token_near_expiry_is_refreshed_and_persisted(tokens, refresh):
+    tokens.seed("env-access", "env-refresh", expires_at=NOW + 60)
+    assert tokens.access_token() == "access-1"
+    refresh.assert_called_once_with("cid", "secret", "env-refresh")
+    stored = tokens.stored()
+    assert stored.refresh_token == "refresh-1"
+    assert stored.expires_at == NOW + 21600
+
+
+def test_rotated_refresh_token_is_used_next_time(tokens, refresh):
+    tokens.seed("env-access", "env-refresh")
+    tokens.access_token()
+    tokens.refresh(rejected_token="access-1")
+    assert refresh.call_args.args[2] == "refresh-1"
+
+
+def test_seed_keeps_rotated_tokens_from_same_env(tokens, refresh):
+    tokens.seed("env-access", "env-refresh")
+    tokens.access_token()
+    tokens.seed("env-access", "env-refresh")
+    assert tokens.stored().access_token == "access-1"
+
+
+def test_seed_replaces_tokens_after_reauthorisation(tokens, refresh):
+    tokens.seed("env-access", "env-refresh")
+    tokens.access_token()
+    tokens.seed("new-access", "new-refresh", expires_at=NOW + 3600)
+    assert tokens.access_token() == "new-access"
+
+
+def test_access_token_without_seed_raises(tokens):
+    with pytest.raises(LookupError):
+        tokens.access_token()
+
+
+def test_second_manager_reuses_refreshed_token(db_path, tokens, refresh):
+    tokens.seed("env-access", "env-refresh")
+    tokens.access_token()
+    other = TokenManager(db_path, "cid", "secret", clock=lambda: NOW)
+    assert other.access_token() == "access-1"
+    other.close()
+    assert refresh.call_count == 1
+
+
+def test_concurrent_refresh_calls_oauth_once(db_path, tokens, refresh):
+    tokens.seed("env-access", "env-refresh")
+    managers = [TokenManager(db_path, "cid", "secret", clock=lambda: NOW) for _ in range(4)]
+    results = []
+    threads = [threading.Thread(target=lambda m=m: results.append(m.access_token())) for m in managers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for manager in managers:
+        manager.close()
+    assert results == ["access-1"] * 4
+    assert refresh.call_count == 1
+
+
+def test_call_retries_once_on_401(tokens, refresh):
+    tokens.seed("env-access", "env-refresh", expires_at=NOW + 3600)
+    seen = []
+
+    def fn(token):
+        seen.append(token)
+        if token == "env-access":
+            raise unauthorized()
+        return "ok"
+
+    assert tokens.call(fn) == "ok"
+    assert seen == ["env-access", "access-1"]
+
+
+def test_call_gives_up_after_second_401(tokens, refresh):
+    tokens.seed("env-access", "env-refresh", expires_at=NOW + 3600)
+
+    def fn(token):
+        raise unauthorized()
+
+    with pytest.raises(requests.HTTPError):
+        tokens.call(fn)
+    assert refresh.call_count == 1
+
+
+def test_call_does_not_refresh_on_other_errors(tokens, refresh):
+    tokens.seed("env-access", "env-refresh", expires_at=NOW + 3600)
+
+    def fn(token):
+        raise requests.ConnectionError("down")
+
+    with pytest.raises(requests.ConnectionError):
+        tokens.call(fn)
+    refresh.assert_not_called()
+
+
+def test_refresh_skipped_when_rejected_token_already_replaced(tokens, refresh):
+    tokens.seed("env-access", "env-refresh")
+    tokens.access_token()
+    assert tokens.refresh(rejected_token="env-access") == "access-1"
+    assert refresh.call_count == 1
@@ -1,7 +1,7 @@
 import sqlite3
 import pytest
 from unittest.mock import MagicMock, patch
-from strava.webhook import handle_verify, handle_event
+from strava.webhook import accept_event, handle_verify, handle_event, prune_deliveries, record_delivery
 
 VERIFY_TOKEN = "mysecrettoken"
 
@@ -47,6 +47,22 @@ def conn(tmp_path):
     c.close()
 
 
+@pytest.fixture
+def tokens(tmp_path, conn):
+    from strava.tokens import TokenManager
+    manager = TokenManager(str(tmp_path / "test.db"), "cid", "secret")
+    manager.seed("token123", "refresh", expires_at=10**10)
+    yield manager
+    manager.close()
+
+
+@pytest.fixture
+def streams(mocker):
+    return mocker.patch(
+        "strava.webhook.get_activity_streams", return_value={"time": {"data": [0, 1, 2]}}
+    )
+
+
 CREATE_EVENT = {
     "object_type": "activity",
     "aspect_type": "create",
@@ -69,41 +85,155 @@ ACTIVITY_DATA = {
 }
 
 
-def test_handle_event_create_calls_get_activity(mocker, conn):
+def test_handle_event_create_calls_get_activity(mocker, conn, tokens, streams):
     mock_get = mocker.patch("strava.webhook.get_activity", return_value=ACTIVITY_DATA)
-    result = handle_event(CREATE_EVENT, "token123", conn)
+    result = handle_event(CREATE_EVENT, tokens, conn)
     mock_get.assert_called_once_with("token123", 42)
     assert result == "saved"
 
 
-def test_handle_event_create_saves_to_db(mocker, conn):
+def test_handle_event_create_saves_to_db(mocker, conn, tokens, streams):
     mocker.patch("strava.webhook.get_activity", return_value=ACTIVITY_DATA)
-    handle_event(CREATE_EVENT, "token123", conn)
+    handle_event(CREATE_EVENT, tokens, conn)
     from strava.db import get_activity
     saved = get_activity(conn, 42)
     assert saved is not None
     assert saved["name"] == "Morning Run"
 
 
-def test_handle_event_ignores_update(mocker, conn):
-    mock_get = mocker.patch("strava.webhook.get_activity", return_value=ACTIVITY_DATA)
-    event = {**CREATE_EVENT, "aspect_type": "update"}
-    result = handle_event(event, "token123", conn)
-    mock_get.assert_not_called()
-    assert result == "ignored"
+def test_handle_event_create_stores_streams(mocker, conn, tokens, streams):
+    from strava.db import get_streams
+    mocker.patch("strava.webhook.get_activity", return_value=ACTIVITY_DATA)
+    handle_event(CREATE_EVENT, tokens, conn)
+    streams.assert_called_once_with("token123", 42)
+    assert list(get_streams(conn, 42)["time"]) == [0, 1, 2]
 
 
-def test_handle_event_ignores_delete(mocker, conn):
+def test_handle_event_create_of_manual_activity_stores_no_streams(mocker, conn, tokens):
+    import requests
+    from strava.db import get_activity_ids_without_streams
+    mocker.patch("strava.webhook.get_activity", return_value=ACTIVITY_DATA)
+    not_found = requests.exceptions.HTTPError(response=mocker.Mock(status_code=404))
+    mocker.patch("strava.webhook.get_activity_streams", side_effect=not_found)
+    assert handle_event(CREATE_EVENT, tokens, conn) == "saved"
+    assert get_activity_ids_without_streams(conn) == []
+
+
+def test_handle_event_update_refetches_activity(mocker, conn, tokens, streams):
     mock_get = mocker.patch("strava.webhook.get_activity", return_value=ACTIVITY_DATA)
-    event = {**CREATE_EVENT, "aspect_type": "delete"}
-    result = handle_event(event, "token123", conn)
+    event = {**CREATE_EVENT, "aspect_type": "update", "updates": {"title": "Evening Run"}}
+    result = handle_event(event, tokens, conn)
+    mock_get.assert_called_once_with("token123", 42)
+    streams.assert_not_called()
+    assert result == "saved"
+
+
+def test_handle_event_delete_removes_activity_without_fetch(mocker, conn, tokens):
+    from strava.db import get_activity, upsert_activity, upsert_streams
+
+    upsert_activity(conn, ACTIVITY_DATA)
+    upsert_streams(conn, 42, {"time": {"data": [0, 1, 2]}})
+    mock_get = mocker.patch("strava.webhook.get_activity")
+    result = handle_event({**CREATE_EVENT, "aspect_type": "delete"}, tokens, conn)
     mock_get.assert_not_called()
-    assert result == "ignored"
+    assert result == "deleted"
+    assert get_activity(conn, 42) is None
+    assert conn.execute("SELECT COUNT(*) FROM streams").fetchone()[0] == 0
+    assert conn.execute("SELECT COUNT(*) FROM agg_weekly").fetchone()[0] == 0
+
+
+def test_handle_event_deauthorization_purges_athlete(mocker, conn, tokens):
+    from strava.db import get_activity_ids, upsert_activities
+
+    upsert_activities(
+        conn,
+        [
+            {**ACTIVITY_DATA, "id": 1, "athlete": {"id": 7}},
+            {**ACTIVITY_DATA, "id": 2, "athlete": {"id": 7}},
+            {**ACTIVITY_DATA, "id": 3, "athlete": {"id": 8}},
+        ],
+    )
+    mock_get = mocker.patch("strava.webhook.get_activity")
+    event = {
+        "object_type": "athlete",
+        "aspect_type": "update",
+        "object_id": 7,
+        "owner_id": 7,
+        "updates": {"authorized": "false"},
+    }
+    assert handle_event(event, tokens, conn) == "deauthorized"
+    mock_get.assert_not_called()
+    assert get_activity_ids(conn) == {3}
+
+
+def test_handle_event_deauthorization_purges_without_token_refresh(mocker, tmp_path, conn):
+    from strava.db import get_activity_ids, upsert_activities
+    from strava.tokens import TokenManager
+
+    upsert_activities(conn, [{**ACTIVITY_DATA, "id": 1, "athlete": {"id": 7}}])
+    refresh = mocker.patch(
+        "strava.tokens.refresh_access_token", side_effect=RuntimeError("invalid refresh token")
+    )
+    expired = TokenManager(str(tmp_path / "test.db"), "cid", "secret")
+    expired.seed("revoked", "revoked", expires_at=0)
+    event = {
+        "object_type": "athlete",
+        "aspect_type": "update",
+        "object_id": 7,
+        "updates": {"authorized": "false"},
+    }
+    assert handle_event(event, expired, conn) == "deauthorized"
+    assert handle_event({**CREATE_EVENT, "aspect_type": "delete"}, expired, conn) == "deleted"
+    refresh.assert_not_called()
+    assert get_activity_ids(conn) == set()
+    expired.close()
 
 
-def test_handle_event_ignores_athlete_object_type(mocker, conn):
+def test_handle_event_ignores_athlete_object_type(mocker, conn, tokens):
     mock_get = mocker.patch("strava.webhook.get_activity", return_value=ACTIVITY_DATA)
     event = {**CREATE_EVENT, "object_type": "athlete"}
-    result = handle_event(event, "token123", conn)
+    result = handle_event(event, tokens, conn)
     mock_get.assert_not_called()
     assert result == "ignored"
+
+
+# --- delivery deduplication ---
+
+DELIVERY = {**CREATE_EVENT, "subscription_id": 7, "event_time": 1710482400}
+
+
+def test_record_delivery_detects_duplicate(conn):
+    assert record_delivery(conn, DELIVERY) is True
+    assert record_delivery(conn, DELIVERY) is False
+
+
+def test_record_delivery_distinguishes_aspect_and_time(conn):
+    assert record_delivery(conn, DELIVERY) is True
+    assert record_delivery(conn, {**DELIVERY, "aspect_type": "update"}) is True
+    assert record_delivery(conn, {**DELIVERY, "event_time": 1710482401}) is True
+
+
+def test_record_delivery_without_key_fields_is_always_new(conn):
+    assert record_delivery(conn, CREATE_EVENT) is True
+    assert record_delivery(conn, CREATE_EVENT) is True
+
+
+def test_accept_event_queues_once(conn):
+    assert accept_event(conn, DELIVERY) == "queued"
+    assert accept_event(conn, DELIVERY) == "duplicate"
+    assert conn.execute("SELECT COUNT(*) FROM webhook_queue").fetchone()[0] == 1
+
+
+def test_accept_event_duplicate_makes_no_api_call(mocker, conn):
+    mock_get = mocker.patch("strava.webhook.get_activity")
+    accept_event(conn, DELIVERY)
+    accept_event(conn, DELIVERY)
+    mock_get.assert_not_called()
+
+
+def test_prune_deliveries_removes_expired_keys(conn):
+    record_delivery(conn, DELIVERY, now=0)
+    record_delivery(conn, {**DELIVERY, "event_time": 1}, now=10**10)
+    conn.commit()
+    assert prune_deliveries(conn, ttl=3600) == 1
+    assert record_delivery(conn, DELIVERY) is True
@@ -0,0 +1,92 @@
+import pytest
+
+import webhook_server
+from strava.db import ConnectionPool, init_db
+from strava.tokens import TokenManager
+
+EVENT = {
+    "object_type": "activity",
+    "aspect_type": "create",
+    "object_id": 42,
+    "owner_id": 1,
+    "subscription_id": 7,
+    "event_time": 1710482400,
+}
+
+
+@pytest.fixture
+def pool(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "test.db")
+    init_db(db_path)
+    pool = ConnectionPool(db_path)
+    monkeypatch.setattr(webhook_server, "_pool", pool)
+    monkeypatch.setattr(webhook_server, "_workers", None)
+    monkeypatch.setattr(webhook_server, "_db_path", db_path)
+    monkeypatch.setattr(webhook_server, "_athlete_tokens", {})
+    yield pool
+    pool.close()
+
+
+@pytest.fixture
+def client(pool):
+    return webhook_server.app.test_client()
+
+
+def test_post_webhook_queues_event(client, pool):
+    resp = client.post("/webhook", json=EVENT)
+    assert resp.get_json() == {"status": "queued"}
+    with pool.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM webhook_queue").fetchone()[0] == 1
+
+
+def test_post_webhook_reports_duplicate(client):
+    client.post("/webhook", json=EVENT)
+    resp = client.post("/webhook", json=EVENT)
+    assert resp.get_json() == {"status": "duplicate"}
+
+
+def test_process_queued_event_uses_shared_token(mocker, pool, monkeypatch):
+    tokens = TokenManager(pool.db_path, "cid", "secret")
+    tokens.seed("shared-token", "refresh", expires_at=10**10)
+    monkeypatch.setattr(webhook_server, "_tokens", tokens)
+    get = mocker.patch("strava.webhook.get_activity", side_effect=RuntimeError("stop"))
+    with pool.connection() as conn:
+        with pytest.raises(RuntimeError):
+            webhook_server.process_queued_event(EVENT, conn)
+    get.assert_called_once_with("shared-token", 42)
+    tokens.close()
+
+
+def test_process_queued_event_uses_registered_athletes_token(mocker, pool, monkeypatch):
+    monkeypatch.setenv("STRAVA_CLIENT_ID", "cid")
+    monkeypatch.setenv("STRAVA_CLIENT_SECRET", "secret")
+    shared = TokenManager(pool.db_path, "cid", "secret")
+    shared.seed("shared-token", "refresh", expires_at=10**10)
+    monkeypatch.setattr(webhook_server, "_tokens", shared)
+    athlete = TokenManager(pool.db_path, "cid", "secret", account="athlete:1")
+    athlete.seed("athlete-token", "athlete-refresh", expires_at=10**10)
+    athlete.close()
+    get = mocker.patch("strava.webhook.get_activity", side_effect=RuntimeError("stop"))
+    with pool.connection() as conn:
+        with conn:
+            conn.execute("INSERT INTO athletes (athlete_id, account) VALUES (1, 'athlete:1')")
+        for event in (EVENT, {**EVENT, "owner_id": 2}):
+            with pytest.raises(RuntimeError):
+                webhook_server.process_queued_event(event, conn)
+    assert [c.args[0] for c in get.call_args_list] == ["athlete-token", "shared-token"]
+    for tokens in webhook_server._athlete_tokens.values():
+        tokens.close()
+    shared.close()
+
+
+def test_process_queued_event_deauthorizes_when_token_refresh_fails(mocker, pool, monkeypatch):
+    tokens = TokenManager(pool.db_path, "cid", "secret")
+    tokens.seed("revoked", "revoked", expires_at=0)
+    monkeypatch.setattr(webhook_server, "_tokens", tokens)
+    mocker.patch("strava.tokens.refresh_access_token", side_effect=RuntimeError("invalid refresh token"))
+    purge = mocker.patch("strava.webhook.purge_athlete", return_value=0)
+    event = {"object_type": "athlete", "aspect_type": "update", "object_id": 1, "updates": {"authorized": "false"}}
+    with pool.connection() as conn:
+        webhook_server.process_queued_event(event, conn)
+        purge.assert_called_once_with(conn, 1)
+    tokens.close()
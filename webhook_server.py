@@ -7,41 +7,36 @@ import time
 import click
 from flask import Flask, request, jsonify, abort
 
-from strava.client import refresh_access_token
-from strava.db import init_db
-from strava.webhook import handle_verify, handle_event
+from strava.athletes import athlete_account
+from strava.client import StravaClient, get_client, set_client
+from strava.db import ConnectionPool, init_db
+from strava.event_queue import WorkerPool
+from strava.ratelimit import RateLimiter
+from strava.tokens import TokenManager
+from strava.webhook import accept_event, handle_event, handle_verify, prune_deliveries
 
 app = Flask(__name__)
 
 _db_path: str = ""
-_access_token: str = ""
-_token_lock = threading.Lock()
+_pool: ConnectionPool | None = None
+_workers: WorkerPool | None = None
+_tokens: TokenManager | None = None
+_athlete_tokens: dict[str, TokenManager] = {}
+_athlete_tokens_lock = threading.Lock()
+_coalesce_window: float = 0.0
 
-_REFRESH_INTERVAL = 5 * 3600  # 5 hours; Strava tokens expire after 6
+_PRUNE_INTERVAL = 3600
 
 
-def _token_refresh_loop(client_id: str, client_secret: str, refresh_token: str) -> None:
-    """Background daemon: refresh the Strava access token every 5 hours."""
+def _prune_loop() -> None:
+    """Background daemon: forget expired webhook delivery keys once an hour."""
     while True:
-        time.sleep(_REFRESH_INTERVAL)
+        time.sleep(_PRUNE_INTERVAL)
         try:
-            tokens = refresh_access_token(client_id, client_secret, refresh_token)
-            with _token_lock:
-                global _access_token
-                _access_token = tokens["access_token"]
+            with _pool.connection() as conn:
+                prune_deliveries(conn)
         except Exception as e:
-            print(f"[token-refresh] failed: {e}", flush=True)
-
-
-def get_conn() -> sqlite3.Connection:
-    """Open and return a new SQLite connection to the configured database.
-
-    Returns:
-        SQLite connection with row_factory set to sqlite3.Row.
-    """
-    conn = sqlite3.connect(_db_path)
-    conn.row_factory = sqlite3.Row
-    return conn
+            print(f"[delivery-prune] failed: {e}", flush=True)
 
 
 @app.route("/webhook", methods=["GET"])
@@ -62,41 +57,180 @@ def webhook_verify():
 def webhook_event():
     """Handle an incoming Strava webhook event (POST /webhook).
 
-    Parses the JSON body, delegates to handle_event, and returns a JSON status
-    response indicating whether the event was saved or ignored.
+    Appends the event to the durable queue and answers immediately, well
+    within Strava's 2-second deadline; background workers fetch and store the
+    activity later. Redeliveries of an already received event are answered
+    with ``"duplicate"`` and not queued again.
     """
     event = request.get_json(force=True)
-    with _token_lock:
-        access_token = _access_token
-    conn = get_conn()
-    try:
-        status = handle_event(event, access_token, conn)
-    finally:
-        conn.close()
+    with _pool.connection() as conn:
+        status = accept_event(conn, event, _coalesce_window)
+    if status == "queued" and _workers is not None:
+        _workers.notify()
     return jsonify({"status": status})
 
 
+def process_queued_event(event: dict, conn: sqlite3.Connection) -> None:
+    """Worker handler: process one queued event; a token is only resolved if the event needs a fetch."""
+    handle_event(event, _tokens_for(event, conn), conn)
+
+
+def _tokens_for(event: dict, conn: sqlite3.Connection) -> TokenManager:
+    """Return the token manager of the event's athlete, or the shared ``default`` one.
+
+    Athletes registered with ``maintenance.py add-athlete`` have their own
+    tokens (account ``athlete:<id>``); events of anyone else use the tokens
+    the server was started with.
+    """
+    owner_id = event.get("owner_id")
+    registered = owner_id is not None and conn.execute(
+        "SELECT 1 FROM athletes WHERE athlete_id = ?", (owner_id,)
+    ).fetchone()
+    if not registered:
+        return _tokens
+    account = athlete_account(owner_id)
+    with _athlete_tokens_lock:
+        tokens = _athlete_tokens.get(account)
+        if tokens is None:
+            tokens = _athlete_tokens[account] = _token_manager(_db_path, account)
+    return tokens
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Expose per-endpoint Strava API retry counters as JSON (GET /metrics)."""
+    return jsonify({"strava_api_retries": get_client().retry_metrics()})
+
+
+def _token_manager(db: str, account: str = "default") -> TokenManager:
+    return TokenManager(
+        db, os.environ["STRAVA_CLIENT_ID"], os.environ["STRAVA_CLIENT_SECRET"], account=account
+    )
+
+
+def _start_process(db: str, queue_workers: int, coalesce_window: float) -> None:
+    """Set up the per-process state: connection pool, API client and background threads.
+
+    Runs once in every serving process. Under gunicorn that is after the fork,
+    because threads and SQLite connections must not cross a fork.
+    """
+    global _db_path, _pool, _workers, _coalesce_window, _tokens
+    _db_path = db
+    _coalesce_window = coalesce_window
+    _pool = ConnectionPool(db)
+    _tokens = _token_manager(db)
+    set_client(StravaClient(rate_limiter=RateLimiter(db)))
+    threading.Thread(target=_prune_loop, daemon=True).start()
+    _workers = WorkerPool(db, process_queued_event, workers=queue_workers)
+    _workers.start()
+
+
+def _stop_process() -> None:
+    if _workers is not None:
+        _workers.stop(timeout=5)
+    if _pool is not None:
+        _pool.close()
+    if _tokens is not None:
+        _tokens.close()
+    with _athlete_tokens_lock:
+        for tokens in _athlete_tokens.values():
+            tokens.close()
+        _athlete_tokens.clear()
+
+
+def _serve_gunicorn(port: int, workers: int, threads: int, post_fork) -> None:
+    from gunicorn.app.base import BaseApplication
+
+    class _Application(BaseApplication):
+        def load_config(self) -> None:
+            self.cfg.set("bind", f"0.0.0.0:{port}")
+            self.cfg.set("workers", workers)
+            self.cfg.set("threads", threads)
+            self.cfg.set("worker_class", "gthread")
+            self.cfg.set("post_fork", lambda server, worker: post_fork())
+            self.cfg.set("worker_exit", lambda server, worker: _stop_process())
+
+        def load(self):
+            return app
+
+    _Application().run()
+
+
 @click.command()
 @click.option("--db", default="strava.db", show_default=True, help="Path to SQLite database")
 @click.option("--port", default=8080, show_default=True, help="Port to listen on")
-def main(db: str, port: int) -> None:
-    """Initialise the database, start the token refresh thread, and run the Flask server."""
-    global _db_path, _access_token
-    _db_path = db
-    _access_token = os.environ["STRAVA_ACCESS_TOKEN"]
-    client_id = os.environ["STRAVA_CLIENT_ID"]
-    client_secret = os.environ["STRAVA_CLIENT_SECRET"]
-    refresh_token = os.environ["STRAVA_REFRESH_TOKEN"]
-
-    t = threading.Thread(
-        target=_token_refresh_loop,
-        args=(client_id, client_secret, refresh_token),
-        daemon=True,
-    )
-    t.start()
-
+@click.option(
+    "--queue-workers",
+    default=2,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of background threads processing queued webhook events",
+)
+@click.option(
+    "--coalesce-window",
+    default=10.0,
+    show_default=True,
+    type=click.FloatRange(min=0),
+    help="Seconds to wait for further create/update events of the same activity before fetching it once",
+)
+@click.option(
+    "--workers",
+    default=1,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Serve with gunicorn using this many processes (requires gunicorn)",
+)
+@click.option(
+    "--threads",
+    default=None,
+    type=click.IntRange(min=1),
+    help="Request threads per process; serves with waitress when --workers is 1 (requires waitress)",
+)
+def main(
+    db: str,
+    port: int,
+    queue_workers: int,
+    coalesce_window: float,
+    workers: int,
+    threads: int | None,
+) -> None:
+    """Initialise the database and run the webhook server.
+
+    Without --workers/--threads, Flask's development server is used. With
+    --threads the app is served by waitress in one process; with --workers
+    > 1 by gunicorn, each process having --threads request threads (default 4)
+    and its own queue workers.
+    """
     init_db(db)
-    app.run(host="0.0.0.0", port=port)
+    tokens = _token_manager(db)
+    tokens.seed(os.environ["STRAVA_ACCESS_TOKEN"], os.environ["STRAVA_REFRESH_TOKEN"])
+    tokens.close()
+
+    if workers > 1:
+        try:
+            import gunicorn  # noqa: F401
+        except ImportError:
+            raise click.ClickException("--workers vyžaduje gunicorn: pip install 'strava-connector[server]'")
+        _serve_gunicorn(
+            port,
+            workers,
+            threads or 4,
+            lambda: _start_process(db, queue_workers, coalesce_window),
+        )
+        return
+
+    _start_process(db, queue_workers, coalesce_window)
+    try:
+        if threads:
+            try:
+                from waitress import serve
+            except ImportError:
+                raise click.ClickException("--threads vyžaduje waitress: pip install 'strava-connector[server]'")
+            serve(app, host="0.0.0.0", port=port, threads=threads)
+        else:
+            app.run(host="0.0.0.0", port=port)
+    finally:
+        _stop_process()
 
 
 if __name__ == "__main__":